@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Benchmark suite on a synthetic fleet: config scans, edits, log search and API throughput.
+
+Builds a throwaway fleet in a temp dir and points cli at it:
+
+  * N users, served by a fake passwd in place of ``pwd.getpwall()``, each
+    with a home dir whose ~/.ssh/config has M Host blocks
+  * a jump_servers.conf with K registered servers
+  * an ssh_login.log with L connect/jump/disconnect lines
+
+then times get_ssh_users (cold and cached), remove_host_block,
+delete-server-all, configure_users_for_server, login-logs searches and
+Flask test-client requests/sec on /key, /download and /connect.
+
+    python3 bench/fleet.py --users 5000 --hosts 40 --servers 2000 --log-lines 2000000 --json before.json
+    python3 bench/fleet.py ... --json after.json --compare before.json
+
+Run it as root or as a regular (uid > 1000) user; nothing outside the temp
+dir is touched.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import pwd
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cli  # noqa: E402
+from click.testing import CliRunner  # noqa: E402
+
+
+def _server(i: int) -> dict:
+    return {"name": f"srv{i:05d}", "ip": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", "port": 22, "description": f"Server {i}"}
+
+
+def build_fleet(root: Path, users: int, hosts: int, servers: int, log_lines: int, seed: int) -> dict:
+    """Write the fleet under *root* and point cli's paths and passwd lookups at it."""
+    rng = random.Random(seed)
+    uid, gid = os.getuid(), os.getgid()
+    fleet = [_server(i) for i in range(servers)]
+    blocks = [cli._host_block(s["name"], s["ip"], s["port"], s["description"]) for s in fleet]
+
+    entries = []
+    root.chmod(0o755)  # scans read each config with its owner's permissions
+    for i in range(users):
+        home = root / "home" / f"user{i:05d}"
+        (home / ".ssh").mkdir(parents=True)
+        picked = rng.sample(range(servers), min(hosts, servers))
+        (home / ".ssh" / "config").write_text("".join(blocks[j] for j in picked))
+        # Login users need uid > 1000; root can chown to made-up ones.
+        user_uid = uid if uid > 1000 else 1001 + i
+        for path in (home, home / ".ssh", home / ".ssh" / "config"):
+            os.chown(path, user_uid, gid)
+        entries.append(pwd.struct_passwd((f"user{i:05d}", "x", user_uid, gid, "", str(home), "/bin/bash")))
+    by_name = {e.pw_name: e for e in entries}
+
+    def getpwnam(name: str) -> pwd.struct_passwd:
+        if name in by_name:
+            return by_name[name]
+        raise KeyError(f"getpwnam(): name not found: '{name}'")
+
+    cli.pwd = types.SimpleNamespace(
+        getpwall=lambda: entries,
+        getpwnam=getpwnam,
+        getpwuid=pwd.getpwuid,
+        struct_passwd=pwd.struct_passwd,
+    )
+
+    cli.SERVERS_CONF = root / "jump_servers.conf"
+    cli.SERVERS_LOCK = root / ".jump_servers.lock"
+    cli.ACCESS_INDEX_FILE = root / ".kangaroo_index.json"
+    cli.TOKEN_FILE = root / ".kangaroo_token"
+    cli.KANGAROO_KEY = root / "kangaroo_key_id_rsa"
+    cli.LOGIN_LOG = root / "logs" / "ssh_login.log"
+    cli.LOGIN_LOG_MANIFEST = cli.LOGIN_LOG.with_name("ssh_login.manifest.json")
+    cli.USE_DAEMON = False
+    cli.KANGAROO_KEY.write_bytes(os.urandom(3243))
+    Path(f"{cli.KANGAROO_KEY}.pub").write_text("ssh-ed25519 AAAAbenchmark kangaroo@bench\n")
+    cli.register_servers(fleet)
+
+    start = datetime(2026, 1, 1)
+    step = max(1, 90 * 86400 // max(log_lines, 1))  # spread over ~90 days
+    cli.LOGIN_LOG.parent.mkdir(parents=True)
+    with open(cli.LOGIN_LOG, "w") as f:
+        chunk = []
+        for n in range(log_lines):
+            user = f"user{rng.randrange(users):05d}"
+            ip = f"203.0.113.{rng.randrange(256)}"
+            at = (start + timedelta(seconds=n * step)).strftime("%Y-%m-%d %H:%M:%S")
+            kind = n % 3
+            if kind == 0:
+                chunk.append(f"User: {user} connected from IP: {ip} at {at}\n")
+            else:
+                action = "connected to" if kind == 1 else "disconnected from"
+                chunk.append(f"User: {user} {action} server: {fleet[rng.randrange(servers)]['name']} using IP: {ip} at {at}\n")
+            if len(chunk) >= 10000:
+                f.writelines(chunk)
+                chunk = []
+        f.writelines(chunk)
+
+    return {
+        "entries": entries,
+        "servers": fleet,
+        "log_start": start,
+        "log_end": start + timedelta(seconds=log_lines * step),
+    }
+
+
+def timed(fn, *args, **kwargs) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def invoke(args: list[str]) -> None:
+    result = CliRunner().invoke(cli.cli, args)
+    if result.exit_code != 0:
+        raise RuntimeError(f"kangaroo {' '.join(args)} failed: {result.output}{result.exception or ''}")
+
+
+def bench_configs(fleet: dict, samples: int) -> dict:
+    results = {}
+    cli.ACCESS_INDEX_FILE.unlink(missing_ok=True)
+    results["get_ssh_users_cold_s"], users = timed(cli.get_ssh_users)
+    results["get_ssh_users_cached_s"], _ = timed(cli.get_ssh_users)
+    results["users_scanned"] = len(users)
+
+    # remove_host_block: one host out of one config, on *samples* different users
+    picked = users[:samples]
+    started = time.perf_counter()
+    for user in picked:
+        cli.remove_host_block(Path(user["home"]) / ".ssh" / "config", user["hosts"][0], user)
+    results["remove_host_block_ms"] = round((time.perf_counter() - started) / max(len(picked), 1) * 1000, 3)
+
+    index = cli.get_access_index()
+    busiest = max(index["hosts"], key=lambda host: len(index["hosts"][host]))
+    results["delete_server_all_users"] = len(index["hosts"][busiest])
+    results["delete_server_all_s"], _ = timed(invoke, ["delete-server-all", busiest])
+
+    new = _server(len(fleet["servers"]))
+    names = [e.pw_name for e in fleet["entries"]]
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["configure_users_for_server_s"], _ = timed(
+            cli.configure_users_for_server,
+            new["name"], new["ip"], new["port"], new["description"], names, cli.KANGAROO_KEY,
+        )
+    return results
+
+
+def bench_logs(fleet: dict, log_lines: int) -> dict:
+    results = {}
+    user = fleet["entries"][0].pw_name
+    results["login_logs_search_s"], _ = timed(invoke, ["login-logs", "--search", user, "--lines", str(max(log_lines, 1))])
+    last_tenth = fleet["log_end"] - (fleet["log_end"] - fleet["log_start"]) / 10
+    results["login_logs_user_since_s"], _ = timed(
+        invoke, ["login-logs", "--user", user, "--since", last_tenth.strftime("%Y-%m-%d %H:%M:%S")]
+    )
+    return results
+
+
+def bench_api(requests: int) -> dict:
+    results = {}
+    app = cli.build_flask_app(cli.DEFAULT_MASTER_PORT, "192.0.2.1", "benchmark-pin")
+    client = app.test_client()
+    token = cli.get_or_create_token()
+
+    for endpoint in ("/key", "/download"):
+        started = time.perf_counter()
+        for _ in range(requests):
+            assert client.get(f"{endpoint}?token={token}").status_code == 200
+        results[f"api{endpoint.replace('/', '_')}_rps"] = round(requests / (time.perf_counter() - started), 1)
+
+    # Every /connect queues a registration of a new server for the (absent)
+    # default users; the writer thread's output is discarded.
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        started = time.perf_counter()
+        for n in range(requests):
+            body = {"token": token, "hostname": f"bench{n:06d}", "ip": f"198.18.{n >> 8 & 255}.{n & 255}", "ssh_port": 22}
+            assert client.post("/connect", json=body).status_code == 202
+        results["api_connect_rps"] = round(requests / (time.perf_counter() - started), 1)
+        while any(j["status"] in ("queued", "running") for j in list(cli._registration_jobs.values())):
+            time.sleep(0.05)
+    return results
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """Print each timing next to the baseline run's, flagging >10% regressions."""
+    print(f"\n{'metric':<32} {'baseline':>12} {'current':>12}  change")
+    for key, value in current["results"].items():
+        old = baseline.get("results", {}).get(key)
+        if not key.endswith(("_s", "_ms", "_rps")) or not isinstance(old, (int, float)) or not old:
+            continue
+        change = (value - old) / old
+        worse = change < -0.10 if key.endswith("_rps") else change > 0.10
+        print(f"{key:<32} {old:>12} {value:>12}  {change:+.1%}{'  REGRESSION' if worse else ''}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="Number of fake users")
+    parser.add_argument("--hosts", type=int, default=30, help="Host blocks per user config")
+    parser.add_argument("--servers", type=int, default=500, help="Registered servers")
+    parser.add_argument("--log-lines", type=int, default=1_000_000, help="Lines in ssh_login.log")
+    parser.add_argument("--samples", type=int, default=200, help="Configs edited by the remove_host_block timing")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per API endpoint")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the fleet layout")
+    parser.add_argument("--keep", action="store_true", help="Keep the fleet directory and print its path")
+    parser.add_argument("--json", dest="json_out", default="", help="Write results to this file")
+    parser.add_argument("--compare", default="", help="Baseline results file to compare against")
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix="kangaroo-fleet-"))
+    try:
+        setup_seconds, fleet = timed(
+            build_fleet, root, args.users, args.hosts, args.servers, args.log_lines, args.seed
+        )
+        print(f"fleet built in {setup_seconds:.1f}s under {root}")
+        results = {}
+        results.update(bench_configs(fleet, args.samples))
+        results.update(bench_logs(fleet, args.log_lines))
+        results.update(bench_api(args.requests))
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    for key, value in results.items():
+        print(f"{key:<32} {round(value, 4) if isinstance(value, float) else value:>12}")
+
+    report = {
+        "params": {k: v for k, v in vars(args).items() if k not in ("json_out", "compare", "keep")},
+        "python": platform.python_version(),
+        "commit": subprocess.run(
+            ["git", "-C", str(Path(__file__).resolve().parent), "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True,
+        ).stdout.strip(),
+        "results": {k: round(v, 4) if isinstance(v, float) else v for k, v in results.items()},
+    }
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
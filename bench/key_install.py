@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Timing comparison: per-user ``cp`` subprocess vs. the in-process key installer.
+
+Creates N fake home directories in a temp dir (owned by the current user) and
+installs a 4096-bit-sized dummy key into each one three ways:
+
+  * cp       - the old loop: subprocess ``cp`` + chown + chmod per user
+  * cold     - install_user_key() on KEY_INSTALL_WORKERS threads, no key present
+  * warm     - the same again, every key already current (hash/mode/owner check)
+
+    python3 bench/key_install.py --users 2000
+"""
+
+import argparse
+import json
+import os
+import pwd
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cli  # noqa: E402
+
+
+def _fake_entries(root: Path, count: int) -> list[pwd.struct_passwd]:
+    uid, gid = os.getuid(), os.getgid()
+    entries = []
+    for i in range(count):
+        home = root / f"user{i:05d}"
+        (home / ".ssh").mkdir(parents=True)
+        entries.append(pwd.struct_passwd((f"user{i:05d}", "x", uid, gid, "", str(home), "/bin/bash")))
+    return entries
+
+
+def _clear_keys(entries: list[pwd.struct_passwd]) -> None:
+    for entry in entries:
+        (Path(entry.pw_dir) / ".ssh" / "kangaroo_key_id_rsa").unlink(missing_ok=True)
+
+
+def time_cp(entries: list[pwd.struct_passwd], private_key: Path) -> float:
+    started = time.perf_counter()
+    for entry in entries:
+        key_dest = Path(entry.pw_dir) / ".ssh" / "kangaroo_key_id_rsa"
+        subprocess.run(["cp", str(private_key), str(key_dest)], check=True)
+        os.chown(key_dest, entry.pw_uid, entry.pw_gid)
+        os.chmod(key_dest, 0o600)
+    return time.perf_counter() - started
+
+
+def time_installer(entries: list[pwd.struct_passwd], private_key: Path) -> tuple[float, int]:
+    started = time.perf_counter()
+    key_data = private_key.read_bytes()
+    with ThreadPoolExecutor(max_workers=cli.KEY_INSTALL_WORKERS) as pool:
+        written = sum(pool.map(lambda e: cli.install_user_key(e, key_data), entries))
+    return time.perf_counter() - started, written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000, help="Number of fake users")
+    parser.add_argument("--json", dest="json_out", default="", help="Also write results to this file")
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix="kangaroo-keybench-"))
+    try:
+        private_key = root / "kangaroo_key_id_rsa"
+        private_key.write_bytes(os.urandom(3243))
+        entries = _fake_entries(root / "home", args.users)
+
+        cp_seconds = time_cp(entries, private_key)
+        _clear_keys(entries)
+        cold_seconds, cold_written = time_installer(entries, private_key)
+        warm_seconds, warm_written = time_installer(entries, private_key)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    results = {
+        "users": args.users,
+        "workers": cli.KEY_INSTALL_WORKERS,
+        "cp_seconds": round(cp_seconds, 3),
+        "installer_cold_seconds": round(cold_seconds, 3),
+        "installer_cold_written": cold_written,
+        "installer_warm_seconds": round(warm_seconds, 3),
+        "installer_warm_written": warm_written,
+    }
+    print(f"cp subprocess per user : {cp_seconds:8.3f}s")
+    print(f"installer (no keys)    : {cold_seconds:8.3f}s  ({cold_written} written, {cp_seconds / cold_seconds:.1f}x faster)")
+    print(f"installer (all current): {warm_seconds:8.3f}s  ({warm_written} written, {cp_seconds / warm_seconds:.1f}x faster)")
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Load benchmark for the Kangaroo master API: requests/sec on /key, /download, /connect.
+
+Point it at a running ``kangaroo master-api``:
+
+    python3 bench/master_api_load.py --url https://127.0.0.1:7437 --token "$(cat .kangaroo_token)"
+
+or let it start a throwaway server on a temp cert/token/key/registry (needs
+openssl). In that mode no passwd entries are visible to it, so /connect
+registrations only write the temp registry:
+
+    python3 bench/master_api_load.py --self-host [--dev]
+
+Every /connect registers a new server, bench-<run>-<n> on an address in
+198.18.0.0/15 (the benchmarking range), and must be answered with 202.
+Against a running master those stay registered; remove them afterwards
+with ``kangaroo delete-servers --unregister``.
+
+Each worker thread keeps one HTTPS keep-alive connection open. With
+``--new-connections`` it reconnects for every request instead, reusing the
+previous TLS session, which shows what session resumption is worth.
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import itertools
+import json
+import logging
+import secrets
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cli  # noqa: E402
+
+ENDPOINTS = ("/key", "/download", "/connect")
+RUN_ID = secrets.token_hex(3)
+_connect_seq = itertools.count()  # next() on a count is atomic under the GIL
+
+
+class _ResumingHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection that offers the previous TLS session when reconnecting."""
+
+    tls_session = None
+    resumed = 0
+
+    def connect(self) -> None:
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # POST sends headers and body apart
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host, session=self.tls_session)
+        if self.sock.session_reused:
+            self.resumed += 1
+
+    def close(self) -> None:
+        # TLS 1.3 tickets arrive after the handshake, so grab the session last.
+        if self.sock is not None:
+            self.tls_session = self.sock.session
+        super().close()
+
+
+def _request(conn: http.client.HTTPSConnection, endpoint: str, token: str) -> int:
+    if endpoint == "/connect":
+        n = next(_connect_seq) % (1 << 17)
+        ip = f"198.{18 + (n >> 16)}.{n >> 8 & 255}.{n & 255}"
+        body = json.dumps({"token": token, "hostname": f"bench-{RUN_ID}-{n}", "ip": ip, "ssh_port": 22})
+        conn.request("POST", endpoint, body=body, headers={"Content-Type": "application/json"})
+    else:
+        conn.request("GET", f"{endpoint}?token={token}")
+    resp = conn.getresponse()
+    resp.read()
+    return resp.status
+
+
+def run_load(url: str, token: str, endpoint: str, concurrency: int, duration: float, new_connections: bool) -> dict:
+    parts = urlsplit(url)
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+
+    latencies: list[list[float]] = [[] for _ in range(concurrency)]
+    statuses: dict[int, int] = {}
+    resumed = [0] * concurrency
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(n: int) -> None:
+        conn = _ResumingHTTPSConnection(parts.hostname, parts.port, context=ctx, timeout=10)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status = _request(conn, endpoint, token)
+            except (OSError, http.client.HTTPException):
+                status = 0
+                conn.close()
+            latencies[n].append(time.perf_counter() - started)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+            if new_connections:
+                conn.close()
+        conn.close()
+        resumed[n] = conn.resumed
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    samples = sorted(x for per_thread in latencies for x in per_thread)
+    total = len(samples)
+
+    def pct(p: float) -> float:
+        return samples[min(total - 1, int(total * p))] * 1000 if samples else 0.0
+
+    return {
+        "endpoint": endpoint,
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(pct(0.50), 2),
+        "p95_ms": round(pct(0.95), 2),
+        "p99_ms": round(pct(0.99), 2),
+        "statuses": statuses,
+        "tls_resumed": sum(resumed),
+    }
+
+
+def _no_such_user(name: str):
+    raise KeyError(f"getpwnam(): name not found: '{name}'")
+
+
+def _self_host(dev: bool, threads: int) -> tuple[str, str]:
+    """Start a master API on 127.0.0.1 with throwaway key, cert and token files."""
+    tmp = Path(tempfile.mkdtemp(prefix="kangaroo-bench-"))
+    cli.TOKEN_FILE = tmp / "token"
+    cli.SERVERS_CONF = tmp / "jump_servers.conf"
+    cli.SERVERS_LOCK = tmp / ".jump_servers.lock"
+    cli.KANGAROO_KEY = tmp / "kangaroo_key_id_rsa"
+    cli.KANGAROO_KEY.write_bytes(b"benchmark")
+    Path(f"{cli.KANGAROO_KEY}.pub").write_text("ssh-ed25519 AAAAbenchmark kangaroo@bench\n")
+    # Registrations must not touch the configs of real users on this machine.
+    cli.pwd = types.SimpleNamespace(getpwall=lambda: [], getpwnam=_no_such_user, struct_passwd=cli.pwd.struct_passwd)
+    tls_key, tls_cert = tmp / "tls_key.pem", tmp / "tls_cert.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-keyout", str(tls_key),
+            "-out", str(tls_cert), "-days", "1", "-nodes", "-subj", "/CN=kangaroo-bench",
+        ],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per-request access log
+    app = cli.build_flask_app(port, "127.0.0.1", "benchmark-pin")
+    ssl_ctx = cli.build_server_ssl_context(tls_cert, tls_key)
+    if dev:
+        target = lambda: app.run(host="127.0.0.1", port=port, ssl_context=ssl_ctx, threaded=True)  # noqa: E731
+    else:
+        target = lambda: cli.serve_production(  # noqa: E731
+            app, "127.0.0.1", port, ssl_ctx, threads=threads, access_log=False, handle_signals=False
+        )
+    threading.Thread(target=target, daemon=True).start()
+
+    for _ in range(100):
+        if cli.is_port_open("127.0.0.1", port):
+            break
+        time.sleep(0.05)
+    return f"https://127.0.0.1:{port}", cli.get_or_create_token()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="", help="Base URL of a running master API")
+    parser.add_argument("--token", default="", help="Master token for --url")
+    parser.add_argument("--self-host", action="store_true", help="Start a temporary master API to measure")
+    parser.add_argument("--dev", action="store_true", help="With --self-host, use the Flask dev server")
+    parser.add_argument("--threads", type=int, default=16, help="Server threads for --self-host")
+    parser.add_argument("--concurrency", type=int, default=16, help="Client threads")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per endpoint")
+    parser.add_argument("--endpoint", action="append", choices=ENDPOINTS, help="Endpoint(s) to measure")
+    parser.add_argument("--new-connections", action="store_true", help="Reconnect (with TLS resumption) per request")
+    parser.add_argument("--json", dest="json_out", default="", help="Also write results to this file")
+    args = parser.parse_args()
+
+    if args.self_host:
+        url, token = _self_host(args.dev, args.threads)
+    elif args.url and args.token:
+        url, token = args.url, args.token
+    else:
+        parser.error("give --url and --token, or --self-host")
+
+    results = []
+    for endpoint in args.endpoint or ENDPOINTS:
+        if endpoint == "/connect" and args.self_host:
+            # The registration writer reports every (user-less) job on stdout.
+            with contextlib.redirect_stdout(io.StringIO()):
+                res = run_load(url, token, endpoint, args.concurrency, args.duration, args.new_connections)
+                while any(j["status"] in ("queued", "running") for j in list(cli._registration_jobs.values())):
+                    time.sleep(0.05)
+        else:
+            res = run_load(url, token, endpoint, args.concurrency, args.duration, args.new_connections)
+        results.append(res)
+        print(
+            f"{endpoint:<10} {res['rps']:>9.1f} req/s  p50 {res['p50_ms']:.2f}ms  "
+            f"p95 {res['p95_ms']:.2f}ms  p99 {res['p99_ms']:.2f}ms  "
+            f"status {res['statuses']}  tls resumed {res['tls_resumed']}"
+        )
+
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(results, indent=2))
+    failed = [r["endpoint"] for r in results if set(r["statuses"]) != {202 if r["endpoint"] == "/connect" else 200}]
+    if failed:
+        sys.exit(f"unexpected response statuses from {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
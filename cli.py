@@ -1,17 +1,29 @@
 #!/usr/bin/env python3
 """Kangaroo SSH JumpServer 🦘 - manages SSH configs across system users."""
 
+import errno
+import fcntl
 import ipaddress
+import json
+import math
 import os
 import re
+import stat
 import sys
 import pwd
+import queue
 import secrets
+import shlex
 import socket
 import subprocess
+import tempfile
 import threading
+import time
 from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple, Sequence
 
 import click
 
@@ -52,22 +64,255 @@ def _validate_text_field(value: str, field: str, max_len: int = 255) -> str:
 SCRIPT_DIR = Path(__file__).resolve().parent
 KANGAROO_KEY = Path("/etc/ssh/kangaroo_key_id_rsa")
 SERVERS_CONF = SCRIPT_DIR / "jump_servers.conf"
+SERVERS_LOCK = SCRIPT_DIR / ".jump_servers.lock"
 TOKEN_FILE = SCRIPT_DIR / ".kangaroo_token"
 MASTER_PORT_FILE = SCRIPT_DIR / ".kangaroo_master_port"
 KANGAROO_TLS_KEY  = Path("/etc/ssh/kangaroo_tls_key.pem")
 KANGAROO_TLS_CERT = Path("/etc/ssh/kangaroo_tls_cert.pem")
+ACCESS_INDEX_FILE = SCRIPT_DIR / ".kangaroo_index.json"
+SSH_CONTROL_DIR = Path("/run/kangaroo")
+LOGIN_LOG = SCRIPT_DIR / "server" / "logs" / "ssh_login.log"
+LOGIN_LOG_MANIFEST = LOGIN_LOG.with_name("ssh_login.manifest.json")
+HEALTH_CACHE = SCRIPT_DIR / "server" / "health.tsv"
 
 DEFAULT_MASTER_PORT = 7437
 
+# Config scanning: 1 worker scans sequentially; more run the per-user stat and
+# parse on a thread pool, giving up on any single config after SCAN_TIMEOUT.
+SCAN_WORKERS = 1
+SCAN_TIMEOUT = 10.0
+
+
+# ---------------------------------------------------------------------------
+# File helpers
+# ---------------------------------------------------------------------------
+
+def atomic_write_bytes(
+    path: Path,
+    data: bytes,
+    mode: int = 0o600,
+    uid: int | None = None,
+    gid: int | None = None,
+) -> None:
+    """Write *data* to a temp file next to *path* and rename it into place.
+
+    Owner and mode are set on the temp file before the rename, so *path*
+    never exists with the wrong permissions, and a symlink at *path* is
+    replaced rather than followed.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if uid is not None and gid is not None:
+                os.fchown(f.fileno(), uid, gid)
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_text(
+    path: Path,
+    text: str,
+    mode: int = 0o600,
+    uid: int | None = None,
+    gid: int | None = None,
+) -> None:
+    """Write *text* to a temp file next to *path* and rename it into place."""
+    atomic_write_bytes(path, text.encode(), mode, uid, gid)
+
+
+@contextmanager
+def file_lock(lock_path: Path):
+    """Hold an exclusive flock on *lock_path* (created if missing) for a read-modify-write cycle."""
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def file_signature(path: Path) -> list[int] | None:
+    """Return [mtime_ns, size, inode] for a regular file, or None if there is none."""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+# ---------------------------------------------------------------------------
+# Profiling
+# ---------------------------------------------------------------------------
+
+# With --profile every subprocess and major phase is recorded as a span
+# (start, duration, thread, nesting depth). A waterfall is printed to stderr
+# when the command exits, and --trace-file saves the spans in Chrome trace
+# format for chrome://tracing or ui.perfetto.dev.
+PROFILE_SPANS: list[dict] | None = None  # None while profiling is off
+PROFILE_WATERFALL_ROWS = 60
+_profile_epoch = 0.0
+_profile_lock = threading.Lock()
+_profile_local = threading.local()
+
+
+def start_profiling() -> None:
+    global PROFILE_SPANS, _profile_epoch
+    PROFILE_SPANS = []
+    _profile_epoch = time.perf_counter()
+
+
+@contextmanager
+def span(name: str, cat: str = "phase"):
+    """Record the block as a profile span; yields a dict of args to attach to it."""
+    args: dict = {}
+    if PROFILE_SPANS is None:
+        yield args
+        return
+    depth = getattr(_profile_local, "depth", 0)
+    _profile_local.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        yield args
+    finally:
+        duration = time.perf_counter() - started
+        _profile_local.depth = depth
+        thread = threading.current_thread()
+        record = {
+            "name": name, "cat": cat, "start": started - _profile_epoch, "dur": duration,
+            "tid": thread.ident, "thread": thread.name, "depth": depth, "args": args,
+        }
+        with _profile_lock:
+            PROFILE_SPANS.append(record)
+
+
+def _command_label(cmd: Sequence[str]) -> tuple[str, str]:
+    """Return (span name, printable argv) for *cmd*, leaving out sshpass passwords and long scripts."""
+    args = list(cmd)
+    if args and os.path.basename(args[0]) == "sshpass":
+        args = args[3:] if len(args) > 2 and args[1] == "-p" else args[1:]
+    program = os.path.basename(args[0]) if args else "?"
+    target = ""
+    if program in ("ssh", "ssh-copy-id", "scp"):
+        target = next((a for a in args[1:] if "@" in a and not a.startswith("-")), "")
+    argv = " ".join(a if len(a) <= 80 else f"<{len(a)} chars>" for a in args)
+    return f"{program} {target}".strip(), argv
+
+
+def run_command(cmd: Sequence[str], **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run() that is recorded as a span under --profile."""
+    name, argv = _command_label(cmd)
+    with span(name, "subprocess") as args:
+        args["argv"] = argv
+        result = subprocess.run(cmd, **kwargs)
+        args["returncode"] = result.returncode
+        return result
+
+
+def render_waterfall(spans: list[dict], width: int = 40) -> str:
+    """Return a text waterfall of *spans* followed by per-name totals."""
+    if not spans:
+        return "No spans recorded.\n"
+    begin = min(s["start"] for s in spans)
+    total = max(s["start"] + s["dur"] for s in spans) - begin or 1e-9
+
+    shown = spans
+    if len(spans) > PROFILE_WATERFALL_ROWS:
+        shown = sorted(spans, key=lambda s: s["dur"], reverse=True)[:PROFILE_WATERFALL_ROWS]
+    lines = [f"{'start ms':>10} {'took ms':>10}  {'':<{width}}  span"]
+    for s in sorted(shown, key=lambda s: (s["start"], -s["dur"])):
+        left = int((s["start"] - begin) / total * width)
+        bar = " " * left + "█" * max(1, round(s["dur"] / total * width))
+        thread = "" if s["thread"] == "MainThread" else f"  [{s['thread']}]"
+        lines.append(
+            f"{(s['start'] - begin) * 1000:10.1f} {s['dur'] * 1000:10.1f}  {bar[:width]:<{width}}  "
+            f"{'  ' * s['depth']}{s['name']}{thread}"
+        )
+    if len(shown) < len(spans):
+        lines.append(f"({len(spans) - len(shown)} shorter spans not shown)")
+
+    totals: dict[str, list] = {}
+    for s in spans:
+        entry = totals.setdefault(s["name"], [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += s["dur"]
+        entry[2] = max(entry[2], s["dur"])
+    lines.append("")
+    lines.append(f"{'count':>7} {'total ms':>10} {'max ms':>10}  span")
+    ranked = sorted(totals.items(), key=lambda item: -item[1][1])
+    for name, (count, summed, longest) in ranked[:PROFILE_WATERFALL_ROWS]:
+        lines.append(f"{count:7d} {summed * 1000:10.1f} {longest * 1000:10.1f}  {name}")
+    if len(ranked) > PROFILE_WATERFALL_ROWS:
+        lines.append(f"({len(ranked) - PROFILE_WATERFALL_ROWS} more)")
+    return "\n".join(lines) + "\n"
+
+
+def write_chrome_trace(spans: list[dict], path: Path) -> None:
+    """Save *spans* as a Chrome trace-event JSON file."""
+    pid = os.getpid()
+    events = [
+        {
+            "name": s["name"], "cat": s["cat"], "ph": "X", "pid": pid, "tid": s["tid"],
+            "ts": round(s["start"] * 1e6, 1), "dur": round(s["dur"] * 1e6, 1), "args": s["args"],
+        }
+        for s in spans
+    ]
+    threads = {s["tid"]: s["thread"] for s in spans}
+    events.extend(
+        {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+        for tid, name in threads.items()
+    )
+    atomic_write_text(path, json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}), 0o644)
+
+
+def finish_profiling(trace_file: Path | None) -> None:
+    """Print the waterfall and write the trace file, if one was asked for."""
+    spans = list(PROFILE_SPANS or [])
+    click.echo("\n🦘 Profile\n" + render_waterfall(spans), err=True)
+    if trace_file:
+        try:
+            write_chrome_trace(spans, trace_file)
+            click.echo(f"Trace written to {trace_file}", err=True)
+        except OSError as exc:
+            click.echo(f"Could not write trace: {exc}", err=True)
+
 
 # ---------------------------------------------------------------------------
 # Token management
 # ---------------------------------------------------------------------------
 
+_TEXT_CACHE: dict[Path, tuple[list[int], str]] = {}
+
+
+def read_text_cached(path: Path) -> str:
+    """Return the contents of *path*, re-reading it only when its (mtime, size, inode) change.
+
+    Raises FileNotFoundError if *path* is not a regular file.
+    """
+    signature = file_signature(path)
+    if signature is None:
+        raise FileNotFoundError(f"No such file: {path}")
+    cached = _TEXT_CACHE.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    text = path.read_text()
+    _TEXT_CACHE[path] = (signature, text)
+    return text
+
+
 def get_or_create_token() -> str:
     """Return the persistent master token, creating it if necessary."""
-    if TOKEN_FILE.is_file():
-        return TOKEN_FILE.read_text().strip()
+    try:
+        return read_text_cached(TOKEN_FILE).strip()
+    except FileNotFoundError:
+        pass
     token = secrets.token_urlsafe(32)
     TOKEN_FILE.write_text(token)
     TOKEN_FILE.chmod(0o600)
@@ -88,121 +333,768 @@ def require_root() -> None:
 # SSH config parsing
 # ---------------------------------------------------------------------------
 
+# One tokenizer serves every reader and writer of ~/.ssh/config. It splits a
+# file into blocks: the options before the first Host/Match line ("global"),
+# then one block per Host or Match line. Each block records its span in the
+# text, and comment/blank lines directly above a Host line belong to that
+# block (e.g. its "# Description:"), while comments between options belong to
+# the block they sit in. The spans tile the file, so joining them gives the
+# original text back and an edit only replaces the spans it touches.
+_CONFIG_LINE_RE = re.compile(r"[^\n]*\n|[^\n]+")
+_CONFIG_OPTION_RE = re.compile(r"([^\s=]+)\s*(?:=\s*)?(.*)")
+_DESCRIPTION_PREFIX_RE = re.compile(r"# Description:\s*")
+MAX_INCLUDE_DEPTH = 16  # same limit as ssh
+MAX_CONFIG_BYTES = 1024 * 1024
+
+
+class ConfigBlock(NamedTuple):
+    kind: str  # "global", "host" or "match"
+    patterns: tuple[str, ...]  # Host aliases, or the Match criteria
+    start: int  # span in the file's text, attached comments included
+    end: int
+    header_start: int  # the Host/Match line itself (empty for "global")
+    header_end: int
+    options: tuple[tuple[str, str], ...]
+    comments: tuple[str, ...]
+    source: str  # file the block was read from
+
+    @property
+    def description(self) -> str:
+        """First non-empty "# Description:" comment of the block."""
+        for line in self.comments:
+            if line.startswith("# Description: "):
+                description = _DESCRIPTION_PREFIX_RE.sub("", line, count=1)
+                if description:
+                    return description
+        return ""
+
+    def get(self, key: str, default: str = "") -> str:
+        """Return the first value of option *key* (case-insensitive), as ssh does."""
+        key = key.lower()
+        for name, value in self.options:
+            if name.lower() == key:
+                return value
+        return default
+
+
+class SSHConfig(NamedTuple):
+    path: str
+    text: str
+    blocks: list[ConfigBlock]  # this file's own blocks
+    resolved: list[ConfigBlock]  # with Include directives expanded in place
+    files: list[tuple[str, list[int] | None]]  # every file read, with its signature
+    errors: list[str]  # unreadable includes, cycles
+
+
+def tokenize_ssh_config(text: str, source: str = "") -> list[ConfigBlock]:
+    """Split *text* into ConfigBlocks whose spans cover it exactly, in order."""
+    blocks: list[ConfigBlock] = []
+    kind, patterns = "global", ()
+    start = header_start = header_end = 0
+    options: list[tuple[str, str]] = []
+    comments: list[str] = []
+    pending_start = None  # comment/blank run not yet attached to a block
+    pending: list[str] = []
+
+    for match in _CONFIG_LINE_RE.finditer(text):
+        line = match.group()
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            if pending_start is None:
+                pending_start = match.start()
+            if stripped:
+                pending.append(line.rstrip("\n"))
+            continue
+
+        key, value = _CONFIG_OPTION_RE.match(stripped).groups()
+        if key.lower() in ("host", "match"):
+            block_start = match.start() if pending_start is None else pending_start
+            blocks.append(ConfigBlock(
+                kind, patterns, start, block_start, header_start, header_end, tuple(options), tuple(comments), source
+            ))
+            kind, patterns = key.lower(), tuple(value.split())
+            start, header_start, header_end = block_start, match.start(), match.end()
+            options, comments = [], pending
+        else:
+            options.append((key, value))
+            comments.extend(pending)
+        pending_start, pending = None, []
+
+    comments.extend(pending)
+    blocks.append(ConfigBlock(
+        kind, patterns, start, len(text), header_start, header_end, tuple(options), tuple(comments), source
+    ))
+    return blocks
+
+
+def _may_access(st: os.stat_result, uid: int, gids: set[int], bit: int) -> bool:
+    """Whether *uid* (member of *gids*) has permission *bit* (4 read, 1 search) on *st*."""
+    if uid == 0:
+        return True
+    if st.st_uid == uid:
+        return bool(st.st_mode & bit << 6)
+    if st.st_gid in gids:
+        return bool(st.st_mode & bit << 3)
+    return bool(st.st_mode & bit)
+
+
+def read_config_file(path: str | Path, uid: int, gids: set[int], errors: str = "replace") -> str:
+    """Read the config file at *path* on behalf of *uid*, who is in groups *gids*.
+
+    Scans run as root, so this refuses (with OSError) anything *uid* could not
+    open itself, and anything that is not a regular file of at most
+    MAX_CONFIG_BYTES: an Include of a FIFO, /dev/zero or /root/.ssh/config
+    must not hang the scan, exhaust memory or leak into the user's hosts.
+    """
+    real = Path(os.path.realpath(path))
+    denied = PermissionError(errno.EACCES, os.strerror(errno.EACCES), str(path))
+    for parent in real.parents:
+        if not _may_access(os.stat(parent), uid, gids, 1):
+            raise denied
+    if not stat.S_ISREG(os.stat(real).st_mode):
+        raise OSError(errno.EINVAL, "Not a regular file", str(path))
+    # O_NONBLOCK: should the file be swapped for a FIFO meanwhile, open() must not block.
+    with os.fdopen(os.open(real, os.O_RDONLY | os.O_NONBLOCK | os.O_NOCTTY), "rb") as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            raise OSError(errno.EINVAL, "Not a regular file", str(path))
+        if not _may_access(st, uid, gids, 4):
+            raise denied
+        data = f.read(MAX_CONFIG_BYTES + 1)
+    if len(data) > MAX_CONFIG_BYTES:
+        raise OSError(errno.EFBIG, f"Larger than {MAX_CONFIG_BYTES} bytes", str(path))
+    return data.decode(errors=errors)
+
+
+def owner_access(username: str, uid: int, gid: int) -> tuple[int, set[int]]:
+    """Return the (uid, gids) read_config_file() checks for on behalf of a user."""
+    return uid, {gid, *os.getgrouplist(username, gid)}
+
+
+def read_user_config(config_path: Path, username: str, uid: int, gid: int) -> str:
+    """Return the text of a user's config ("" if there is none) for rewriting it.
+
+    Read with the user's own permissions (see read_config_file()), since the
+    result is written back into a file they own: a config symlinked to a file
+    they cannot read must never be copied into it.
+    """
+    try:
+        return read_config_file(config_path, *owner_access(username, uid, gid), errors="strict")
+    except FileNotFoundError:
+        return ""
+
+
+def _resolve_includes(
+    blocks: list[ConfigBlock],
+    base_dir: Path,
+    stack: list[str],
+    files: list[tuple[str, list[int] | None]],
+    errors: list[str],
+    access: tuple[int, set[int]],
+) -> list[ConfigBlock]:
+    """Return *blocks* with the blocks of every Include'd file spliced in after its directive."""
+    import glob
+
+    home = str(base_dir.parent)
+    resolved: list[ConfigBlock] = []
+    for block in blocks:
+        resolved.append(block)
+        for key, value in block.options:
+            if key.lower() != "include":
+                continue
+            for pattern in value.split():
+                if pattern.startswith("~/"):
+                    pattern = home + pattern[1:]
+                elif not os.path.isabs(pattern):
+                    pattern = str(base_dir / pattern)  # relative to ~/.ssh, like ssh
+                for include in sorted(glob.glob(pattern)):
+                    real = os.path.realpath(include)
+                    if real in stack:
+                        errors.append(f"Include cycle: {' -> '.join(stack + [real])}")
+                        continue
+                    if len(stack) > MAX_INCLUDE_DEPTH:
+                        errors.append(f"Include nested too deeply: {include}")
+                        continue
+                    try:
+                        text = read_config_file(include, *access)
+                    except OSError as exc:
+                        errors.append(str(exc))
+                        continue
+                    files.append((include, file_signature(Path(include))))
+                    resolved.extend(_resolve_includes(
+                        tokenize_ssh_config(text, include), base_dir, stack + [real], files, errors, access
+                    ))
+    return resolved
+
+
+def load_ssh_config(path: str | Path, owner: pwd.struct_passwd | None = None) -> SSHConfig:
+    """Parse the config at *path*, following Include; raises OSError if it is unreadable.
+
+    Files are read with the permissions of *owner* (default: the caller's),
+    see read_config_file(); Includes it may not read are skipped and reported
+    in ``errors``.
+    """
+    path = Path(path)
+    if owner is None:
+        access = (os.geteuid(), {os.getegid(), *os.getgroups()})
+    else:
+        access = owner_access(owner.pw_name, owner.pw_uid, owner.pw_gid)
+    text = read_config_file(path, *access)
+    blocks = tokenize_ssh_config(text, str(path))
+    files = [(str(path), file_signature(path))]
+    errors: list[str] = []
+    resolved = _resolve_includes(blocks, path.parent, [os.path.realpath(path)], files, errors, access)
+    return SSHConfig(str(path), text, blocks, resolved, files, errors)
+
+
+def host_options(blocks: Iterable[ConfigBlock]) -> dict[str, dict[str, str]]:
+    """Return {alias: {option: value}} for the Host blocks in *blocks*.
+
+    Every alias gets its own dict. An alias named by several blocks collects
+    the options of all of them, the first value of each option winning, as
+    in ssh.
+    """
+    config_map: dict[str, dict[str, str]] = {}
+    for block in blocks:
+        if block.kind != "host":
+            continue
+        for alias in block.patterns:
+            options = config_map.setdefault(alias, {})
+            for key, value in block.options:
+                options.setdefault(key, value)
+    return config_map
+
+
 def parse_ssh_config(path: str | Path) -> dict[str, dict[str, str]]:
     """Parse an SSH config file and return a mapping of {host: {key: value}}."""
+    try:
+        return host_options(load_ssh_config(path).resolved)
+    except OSError as exc:
+        return {"error": str(exc)}
+
+
+# ---------------------------------------------------------------------------
+# User discovery
+# ---------------------------------------------------------------------------
+
+ACCESS_INDEX_VERSION = 2
+
+
+def load_access_index() -> dict:
+    """Load the on-disk config cache, returning an empty one if it is missing or stale."""
+    try:
+        data = json.loads(ACCESS_INDEX_FILE.read_text())
+    except (OSError, ValueError):
+        data = None
+    if not isinstance(data, dict) or data.get("version") != ACCESS_INDEX_VERSION:
+        return {"version": ACCESS_INDEX_VERSION, "configs": {}}
+    return data
+
+
+def save_access_index(index: dict) -> None:
+    try:
+        atomic_write_text(ACCESS_INDEX_FILE, json.dumps(index, separators=(",", ":")))
+    except OSError:
+        # The cache is an optimisation only; a read-only checkout still works.
+        pass
+
+
+def _is_login_entry(entry: pwd.struct_passwd) -> bool:
+    return entry.pw_uid > 1000 and not any(s in entry.pw_shell for s in ("nologin", "false"))
+
+
+def _login_entries() -> list[pwd.struct_passwd]:
+    """Return passwd entries for users that can log in (uid > 1000, real shell)."""
+    return [entry for entry in pwd.getpwall() if _is_login_entry(entry)]
+
+
+def _scan_user(entry: pwd.struct_passwd, cached: dict | None) -> tuple[dict, dict | None]:
+    """Build the user record for *entry*, re-parsing its config only if it changed.
+
+    Returns the record and the cache entry to store for its config (None if
+    there is nothing cacheable, e.g. no config or a read error).
+    """
+    ssh_config_path = Path(entry.pw_dir) / ".ssh" / "config"
+    signature = file_signature(ssh_config_path)
     config_map: dict[str, dict[str, str]] = {}
-    current_hosts: list[str] = []
-    current_config: dict[str, str] = {}
+    cache_entry = None
+
+    if signature is not None:
+        if (
+            cached
+            and cached.get("signature") == signature
+            and all(file_signature(Path(name)) == sig for name, sig in cached["includes"])
+        ):
+            config_map, includes = cached["config_map"], cached["includes"]
+        else:
+            try:
+                config = load_ssh_config(ssh_config_path, entry)
+                for error in config.errors:
+                    click.echo(f"Warning: {ssh_config_path}: {error}", err=True)
+                config_map = host_options(config.resolved)
+                includes = [[name, sig] for name, sig in config.files[1:]]
+            except OSError as exc:
+                config_map = {"error": str(exc)}
+        if "error" not in config_map:
+            cache_entry = {"signature": signature, "config_map": config_map, "includes": includes}
+
+    user = {
+        "username": entry.pw_name,
+        "uid": entry.pw_uid,
+        "gid": entry.pw_gid,
+        "home": entry.pw_dir,
+        "hosts": [h for h in config_map if h != "error"],
+        "config_map": config_map,
+    }
+    return user, cache_entry
+
+
+def _errored_user(entry: pwd.struct_passwd, error: str) -> tuple[dict, None]:
+    user = {
+        "username": entry.pw_name,
+        "uid": entry.pw_uid,
+        "gid": entry.pw_gid,
+        "home": entry.pw_dir,
+        "hosts": [],
+        "config_map": {"error": error},
+    }
+    return user, None
+
+
+def _scan_users_parallel(
+    entries: list[pwd.struct_passwd],
+    cached_configs: dict[str, dict],
+    workers: int,
+    timeout: float,
+) -> Iterator[tuple[int, tuple[dict, dict | None]]]:
+    """Run _scan_user() for every entry on at most *workers* daemon threads.
+
+    Yields (position in *entries*, outcome) as each scan finishes. A config
+    that takes longer than *timeout* seconds (e.g. a hung NFS mount) marks
+    that user as errored and a replacement worker is started, so one stuck
+    home directory cannot stall the whole scan.
+    """
+    finished = [False] * len(entries)
+    todo: queue.Queue[int] = queue.Queue()
+    done: queue.Queue[tuple[int, tuple[dict, dict | None]]] = queue.Queue()
+    started: dict[int, float] = {}
+    lock = threading.Lock()
+
+    for i in range(len(entries)):
+        todo.put(i)
+
+    def worker() -> None:
+        while True:
+            try:
+                i = todo.get_nowait()
+            except queue.Empty:
+                return
+            with lock:
+                started[i] = time.monotonic()
+            entry = entries[i]
+            config_key = str(Path(entry.pw_dir) / ".ssh" / "config")
+            try:
+                outcome = _scan_user(entry, cached_configs.get(config_key))
+            except Exception as exc:
+                outcome = _errored_user(entry, str(exc))
+            with lock:
+                started.pop(i, None)
+            done.put((i, outcome))
+
+    def spawn() -> None:
+        threading.Thread(target=worker, name="kangaroo-scan", daemon=True).start()
+
+    for _ in range(min(workers, len(entries))):
+        spawn()
 
-    def _flush() -> None:
-        for h in current_hosts:
-            config_map[h] = current_config
+    remaining = len(entries)
+    while remaining:
+        try:
+            i, outcome = done.get(timeout=min(timeout, 0.05))
+            if not finished[i]:
+                finished[i] = True
+                remaining -= 1
+                yield i, outcome
+        except queue.Empty:
+            pass
+
+        now = time.monotonic()
+        with lock:
+            overdue = [i for i, t in started.items() if now - t > timeout]
+            for i in overdue:
+                del started[i]
+        for i in overdue:
+            if finished[i]:
+                continue
+            finished[i] = True
+            remaining -= 1
+            spawn()
+            entry = entries[i]
+            config_path = Path(entry.pw_dir) / ".ssh" / "config"
+            yield i, _errored_user(entry, f"timed out after {timeout:g}s reading {config_path}")
+
+
+def _scan_access(workers: int | None = None, timeout: float | None = None) -> Iterator[tuple[int, dict]]:
+    """Yield (passwd position, user record) for every login user as soon as it is scanned.
+
+    Each config is re-parsed only when its (mtime, size, inode) differs from
+    the cached copy in ACCESS_INDEX_FILE; the cache is rewritten once the
+    scan has run to completion and anything changed. With more than one
+    worker (default SCAN_WORKERS) records arrive in completion order, see
+    _scan_users_parallel().
+    """
+    workers = SCAN_WORKERS if workers is None else workers
+    timeout = SCAN_TIMEOUT if timeout is None else timeout
 
     try:
-        with open(path) as f:
-            for raw_line in f:
-                line = raw_line.strip()
-                if not line or line.startswith("#"):
-                    continue
+        passwd_entries = _login_entries()
+    except Exception as exc:
+        click.echo(f"Error reading passwd database: {exc}", err=True)
+        return
 
-                if line.lower().startswith("host "):
-                    _flush()
-                    current_hosts = line[5:].split()
-                    current_config = {}
-                else:
-                    parts = line.split(None, 1)
-                    current_config[parts[0]] = parts[1] if len(parts) > 1 else ""
+    index = load_access_index()
+    cached_configs: dict[str, dict] = index["configs"]
+    fresh_configs: dict[str, dict] = {}
 
-        _flush()
-    except OSError as exc:
-        config_map["error"] = str(exc)
+    if workers > 1:
+        scanned = _scan_users_parallel(passwd_entries, cached_configs, workers, timeout)
+    else:
+        scanned = (
+            (i, _scan_user(entry, cached_configs.get(str(Path(entry.pw_dir) / ".ssh" / "config"))))
+            for i, entry in enumerate(passwd_entries)
+        )
 
-    return config_map
+    for i, (user, cache_entry) in scanned:
+        config_key = str(Path(passwd_entries[i].pw_dir) / ".ssh" / "config")
+        if cache_entry is not None:
+            fresh_configs[config_key] = cache_entry
+        elif "error" in user["config_map"] and config_key in cached_configs:
+            # Keep the last good parse so a transient failure doesn't evict it.
+            fresh_configs[config_key] = cached_configs[config_key]
+        yield i, user
+
+    if fresh_configs != cached_configs:
+        save_access_index({"version": ACCESS_INDEX_VERSION, "configs": fresh_configs})
+
+
+def get_access_index(workers: int | None = None, timeout: float | None = None) -> dict:
+    """Return {"users": {username: user}, "hosts": {host: [usernames]}}, in passwd order."""
+    index = daemon_request("index")
+    if index is not None:
+        return index
+    with span("scan configs") as args:
+        ordered = sorted(_scan_access(workers, timeout), key=lambda item: item[0])
+        args["users"] = len(ordered)
+    users: dict[str, dict] = {}
+    hosts: dict[str, list[str]] = defaultdict(list)
+    for _, user in ordered:
+        users[user["username"]] = user
+        for host in user["hosts"]:
+            hosts[host].append(user["username"])
+    return {"users": users, "hosts": dict(hosts)}
 
 
-# ---------------------------------------------------------------------------
-# User discovery
-# ---------------------------------------------------------------------------
+def iter_ssh_users(workers: int | None = None, timeout: float | None = None) -> Iterator[dict]:
+    """Yield user records as they are scanned, without collecting or ordering them."""
+    index = daemon_request("index")
+    if index is not None:
+        yield from index["users"].values()
+        return
+    for _, user in _scan_access(workers, timeout):
+        yield user
+
 
 def get_ssh_users() -> list[dict]:
     """Return info about system users (uid > 1000, login shell) with SSH configs."""
-    users: list[dict] = []
+    return list(get_access_index()["users"].values())
 
+
+def get_ssh_user(username: str) -> dict | None:
+    """Scan just *username*'s config (through the access index cache); None if not a login user."""
+    answer = daemon_request("user", username=username)
+    if answer is not None:
+        return answer["user"]
     try:
-        passwd_entries = pwd.getpwall()
-    except Exception as exc:
-        click.echo(f"Error reading passwd database: {exc}", err=True)
-        return users
+        entry = pwd.getpwnam(username)
+    except KeyError:
+        return None
+    if not _is_login_entry(entry):
+        return None
+    config_key = str(Path(entry.pw_dir) / ".ssh" / "config")
+    index = load_access_index()
+    # One-entry parallel scan, so a hung home directory still times out.
+    _, (user, cache_entry) = next(_scan_users_parallel([entry], index["configs"], 1, SCAN_TIMEOUT))
+    if cache_entry is not None and index["configs"].get(config_key) != cache_entry:
+        index["configs"][config_key] = cache_entry
+        save_access_index(index)
+    return user
+
+
+# ---------------------------------------------------------------------------
+# Server registry
+# ---------------------------------------------------------------------------
+
+# jump_servers.conf holds one server per line:
+#     name ip port registered_at description...
+# Lines written by older versions ("name ip") still load, with port 22 and
+# no registration time, and are rewritten in the full format on next save.
+REGISTRY_HEADER = "# name ip port registered_at description\n"
+
+_registry_cache: dict = {"signature": None, "by_name": {}, "by_ip": {}}
+
 
-    for entry in passwd_entries:
-        if entry.pw_uid <= 1000:
+def _parse_registry(text: str) -> dict[str, dict]:
+    records: dict[str, dict] = {}
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
             continue
-        shell = entry.pw_shell
-        if any(s in shell for s in ("nologin", "false")):
+        parts = line.split(None, 4)
+        if len(parts) < 2:
             continue
-
-        ssh_config_path = Path(entry.pw_dir) / ".ssh" / "config"
-        config_map: dict[str, dict[str, str]] = {}
-        hosts: list[str] = []
-
-        if ssh_config_path.is_file():
-            config_map = parse_ssh_config(ssh_config_path)
-            hosts = [h for h in config_map if h != "error"]
-
-        users.append(
-            {
-                "username": entry.pw_name,
-                "uid": entry.pw_uid,
-                "gid": entry.pw_gid,
-                "home": entry.pw_dir,
-                "hosts": hosts,
-                "config_map": config_map,
+        try:
+            port = int(parts[2]) if len(parts) > 2 else 22
+        except ValueError:
+            port = 22
+        records[parts[0]] = {
+            "name": parts[0],
+            "ip": parts[1],
+            "port": port,
+            "registered_at": parts[3] if len(parts) > 3 and parts[3] != "-" else "",
+            "description": parts[4].strip() if len(parts) > 4 else "",
+        }
+    return records
+
+
+def _index_registry(records: dict[str, dict], signature: list[int] | None) -> dict:
+    return {
+        "signature": signature,
+        "by_name": records,
+        "by_ip": {r["ip"]: r for r in records.values()},
+    }
+
+
+def load_server_registry() -> dict:
+    """Return {"by_name": {name: record}, "by_ip": {ip: record}} for jump_servers.conf.
+
+    The parsed file is kept in memory and re-read only when its (mtime, size,
+    inode) change. Records hold name, ip, port, registered_at and description.
+    """
+    global _registry_cache
+
+    signature = file_signature(SERVERS_CONF)
+    if signature != _registry_cache["signature"]:
+        text = SERVERS_CONF.read_text() if signature is not None else ""
+        _registry_cache = _index_registry(_parse_registry(text), signature)
+    return _registry_cache
+
+
+def _save_registry(records: dict[str, dict]) -> None:
+    lines = [REGISTRY_HEADER]
+    for r in records.values():
+        line = f"{r['name']} {r['ip']} {r['port']} {r['registered_at'] or '-'}"
+        lines.append(f"{line} {r['description']}\n" if r["description"] else f"{line}\n")
+    atomic_write_text(SERVERS_CONF, "".join(lines), 0o600)
+
+
+def registry_conflict(name: str, ip: str, registry: dict | None = None) -> str | None:
+    """Return why *name*/*ip* cannot be registered as a new server, or None."""
+    if registry is None:
+        registry = load_server_registry()
+    if name in registry["by_name"]:
+        return f"Server '{name}' already registered"
+    existing = registry["by_ip"].get(ip)
+    if existing:
+        return f"IP '{ip}' already registered under '{existing['name']}'"
+    return None
+
+
+def register_servers(servers: list[dict]) -> None:
+    """Add or update registry records for *servers* in one locked, atomic rewrite.
+
+    Each server is a dict with ``name``, ``ip``, ``port`` and ``description``;
+    re-registering a name replaces its record.
+    """
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    with file_lock(SERVERS_LOCK):
+        records = dict(load_server_registry()["by_name"])
+        for srv in servers:
+            previous = records.get(srv["name"], {})
+            records[srv["name"]] = {
+                "name": srv["name"],
+                "ip": srv["ip"],
+                "port": int(srv["port"]),
+                "registered_at": previous.get("registered_at") or now,
+                "description": (srv.get("description") or "").strip(),
             }
-        )
-
-    return users
+        _save_registry(records)
 
 
-def find_user(username: str, users: list[dict]) -> dict | None:
-    return next((u for u in users if u["username"] == username), None)
+def unregister_servers(names: set[str]) -> list[str]:
+    """Drop *names* from the registry; return the ones that were registered."""
+    with file_lock(SERVERS_LOCK):
+        records = dict(load_server_registry()["by_name"])
+        removed = [name for name in records if name in names]
+        if removed:
+            for name in removed:
+                del records[name]
+            _save_registry(records)
+    return removed
 
 
 # ---------------------------------------------------------------------------
 # SSH config mutation
 # ---------------------------------------------------------------------------
 
-def remove_host_block(config_path: str | Path, server_name: str) -> tuple[bool, str | None]:
-    """Remove all Host blocks that include *server_name* from the given config file."""
+def _rewrite_host_line(header: str, aliases: list[str]) -> str:
+    """Return the Host line *header* naming only *aliases*, keeping its indent and keyword."""
+    stripped = header.strip()
+    indent = header[: len(header) - len(header.lstrip())]
+    keyword = _CONFIG_OPTION_RE.match(stripped).group(1)
+    return f"{indent}{keyword} {' '.join(aliases)}" + ("\n" if header.endswith("\n") else "")
+
+
+def patch_host_blocks(
+    text: str,
+    remove: set[str] = frozenset(),
+    replace: dict[str, str] | None = None,
+) -> tuple[str, list[str]]:
+    """Return *text* with the Host entries in *remove* dropped and those in *replace* rewritten.
+
+    Only the spans of the blocks involved change; the rest of the file is kept
+    as is. A block that also names other aliases keeps them, with just its
+    Host line rewritten. A replaced block is swapped for its new text in
+    place; replacements for aliases not in the file are appended. Also
+    returns the matched aliases, in file order.
+    """
+    replace = replace or {}
+    targets = remove | replace.keys()
+    parts: list[str] = []
+    matched: list[str] = []
+    pos = 0
+
+    for block in tokenize_ssh_config(text):
+        hit = [a for a in block.patterns if a in targets] if block.kind == "host" else []
+        if not hit:
+            continue
+        new_blocks = "".join(replace[a] for a in hit if a in replace and a not in matched)
+        matched.extend(a for a in hit if a not in matched)
+        kept = [a for a in block.patterns if a not in targets]
+
+        parts.append(text[pos:block.start])
+        if kept:
+            parts.append(text[block.start:block.header_start])
+            parts.append(_rewrite_host_line(text[block.header_start:block.header_end], kept))
+            parts.append(text[block.header_end:block.end])
+        parts.append(new_blocks)
+        pos = block.end
+
+    parts.append(text[pos:])
+    parts.extend(block for alias, block in replace.items() if alias not in matched)
+    return "".join(parts), matched
+
+
+def strip_host_blocks(text: str, server_names: set[str]) -> tuple[str, list[str]]:
+    """Return *text* without the Host entries for *server_names*, and the matched aliases.
+
+    Comment and blank lines directly above a Host line (e.g. its
+    ``# Description:``) go with that block, so removing one entry never
+    strips the description of the entry that follows it.
+    """
+    return patch_host_blocks(text, server_names)
+
+
+def _config_mode(config_path: Path) -> int:
+    """Mode to rewrite *config_path* with: its own if it is a regular file, else 0600."""
+    try:
+        st = config_path.lstat()
+    except FileNotFoundError:
+        return 0o600
+    return stat.S_IMODE(st.st_mode) if stat.S_ISREG(st.st_mode) else 0o600
+
+
+def remove_host_blocks(config_path: str | Path, server_names: set[str], user: dict) -> tuple[list[str], str | None]:
+    """Remove every Host block naming one of *server_names* from *user*'s config in a single rewrite.
+
+    The file is read with the user's permissions (see read_user_config()) and
+    replaced atomically (temp file + rename), owned by the user and keeping
+    its mode, only if something matched. Returns the removed aliases and an
+    error message, if any.
+    """
     config_path = Path(config_path)
     if not config_path.is_file():
-        return False, f"Config file not found: {config_path}"
+        return [], f"Config file not found: {config_path}"
 
     try:
-        lines = config_path.read_text().splitlines(keepends=True)
-        new_lines: list[str] = []
-        skip_block = False
+        text = read_user_config(config_path, user["username"], user["uid"], user["gid"])
+        new_text, removed = strip_host_blocks(text, server_names)
+        if removed:
+            atomic_write_text(config_path, new_text, _config_mode(config_path), user["uid"], user["gid"])
+            write_user_menu(config_path, new_text, user["uid"], user["gid"])
+        return removed, None
+    except OSError as exc:
+        return [], str(exc)
 
-        for line in lines:
-            stripped = line.strip()
-            if stripped.lower().startswith("host "):
-                block_hosts = stripped[5:].split()
-                skip_block = server_name in block_hosts
-            if not skip_block:
-                new_lines.append(line)
 
-        config_path.write_text("".join(new_lines))
-        return True, None
-    except OSError as exc:
-        return False, str(exc)
+def remove_host_block(config_path: str | Path, server_name: str, user: dict) -> tuple[bool, str | None]:
+    """Remove all Host blocks that include *server_name* from the given config file.
+
+    Returns whether the file named it (and was rewritten) and an error message, if any.
+    """
+    removed, err = remove_host_blocks(config_path, {server_name}, user)
+    return bool(removed), err
+
+
+def warn_included(server_names: Iterable[str], username: str) -> None:
+    """Report aliases a user has only through Included files, which are never edited."""
+    for name in server_names:
+        click.echo(f"Warning: '{name}' for '{username}' comes from an Included file; left unchanged.", err=True)
+
+
+# Each user's jump menu is precomputed next to their config so server/client.sh
+# can hand it to fzf as is. client.sh rebuilds it with the same rules (see
+# build_menu there) whenever the config is newer, so both must stay in step:
+# Host blocks of the file itself (not its includes) with a "# Description:"
+# comment and a HostName, first alias only, byte-sorted, a header row,
+# columns padded to the widest name and IP.
+MENU_FILE_NAME = "kangaroo_menu"
+
+
+def menu_rows(text: str) -> list[tuple[str, str, str]]:
+    """Return sorted (alias, HostName, description) rows for the jump menu."""
+    rows = []
+    for block in tokenize_ssh_config(text):
+        if block.kind != "host" or not block.patterns:
+            continue
+        hostname = next((v.split()[0] for k, v in block.options if k.lower() == "hostname" and v.split()), "")
+        description = block.description
+        if hostname and description:
+            rows.append((block.patterns[0], hostname, description))
+    return sorted(rows, key=lambda row: row[0].encode())
+
+
+def render_menu(rows: list[tuple[str, str, str]]) -> str:
+    name_w = max([4] + [len(row[0]) for row in rows])
+    ip_w = max([2] + [len(row[1]) for row in rows])
+    lines = [f"{'NAME':<{name_w}}  {'IP':<{ip_w}}  DESCRIPTION"]
+    lines.extend(f"{name:<{name_w}}  {ip:<{ip_w}}  {desc}" for name, ip, desc in rows)
+    return "\n".join(lines) + "\n"
 
 
-def append_host_block(config_path: Path, uid: int, gid: int, entry: str) -> None:
-    """Append a Host block to *config_path*, creating the file if necessary."""
-    config_path.parent.mkdir(mode=0o700, exist_ok=True)
-    with open(config_path, "a") as f:
-        f.write(entry)
-    os.chown(config_path, uid, gid)
-    os.chmod(config_path, 0o600)
+def write_user_menu(config_path: Path, text: str, uid: int, gid: int) -> None:
+    """Write the menu for the config at *config_path* (whose content is *text*).
+
+    Best effort: if it fails, the menu is left older than the config and
+    client.sh rebuilds it on the next redraw.
+    """
+    try:
+        atomic_write_text(config_path.parent / MENU_FILE_NAME, render_menu(menu_rows(text)), 0o600, uid, gid)
+    except OSError:
+        pass
+
+
+def config_aliases(text: str) -> set[str]:
+    """Return every alias named on a Host line of *text*."""
+    return {alias for block in tokenize_ssh_config(text) if block.kind == "host" for alias in block.patterns}
 
 
 # ---------------------------------------------------------------------------
@@ -252,7 +1144,7 @@ def ensure_kangaroo_key() -> Path:
     """Generate the shared kangaroo key pair if it does not exist yet."""
     if not KANGAROO_KEY.exists():
         click.echo("Generating SSH key...")
-        subprocess.run(
+        run_command(
             ["ssh-keygen", "-t", "rsa", "-b", "4096", "-f", str(KANGAROO_KEY), "-N", ""],
             check=True,
         )
@@ -265,7 +1157,7 @@ def ensure_tls_cert() -> tuple[Path, Path]:
     """Generate a persistent self-signed TLS certificate/key pair if they do not exist."""
     if not KANGAROO_TLS_KEY.exists() or not KANGAROO_TLS_CERT.exists():
         click.echo("Generating TLS certificate...")
-        subprocess.run(
+        run_command(
             [
                 "openssl", "req", "-x509", "-newkey", "rsa:2048",
                 "-keyout", str(KANGAROO_TLS_KEY),
@@ -283,55 +1175,183 @@ def ensure_tls_cert() -> tuple[Path, Path]:
     return KANGAROO_TLS_KEY, KANGAROO_TLS_CERT
 
 
+def _der_element(data: bytes, offset: int) -> tuple[int, int, int]:
+    """Return (tag, content start, end) of the DER element at *offset*."""
+    tag = data[offset]
+    length = data[offset + 1]
+    start = offset + 2
+    if length & 0x80:
+        count = length & 0x7F
+        if not 0 < count <= 4:
+            raise ValueError("unsupported DER length")
+        length = int.from_bytes(data[start:start + count], "big")
+        start += count
+    if start + length > len(data):
+        raise ValueError("truncated DER element")
+    return tag, start, start + length
+
+
+def cert_spki_der(cert_der: bytes) -> bytes:
+    """Return the DER SubjectPublicKeyInfo of an X.509 certificate.
+
+    Certificate ::= SEQUENCE { tbsCertificate, ... } and tbsCertificate is
+    SEQUENCE { [0] version OPTIONAL, serialNumber, signature, issuer,
+    validity, subject, subjectPublicKeyInfo, ... }, so the SPKI is the
+    sixth element, or the seventh when the explicit version tag is present.
+    """
+    tag, start, _ = _der_element(cert_der, 0)
+    if tag != 0x30:
+        raise ValueError("not a DER certificate")
+    tag, offset, _ = _der_element(cert_der, start)
+    if tag != 0x30:
+        raise ValueError("certificate has no tbsCertificate")
+    if cert_der[offset] == 0xA0:
+        offset = _der_element(cert_der, offset)[2]
+    for _ in range(5):  # serialNumber, signature, issuer, validity, subject
+        offset = _der_element(cert_der, offset)[2]
+    tag, _, end = _der_element(cert_der, offset)
+    if tag != 0x30:
+        raise ValueError("certificate has no subjectPublicKeyInfo")
+    return cert_der[offset:end]
+
+
+def _pem_certificate_der(pem: str) -> bytes:
+    import base64
+
+    m = re.search(r"-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----", pem, re.S)
+    if not m:
+        raise ValueError("no PEM certificate found")
+    return base64.b64decode("".join(m[1].split()))
+
+
 def get_cert_pin(cert_path: Path) -> str:
-    """Return the SHA-256 SPKI fingerprint (base64) for curl --pinnedpubkey."""
-    import hashlib
+    """Return the SHA-256 SPKI fingerprint (base64) for curl --pinnedpubkey.
+
+    Computed in-process from the certificate's DER and cached in a sidecar
+    ``.pin`` file next to it, keyed by the certificate's SHA-256 fingerprint,
+    so it is only recomputed when the certificate is replaced.
+    """
     import base64
+    import hashlib
+
+    cert_der = _pem_certificate_der(cert_path.read_text())
+    fingerprint = hashlib.sha256(cert_der).hexdigest()
+    pin_path = cert_path.with_suffix(".pin")
+    try:
+        cached = json.loads(pin_path.read_text())
+        if cached.get("fingerprint") == fingerprint and cached.get("pin"):
+            return cached["pin"]
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    pin = base64.b64encode(hashlib.sha256(cert_spki_der(cert_der)).digest()).decode()
+    try:
+        atomic_write_text(pin_path, json.dumps({"fingerprint": fingerprint, "pin": pin}) + "\n", 0o644)
+    except OSError:
+        pass  # the pin is cheap to recompute; a read-only /etc/ssh is fine
+    return pin
+
 
-    pubkey_pem = subprocess.run(
-        ["openssl", "x509", "-in", str(cert_path), "-pubkey", "-noout"],
-        capture_output=True, check=True, text=True,
-    ).stdout
+_KNOWN_HOSTS_LOCK = threading.Lock()
 
-    der_bytes = subprocess.run(
-        ["openssl", "pkey", "-pubin", "-outform", "DER"],
-        input=pubkey_pem, capture_output=True, check=True,
-    ).stdout
+# Provisioning steps for one host share a single master connection: the first
+# ssh authenticates, later ones ride on its control socket until
+# close_ssh_master() (or ControlPersist) ends it.
+PROVISION_CONTROL_PERSIST = "120"
 
-    return base64.b64encode(hashlib.sha256(der_bytes).digest()).decode()
+_CONTROL_PERSIST_RE = re.compile(r"^(yes|no|\d+[smhdw]?)$")
 
 
-def copy_key_to_remote(password: str, ssh_user: str, server_ip: str, port: int, public_key: Path) -> bool:
-    subprocess.run(
-        ["ssh-keygen", "-f", "/root/.ssh/known_hosts", "-R", server_ip],
+def _ssh_mux_options() -> list[str]:
+    SSH_CONTROL_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return [
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={SSH_CONTROL_DIR}/%C",
+        "-o", f"ControlPersist={PROVISION_CONTROL_PERSIST}",
+    ]
+
+
+def close_ssh_master(ssh_user: str, server_ip: str, port: int) -> None:
+    """Stop the provisioning master connection for a host, if one is running."""
+    run_command(
+        [
+            "ssh", "-O", "exit",
+            "-p", str(port),
+            "-o", f"ControlPath={SSH_CONTROL_DIR}/%C",
+            f"{ssh_user}@{server_ip}",
+        ],
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
     )
 
-    result = subprocess.run(
+
+def copy_key_to_remote(
+    password: str,
+    ssh_user: str,
+    server_ip: str,
+    port: int,
+    public_key: Path,
+    *,
+    batch: bool = False,
+    timeout: float | None = None,
+) -> bool:
+    """Install *public_key* on the remote with ssh-copy-id.
+
+    With *batch* the output is captured instead of shown, for unattended runs.
+    """
+    # ssh-keygen -R rewrites known_hosts; concurrent onboarding must not interleave.
+    with _KNOWN_HOSTS_LOCK:
+        run_command(
+            ["ssh-keygen", "-f", "/root/.ssh/known_hosts", "-R", server_ip],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    result = run_command(
         [
             "sshpass", "-p", password,
             "ssh-copy-id",
             "-p", str(port),
             "-o", "StrictHostKeyChecking=no",
+            *_ssh_mux_options(),
             "-i", str(public_key),
             f"{ssh_user}@{server_ip}",
-        ]
+        ],
+        capture_output=batch,
+        timeout=timeout,
     )
     return result.returncode == 0
 
 
-def run_remote_provision(ssh_user: str, server_ip: str, port: int, private_key: Path) -> None:
-    subprocess.run(
+def run_remote_provision(
+    ssh_user: str,
+    server_ip: str,
+    port: int,
+    private_key: Path,
+    *,
+    batch: bool = False,
+    timeout: float | None = None,
+) -> None:
+    """Run REMOTE_PROVISION_SCRIPT on the remote as *ssh_user*.
+
+    With *batch* ssh never prompts and its output is captured, so a failure
+    raises CalledProcessError carrying stderr instead of hanging on input.
+    """
+    run_command(
         [
             "ssh",
             "-p", str(port),
             "-o", "StrictHostKeyChecking=no",
+            *(["-o", "BatchMode=yes"] if batch else []),
+            *_ssh_mux_options(),
             "-i", str(private_key),
             f"{ssh_user}@{server_ip}",
             REMOTE_PROVISION_SCRIPT,
         ],
         check=True,
+        capture_output=batch,
+        text=batch,
+        timeout=timeout,
     )
 
 
@@ -357,20 +1377,25 @@ def resolve_auth(password: str) -> tuple[bool, str]:
 # Shared helper: configure local users for a new server
 # ---------------------------------------------------------------------------
 
-def configure_users_for_server(
-    name: str,
-    ip: str,
-    port: int,
-    description: str,
-    system_users: list[str],
-    private_key: Path,
-) -> None:
-    """Write SSH config entries for each local user and copy the kangaroo key."""
+def _validate_control_persist(value: str) -> str:
+    """Accept ssh_config ControlPersist values: yes, no, or a time like 600 / 10m."""
+    if not _CONTROL_PERSIST_RE.fullmatch(value):
+        raise ValueError(f"ControlPersist '{value}' must be yes, no or a time such as 600 or 10m")
+    return value
+
+
+def _host_block(name: str, ip: str, port: int, description: str, control_persist: str = "") -> str:
+    """Return the validated Host block Kangaroo writes for one server.
+
+    With *control_persist* the block multiplexes connections over a per-user
+    control socket in the user's runtime dir (/run/user/UID, never on NFS
+    homes), kept open for that long after the last session closes.
+    """
     name = _validate_hostname(name)
     ip = _validate_ip(ip)
     description = _validate_text_field(description or "none", "description")
 
-    config_entry = (
+    block = (
         f"\n# Description: {description}\n"
         f"Host {name}\n"
         f"    HostName {ip}\n"
@@ -378,33 +1403,150 @@ def configure_users_for_server(
         f"    Port {port}\n"
         f"    IdentityFile ~/.ssh/kangaroo_key_id_rsa\n"
     )
+    if control_persist:
+        block += (
+            f"    ControlMaster auto\n"
+            f"    ControlPath /run/user/%i/kangaroo-%C\n"
+            f"    ControlPersist {_validate_control_persist(control_persist)}\n"
+        )
+    return block
+
+
+KEY_INSTALL_WORKERS = 16
+
 
-    for username in system_users:
+def _key_is_current(dest: Path, key_data: bytes, uid: int, gid: int) -> bool:
+    """True if *dest* already holds *key_data* as a 0600 regular file owned by uid:gid."""
+    import hashlib
+
+    try:
+        st = os.lstat(dest)
+    except OSError:
+        return False
+    if (
+        not stat.S_ISREG(st.st_mode)
+        or stat.S_IMODE(st.st_mode) != 0o600
+        or (st.st_uid, st.st_gid) != (uid, gid)
+        or st.st_size != len(key_data)
+    ):
+        return False
+    try:
+        return hashlib.sha256(dest.read_bytes()).digest() == hashlib.sha256(key_data).digest()
+    except OSError:
+        return False
+
+
+def install_user_key(entry: pwd.struct_passwd, key_data: bytes) -> bool:
+    """Install the kangaroo private key as ~/.ssh/kangaroo_key_id_rsa for one user.
+
+    Users whose installed key already matches (content, owner, 0600) are
+    skipped; otherwise the key is written atomically with the right owner and
+    mode. Returns True if the file was (re)written.
+    """
+    ssh_dir = Path(entry.pw_dir) / ".ssh"
+    key_dest = ssh_dir / "kangaroo_key_id_rsa"
+    if _key_is_current(key_dest, key_data, entry.pw_uid, entry.pw_gid):
+        return False
+
+    if not ssh_dir.is_dir():
+        ssh_dir.mkdir(mode=0o700)
+        os.chown(ssh_dir, entry.pw_uid, entry.pw_gid)
+    atomic_write_bytes(key_dest, key_data, 0o600, entry.pw_uid, entry.pw_gid)
+    return True
+
+
+def host_blocks_for(servers: Iterable[dict], control_persist: str = "") -> dict[str, str]:
+    """Return {name: Host block} for server records, validating every field up front."""
+    return {
+        srv["name"]: _host_block(srv["name"], srv["ip"], srv["port"], srv["description"], control_persist)
+        for srv in servers
+    }
+
+
+def grant_user_hosts(entry: pwd.struct_passwd, blocks: dict[str, str], key_data: bytes) -> list[str]:
+    """Give one user the Host *blocks* they lack, with a single atomic config write.
+
+    Aliases the config already has a Host entry for are left alone, so the
+    file is only rewritten when something is missing. Returns the names added.
+    """
+    with timed_phase("key_copy"):
+        install_user_key(entry, key_data)
+    config_path = Path(entry.pw_dir) / ".ssh" / "config"
+    with timed_phase("config_write"):
+        text = read_user_config(config_path, entry.pw_name, entry.pw_uid, entry.pw_gid)
+        present = config_aliases(text)
+        added = [name for name in blocks if name not in present]
+        if added:
+            text += "".join(blocks[name] for name in added)
+            atomic_write_text(config_path, text, _config_mode(config_path), entry.pw_uid, entry.pw_gid)
+            write_user_menu(config_path, text, entry.pw_uid, entry.pw_gid)
+    return added
+
+
+def resolve_entries(usernames: Iterable[str]) -> list[pwd.struct_passwd]:
+    """Return passwd entries for *usernames*, reporting and skipping unknown ones."""
+    entries: list[pwd.struct_passwd] = []
+    for username in usernames:
         try:
-            entry = pwd.getpwnam(username)
+            entries.append(pwd.getpwnam(username))
         except KeyError:
             click.echo(f"User '{username}' not found. Skipping.")
-            continue
+    return entries
+
+
+def configure_users_for_servers(
+    servers: list[dict],
+    system_users: list[str],
+    private_key: Path,
+    control_persist: str = "",
+) -> None:
+    """Write Host blocks for several servers with one config write and key install per user.
 
-        home = Path(entry.pw_dir)
-        key_dest = home / ".ssh" / "kangaroo_key_id_rsa"
+    Each server is a dict with ``name``, ``ip``, ``port`` and ``description``.
+    Users are configured concurrently on KEY_INSTALL_WORKERS threads.
+    """
+    from concurrent.futures import ThreadPoolExecutor
 
-        subprocess.run(["cp", str(private_key), str(key_dest)], check=True)
-        os.chown(key_dest, entry.pw_uid, entry.pw_gid)
-        os.chmod(key_dest, 0o600)
+    blocks = host_blocks_for(servers, control_persist)
+    if not blocks:
+        return
 
-        append_host_block(
-            home / ".ssh" / "config",
-            entry.pw_uid,
-            entry.pw_gid,
-            config_entry,
-        )
-        click.echo(f"Configured SSH for user '{username}'.")
+    entries = resolve_entries(system_users)
+    key_data = private_key.read_bytes()
+
+    def configure(entry: pwd.struct_passwd) -> str:
+        try:
+            grant_user_hosts(entry, blocks, key_data)
+        except OSError as exc:
+            # e.g. a config symlinked somewhere the user cannot read; don't let
+            # one user's file block the registration for everyone else.
+            return str(exc)
+        return ""
+
+    with span("configure users") as args, ThreadPoolExecutor(max_workers=KEY_INSTALL_WORKERS) as pool:
+        args["users"] = len(entries)
+        for entry, err in zip(entries, pool.map(configure, entries)):
+            if err:
+                click.echo(f"Skipping user '{entry.pw_name}': {err}", err=True)
+            else:
+                click.echo(f"Configured SSH for user '{entry.pw_name}'.")
+
+    with timed_phase("registry_write"):
+        register_servers(servers)
 
-    # Persist server record
-    with open(SERVERS_CONF, "a") as f:
-        f.write(f"{name} {ip}\n")
-    os.chmod(SERVERS_CONF, 0o600)
+
+def configure_users_for_server(
+    name: str,
+    ip: str,
+    port: int,
+    description: str,
+    system_users: list[str],
+    private_key: Path,
+    control_persist: str = "",
+) -> None:
+    """Write SSH config entries for each local user and copy the kangaroo key."""
+    server = {"name": name, "ip": ip, "port": port, "description": description}
+    configure_users_for_servers([server], system_users, private_key, control_persist)
 
 
 def all_system_users() -> list[str]:
@@ -418,117 +1560,989 @@ def all_system_users() -> list[str]:
 
 
 # ---------------------------------------------------------------------------
-# Flask application (lazy import)
+# Access policy sync
 # ---------------------------------------------------------------------------
 
-def build_flask_app(master_port: int, configured_master_ip: str = "", cert_pin: str = "") -> "Flask":  # noqa: F821
-    from flask import Flask, jsonify, request, send_file, abort
-    import io
-    import tempfile
-
-    app = Flask(__name__)
+# A policy file is JSON mapping users to the registered servers they may reach:
+#     {"users": {"bob": ["web01", "db01"], "alice": "all"}}
+# Only registered servers are managed; other Host entries in a config are
+# never touched.
 
-    # ------------------------------------------------------------------ /key
-    @app.route("/key")
-    def route_key():
-        expected_token = get_or_create_token()
-        provided_token = request.args.get("token", "")
-        if not secrets.compare_digest(provided_token, expected_token):
-            abort(403)
-        pub = Path(f"{KANGAROO_KEY}.pub")
-        if not pub.is_file():
-            return jsonify({"error": "Key not generated yet. Run: kangaroo add-server first."}), 404
-        return pub.read_text(), 200, {"Content-Type": "text/plain"}
+def load_access_policy(path: Path, registry: dict[str, dict]) -> dict[str, list[str]]:
+    """Return {username: [server names]} from the policy at *path*; ValueError if invalid."""
+    try:
+        data = json.loads(path.read_text())
+    except ValueError as exc:
+        raise ValueError(f"{path}: {exc}") from None
+    users = data.get("users") if isinstance(data, dict) else None
+    if not isinstance(users, dict):
+        raise ValueError(f'{path}: expected {{"users": {{username: [servers] or "all"}}}}')
+
+    policy: dict[str, list[str]] = {}
+    unknown: set[str] = set()
+    for username, servers in users.items():
+        if servers == "all":
+            servers = list(registry)
+        elif not isinstance(servers, list) or not all(isinstance(n, str) for n in servers):
+            raise ValueError(f"{path}: servers for '{username}' must be a list of names or \"all\"")
+        unknown.update(n for n in servers if n not in registry)
+        policy[username] = list(dict.fromkeys(servers))
+    if unknown:
+        raise ValueError(f"{path}: not registered: {', '.join(sorted(unknown))}")
+    return policy
+
+
+def _block_is_current(config: dict[str, str], server: dict) -> bool:
+    """True if a parsed Host entry still points where the registry says."""
+    options = {key.lower(): value for key, value in config.items()}
+    return (
+        options.get("hostname") == server["ip"]
+        and options.get("port", "22") == str(server["port"])
+        and options.get("user") == "kangaroo"
+    )
 
-    # ------------------------------------------------------------ /download
-    @app.route("/download")
-    def route_download():
-        """Return the slave bootstrap script as a downloadable file."""
-        expected_token = get_or_create_token()
-        provided_token = request.args.get("token", "")
-        if not secrets.compare_digest(provided_token, expected_token):
-            abort(403)  # Forbidden
 
-        if configured_master_ip:
-            master_ip = configured_master_ip
+def plan_access_sync(
+    users: dict[str, dict],
+    policy: dict[str, list[str]],
+    registry: dict[str, dict],
+    prune: bool = False,
+) -> list[dict]:
+    """Diff scanned *users* against *policy*; return one change record per user to touch.
+
+    Each record has ``username``, ``home`` and the ``add``, ``remove`` and
+    ``update`` (registered host whose HostName/Port/User drifted) lists, plus
+    ``included``: hosts that need a change but are defined (or shadowed) by
+    an Included file, which is never edited. Removals and updates are planned
+    against the user's own file, read again here, so applying a plan always
+    converges. A record whose config cannot be read carries ``error``.
+    With *prune*, users missing from the policy lose every registered host.
+    """
+    plan = []
+    for username, user in users.items():
+        if username in policy:
+            desired = policy[username]
+        elif prune:
+            desired = []
         else:
-            raw_host = request.host.split(":")[0]
+            continue
+        config_map = user["config_map"]
+        wanted = set(desired)
+        unwanted = [host for host in user["hosts"] if host in registry and host not in wanted]
+        stale = [
+            host for host in desired
+            if host in config_map and not _block_is_current(config_map[host], registry[host])
+        ]
+        change = {
+            "username": username,
+            "home": user["home"],
+            "add": [name for name in desired if name not in config_map],
+            "remove": [],
+            "update": [],
+            "included": [],
+        }
+        if unwanted or stale:
+            config_path = Path(user["home"]) / ".ssh" / "config"
             try:
-                master_ip = _validate_ip(raw_host)
-            except ValueError:
-                return jsonify({
-                    "error": (
-                        f"Host header '{raw_host}' is not a valid IP address. "
-                        "Start the API with --master-ip <IP> to set it explicitly."
-                    )
-                }), 500
+                text = read_user_config(config_path, username, user["uid"], user["gid"])
+            except (OSError, ValueError) as exc:
+                plan.append({**change, "error": str(exc)})
+                continue
+            own = host_options(tokenize_ssh_config(text, str(config_path)))
+            change["remove"] = [host for host in unwanted if host in own]
+            change["update"] = [
+                host for host in stale if host in own and not _block_is_current(own[host], registry[host])
+            ]
+            change["included"] = [host for host in unwanted if host not in own] + [
+                host for host in stale if host not in change["update"]
+            ]
+        if any(change[key] for key in ("add", "remove", "update", "included")):
+            plan.append(change)
+    return plan
+
+
+def apply_user_sync(entry: pwd.struct_passwd, change: dict, blocks: dict[str, str], key_data: bytes) -> None:
+    """Apply one user's planned change with a single atomic config write.
+
+    Nothing is written if the config would come out unchanged, so its mtime
+    (and with it the access index and the menu) stays valid.
+    """
+    if change["add"]:
+        install_user_key(entry, key_data)
+    config_path = Path(entry.pw_dir) / ".ssh" / "config"
+    text = read_user_config(config_path, entry.pw_name, entry.pw_uid, entry.pw_gid)
+    new_text, _ = patch_host_blocks(
+        text,
+        set(change["remove"]),
+        {name: blocks[name] for name in change["update"] + change["add"]},
+    )
+    if new_text == text:
+        return
+    atomic_write_text(config_path, new_text, _config_mode(config_path), entry.pw_uid, entry.pw_gid)
+    write_user_menu(config_path, new_text, entry.pw_uid, entry.pw_gid)
 
-        slave_script = _build_slave_script(master_ip, master_port, expected_token, cert_pin)
-        buf = io.BytesIO(slave_script.encode())
-        buf.seek(0)
-        return send_file(
-            buf,
-            mimetype="text/x-sh",
-            as_attachment=True,
-            download_name="kangaroo_slave_setup.sh",
-        )
 
-    # ------------------------------------------------------------- /connect
-    @app.route("/connect", methods=["POST"])
-    def route_connect():
-        """Called by slave after it has set itself up."""
-        data = request.get_json(force=True, silent=True) or {}
+# ---------------------------------------------------------------------------
+# Key rotation
+# ---------------------------------------------------------------------------
 
-        # Token validation
-        token = get_or_create_token()
-        if not secrets.compare_digest(data.get("token", ""), token):
-            return jsonify({"error": "Invalid token"}), 403
+# A rotation replaces the shared kangaroo key on every registered host and in
+# every user's ~/.ssh. On the remotes the key is authorized for two logins:
+# the kangaroo user and the provisioning user it was first copied to
+# (add-server --user, root for self-registered slaves); both are rotated.
+# Progress is kept per host in KEY_ROTATION_STATE so an interrupted run can
+# be resumed or rolled back:
+#   1. add     new public key appended for both remote logins (old key)
+#   2. verify  both logins work with the new key
+#   3. swap    new key becomes KANGAROO_KEY (old one kept as .old) and is
+#              installed for every user that had the old one
+#   4. clean   old public key removed for both logins (new key)
+KEY_ROTATION_STATE = SCRIPT_DIR / ".kangaroo_key_rotation.json"
+NEW_KANGAROO_KEY = KANGAROO_KEY.with_name(KANGAROO_KEY.name + ".new")
+OLD_KANGAROO_KEY = KANGAROO_KEY.with_name(KANGAROO_KEY.name + ".old")
+
+
+def _move_key_pair(src: Path, dst: Path) -> None:
+    if src.exists():
+        os.replace(src, dst)
+    if Path(f"{src}.pub").exists():
+        os.replace(f"{src}.pub", f"{dst}.pub")
+
+
+def _authorize_key_script(pub: str) -> str:
+    blob = shlex.quote(pub.split()[1])
+    return (
+        "umask 077; mkdir -p ~/.ssh; touch ~/.ssh/authorized_keys; "
+        f"grep -qF {blob} ~/.ssh/authorized_keys || printf '%s\\n' {shlex.quote(pub)} >> ~/.ssh/authorized_keys"
+    )
+
+
+def _revoke_key_script(pub: str) -> str:
+    # Rewrite in place (cat >) so the file keeps its inode, owner and mode.
+    blob = shlex.quote(pub.split()[1])
+    return (
+        "f=~/.ssh/authorized_keys; [ -f \"$f\" ] || exit 0; "
+        f"grep -vF {blob} \"$f\" > \"$f.kangaroo\"; cat \"$f.kangaroo\" > \"$f\"; rm -f \"$f.kangaroo\""
+    )
+
+
+def run_remote_as(server: dict, login: str, key: Path, command: str, timeout: float) -> str:
+    """Run *command* on *server* as *login*, authenticating only with *key*.
+
+    Returns "" on success, otherwise a one-line error.
+    """
+    try:
+        result = run_command(
+            [
+                "ssh", "-i", str(key), "-p", str(server["port"]),
+                "-o", "IdentitiesOnly=yes",
+                "-o", "BatchMode=yes",
+                "-o", "StrictHostKeyChecking=accept-new",
+                "-o", f"ConnectTimeout={max(1, int(timeout))}",
+                f"{login}@{server['ip']}",
+                command,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+            stdin=subprocess.DEVNULL,
+        )
+    except subprocess.TimeoutExpired:
+        return f"timed out after {timeout:g}s"
+    except OSError as exc:
+        return str(exc)
+    if result.returncode == 0:
+        return ""
+    lines = result.stderr.strip().splitlines()
+    return f"exit {result.returncode}" + (f": {lines[-1]}" if lines else "")
+
+
+def load_key_rotation() -> dict | None:
+    try:
+        return json.loads(KEY_ROTATION_STATE.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def save_key_rotation(state: dict) -> None:
+    atomic_write_text(KEY_ROTATION_STATE, json.dumps(state, indent=2) + "\n")
+
+
+def rotation_logins(state: dict) -> list[str]:
+    """Return the remote logins whose authorized_keys hold the shared key."""
+    ssh_user = state.get("ssh_user", "root")
+    return ["kangaroo"] if ssh_user == "kangaroo" else ["kangaroo", ssh_user]
+
+
+def run_for_logins(state: dict, server: dict, key: Path, command: str, timeout: float) -> str:
+    """Run *command* as every rotation login in turn; return the first error, prefixed with its login."""
+    for login in rotation_logins(state):
+        error = run_remote_as(server, login, key, command, timeout)
+        if error:
+            return f"{login}: {error}"
+    return ""
+
+
+def start_key_rotation(key_type: str, ssh_user: str = "root") -> dict:
+    """Generate the new key pair and record a rotation over every registered host."""
+    NEW_KANGAROO_KEY.unlink(missing_ok=True)
+    Path(f"{NEW_KANGAROO_KEY}.pub").unlink(missing_ok=True)
+    cmd = ["ssh-keygen", "-q", "-t", key_type, "-f", str(NEW_KANGAROO_KEY), "-N", ""]
+    if key_type == "rsa":
+        cmd += ["-b", "4096"]
+    run_command(cmd + ["-C", f"kangaroo@{socket.gethostname()}"], check=True)
+    state = {
+        "started": datetime.now().strftime(_LOG_TIME_FORMAT),
+        "key_type": key_type,
+        "ssh_user": ssh_user,
+        "old_pub": Path(f"{KANGAROO_KEY}.pub").read_text().strip(),
+        "new_pub": Path(f"{NEW_KANGAROO_KEY}.pub").read_text().strip(),
+        "swapped": False,
+        "hosts": {
+            name: {"ip": r["ip"], "port": r["port"], "added": [], "verified": False, "cleaned": False, "error": ""}
+            for name, r in load_server_registry()["by_name"].items()
+        },
+    }
+    save_key_rotation(state)
+    return state
+
+
+def rotation_keys(state: dict) -> tuple[Path, Path]:
+    """Return where the (old, new) private keys currently are."""
+    if state["swapped"]:
+        return OLD_KANGAROO_KEY, KANGAROO_KEY
+    return KANGAROO_KEY, NEW_KANGAROO_KEY
+
+
+def for_rotation_hosts(state: dict, names: list[str], step, workers: int) -> None:
+    """Run step(name, host) -> error for *names* concurrently, saving state after each host."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    lock = threading.Lock()
+
+    def run(name: str) -> None:
+        host = state["hosts"][name]
+        error = step(name, host)
+        with lock:
+            host["error"] = error
+            save_key_rotation(state)
+        click.echo(f"  {name}: {'failed: ' + error if error else 'ok'}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, names))
+
+
+def swap_kangaroo_key(state: dict) -> int:
+    """Make the new key KANGAROO_KEY and install it for every user holding the old one.
+
+    Safe to repeat after an interruption. Returns how many users were updated.
+    """
+    if NEW_KANGAROO_KEY.exists():
+        if KANGAROO_KEY.exists():
+            _move_key_pair(KANGAROO_KEY, OLD_KANGAROO_KEY)
+        _move_key_pair(NEW_KANGAROO_KEY, KANGAROO_KEY)
+    state["swapped"] = True
+    save_key_rotation(state)
+    return _reinstall_user_keys()
+
+
+def _reinstall_user_keys() -> int:
+    from concurrent.futures import ThreadPoolExecutor
+
+    key_data = KANGAROO_KEY.read_bytes()
+    entries = [e for e in _login_entries() if (Path(e.pw_dir) / ".ssh" / "kangaroo_key_id_rsa").exists()]
+    with ThreadPoolExecutor(max_workers=KEY_INSTALL_WORKERS) as pool:
+        return sum(pool.map(lambda e: install_user_key(e, key_data), entries))
+
+
+def advance_key_rotation(state: dict, workers: int, timeout: float) -> bool:
+    """Carry a rotation as far as it can go; True once it is complete.
+
+    Stops before the swap if any host could not be verified with the new
+    key, and before finishing if the old key could not be removed somewhere;
+    in both cases the state is kept for a later resume or rollback.
+    """
+    registered = load_server_registry()["by_name"]
+    for name in [n for n in state["hosts"] if n not in registered]:
+        del state["hosts"][name]  # decommissioned since the rotation started
+    save_key_rotation(state)
+    old_key, new_key = rotation_keys(state)
+
+    def add_and_verify(name: str, host: dict) -> str:
+        for login in rotation_logins(state):
+            if login not in host["added"]:
+                error = run_remote_as(host, login, old_key, _authorize_key_script(state["new_pub"]), timeout)
+                if error:
+                    return f"{login}: {error}"
+                host["added"].append(login)
+        error = run_for_logins(state, host, new_key, "true", timeout)
+        host["verified"] = not error
+        return error and f"new key rejected: {error}"
+
+    pending = [n for n, h in state["hosts"].items() if not h["verified"]]
+    if pending:
+        click.echo(f"Adding and verifying the new key on {len(pending)} host(s)...")
+        for_rotation_hosts(state, pending, add_and_verify, workers)
+    if not all(h["verified"] for h in state["hosts"].values()):
+        return False
+
+    if not state["swapped"]:
+        updated = swap_kangaroo_key(state)
+        click.echo(f"Installed the new key for {updated} user(s).")
+        old_key, new_key = rotation_keys(state)
+
+    def clean(name: str, host: dict) -> str:
+        error = run_for_logins(state, host, new_key, _revoke_key_script(state["old_pub"]), timeout)
+        host["cleaned"] = not error
+        return error
+
+    pending = [n for n, h in state["hosts"].items() if not h["cleaned"]]
+    if pending:
+        click.echo(f"Removing the old key from {len(pending)} host(s)...")
+        for_rotation_hosts(state, pending, clean, workers)
+    if not all(h["cleaned"] for h in state["hosts"].values()):
+        return False
+
+    OLD_KANGAROO_KEY.unlink(missing_ok=True)
+    Path(f"{OLD_KANGAROO_KEY}.pub").unlink(missing_ok=True)
+    KEY_ROTATION_STATE.unlink(missing_ok=True)
+    return True
+
+
+def rollback_key_rotation(state: dict, workers: int, timeout: float) -> bool:
+    """Undo a rotation at whatever step it stopped; True if every host was restored."""
+    old_key, new_key = rotation_keys(state)
+    old_pub, new_pub = state["old_pub"], state["new_pub"]
+
+    def restore(name: str, host: dict) -> str:
+        if host["verified"]:
+            # The old key may be gone for some logins; put it back while the new one still works.
+            error = run_for_logins(state, host, new_key, _authorize_key_script(old_pub), timeout)
+            if error:
+                return error
+            host["cleaned"] = host["verified"] = False
+        for login in list(host["added"]):
+            error = run_remote_as(host, login, old_key, _revoke_key_script(new_pub), timeout)
+            if error:
+                return f"{login}: {error}"
+            host["added"].remove(login)
+        return ""
+
+    for_rotation_hosts(state, list(state["hosts"]), restore, workers)
+    if any(h["added"] or h["verified"] for h in state["hosts"].values()):
+        return False
+
+    if state["swapped"]:
+        _move_key_pair(KANGAROO_KEY, NEW_KANGAROO_KEY)
+        _move_key_pair(OLD_KANGAROO_KEY, KANGAROO_KEY)
+        state["swapped"] = False
+        save_key_rotation(state)
+        _reinstall_user_keys()
+    NEW_KANGAROO_KEY.unlink(missing_ok=True)
+    Path(f"{NEW_KANGAROO_KEY}.pub").unlink(missing_ok=True)
+    KEY_ROTATION_STATE.unlink(missing_ok=True)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Slave registration queue
+# ---------------------------------------------------------------------------
+
+# /connect only validates and enqueues; a single writer thread applies the
+# registrations one at a time, so concurrent slaves never race on
+# jump_servers.conf or on the same users' configs.
+REGISTRATION_JOBS_KEPT = 10000
+
+_registration_queue: queue.Queue[dict] = queue.Queue()
+_registration_jobs: dict[str, dict] = {}
+_registration_lock = threading.Lock()
+_registration_worker: threading.Thread | None = None
+
+
+def _registered_conflict(name: str, ip: str) -> str | None:
+    """Return why *name*/*ip* cannot be registered, or None. Caller holds the lock."""
+    conflict = registry_conflict(name, ip)
+    if conflict:
+        return conflict
+
+    for job in _registration_jobs.values():
+        if job["status"] not in ("queued", "running"):
+            continue
+        if job["server"] == name:
+            return f"Server '{name}' is already being registered"
+        if job["ip"] == ip:
+            return f"IP '{ip}' is already being registered under '{job['server']}'"
+    return None
+
+
+def submit_registration(name: str, ip: str, port: int, description: str, users: list[str]) -> tuple[dict | None, str | None]:
+    """Queue a validated slave registration; return (job, None) or (None, conflict)."""
+    global _registration_worker
+
+    with _registration_lock:
+        conflict = _registered_conflict(name, ip)
+        if conflict:
+            return None, conflict
+
+        job = {
+            "id": secrets.token_hex(8),
+            "status": "queued",
+            "server": name,
+            "ip": ip,
+            "port": port,
+            "description": description,
+            "users": users,
+            "submitted_at": time.time(),
+            "finished_at": None,
+            "error": None,
+        }
+        _registration_jobs[job["id"]] = job
+
+        # Forget the oldest finished jobs (dicts keep insertion order).
+        excess = len(_registration_jobs) - REGISTRATION_JOBS_KEPT
+        for job_id in [j for j, v in _registration_jobs.items() if v["status"] in ("done", "failed")][:max(excess, 0)]:
+            del _registration_jobs[job_id]
+
+        if _registration_worker is None or not _registration_worker.is_alive():
+            _registration_worker = threading.Thread(
+                target=_run_registrations, name="kangaroo-registrations", daemon=True
+            )
+            _registration_worker.start()
+
+    _registration_queue.put(job)
+    return job, None
+
+
+def get_registration(job_id: str) -> dict | None:
+    """Return a snapshot of a registration job's public fields."""
+    with _registration_lock:
+        job = _registration_jobs.get(job_id)
+        if job is None:
+            return None
+        return {k: v for k, v in job.items() if k != "users"}
+
+
+def _run_registrations() -> None:
+    while True:
+        job = _registration_queue.get()
+        with _registration_lock:
+            job["status"] = "running"
 
         try:
-            name = _validate_hostname(data.get("hostname", "").strip())
-            ip = _validate_ip(data.get("ip", "").strip())
-            description = _validate_text_field(data.get("description", ""), "description")
-        except ValueError as exc:
-            return jsonify({"error": str(exc)}), 400
+            private_key = ensure_kangaroo_key()
+            configure_users_for_server(
+                job["server"], job["ip"], job["port"], job["description"], job["users"], private_key
+            )
+        except Exception as exc:
+            status, error = "failed", str(exc)
+            click.echo(f"\n🦘 Registering slave '{job['server']}' failed: {exc}", err=True)
+        else:
+            status, error = "done", None
+            click.echo(
+                f"\n🦘 Slave '{job['server']}' ({job['ip']}:{job['port']}) registered and configured for all users."
+            )
 
+        metric_add("registration_jobs", (status,))
+        with _registration_lock:
+            job["status"] = status
+            job["error"] = error
+            job["finished_at"] = time.time()
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+# In-process counters, gauges and histograms for the master API, rendered in
+# the Prometheus text format by /metrics. Everything is keyed by a tuple of
+# label values and guarded by one lock; observing is a dict update.
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Any other request method is counted as "other", so clients cannot grow the label set.
+METRIC_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"})
+
+_metrics_lock = threading.Lock()
+_metrics: dict[str, dict] = {
+    "requests": {},  # (route, method, status) -> count
+    "in_flight": {},  # (route,) -> gauge
+    "latency": {},  # (route,) -> [bucket counts..., sum, count]
+    "phases": {},  # (phase,) -> histogram
+    "registrations": {},  # (status,) -> count
+    "registration_jobs": {},  # (result,) -> count
+    "tls_handshakes": {},  # (resumed,) -> histogram
+}
+
+_METRIC_HELP = {
+    "requests": ("kangaroo_http_requests_total", "counter", "HTTP requests handled", ("route", "method", "status")),
+    "in_flight": ("kangaroo_http_requests_in_flight", "gauge", "HTTP requests being handled", ("route",)),
+    "latency": ("kangaroo_http_request_duration_seconds", "histogram", "HTTP request latency", ("route",)),
+    "phases": (
+        "kangaroo_registration_phase_seconds", "histogram",
+        "Time spent in each registration phase (key_copy and config_write are per user)", ("phase",),
+    ),
+    "registrations": ("kangaroo_registrations_total", "counter", "/connect responses by status code", ("status",)),
+    "registration_jobs": ("kangaroo_registration_jobs_total", "counter", "Queued registrations by outcome", ("result",)),
+    "tls_handshakes": ("kangaroo_tls_handshake_seconds", "histogram", "TLS handshake time per connection", ("resumed",)),
+}
+
+
+def metric_add(name: str, labels: tuple, amount: float = 1) -> None:
+    with _metrics_lock:
+        series = _metrics[name]
+        series[labels] = series.get(labels, 0) + amount
+
+
+def metric_observe(name: str, labels: tuple, seconds: float) -> None:
+    import bisect
+
+    with _metrics_lock:
+        hist = _metrics[name].get(labels)
+        if hist is None:
+            hist = _metrics[name][labels] = [0] * len(METRIC_BUCKETS) + [0.0, 0]
+        bucket = bisect.bisect_left(METRIC_BUCKETS, seconds)
+        if bucket < len(METRIC_BUCKETS):  # beyond the last bound only +Inf counts it
+            hist[bucket] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+
+@contextmanager
+def timed_phase(phase: str):
+    """Record how long the block takes in the registration phase histogram (and as a span)."""
+    started = time.perf_counter()
+    try:
+        with span(phase):
+            yield
+    finally:
+        metric_observe("phases", (phase,), time.perf_counter() - started)
+
+
+def _metric_labels(names: tuple, values: tuple, le: str = "") -> str:
+    pairs = list(zip(names, values)) + ([("le", le)] if le else [])
+    if not pairs:
+        return ""
+    escaped = (
+        (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for n, v in pairs
+    )
+    return "{" + ",".join(f'{n}="{v}"' for n, v in escaped) + "}"
+
+
+def render_metrics() -> str:
+    """Return every metric in the Prometheus text exposition format."""
+    with _metrics_lock:
+        snapshot = {
+            name: {labels: list(v) if isinstance(v, list) else v for labels, v in series.items()}
+            for name, series in _metrics.items()
+        }
+
+    lines = []
+    for name, (metric, kind, help_text, label_names) in _METRIC_HELP.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for labels, value in sorted(snapshot[name].items()):
+            if kind != "histogram":
+                lines.append(f"{metric}{_metric_labels(label_names, labels)} {value:g}")
+                continue
+            cumulative = 0
+            for bound, count in zip(METRIC_BUCKETS, value):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_metric_labels(label_names, labels, f'{bound:g}')} {cumulative}")
+            lines.append(f"{metric}_bucket{_metric_labels(label_names, labels, '+Inf')} {value[-1]}")
+            lines.append(f"{metric}_sum{_metric_labels(label_names, labels)} {value[-2]:.6f}")
+            lines.append(f"{metric}_count{_metric_labels(label_names, labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Flask application (lazy import)
+# ---------------------------------------------------------------------------
+
+def build_flask_app(
+    master_port: int,
+    configured_master_ip: str = "",
+    cert_pin: str = "",
+    metrics_localhost: bool = False,
+) -> "Flask":  # noqa: F821
+    from flask import Flask, Response, g, jsonify, request, abort
+    import hashlib
+
+    app = Flask(__name__)
+
+    # ------------------------------------------------------- request metrics
+    @app.before_request
+    def metrics_start():
+        g.metrics_route = request.url_rule.rule if request.url_rule else "unmatched"
+        g.metrics_started = time.perf_counter()
+        metric_add("in_flight", (g.metrics_route,))
+
+    @app.after_request
+    def metrics_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def metrics_finish(exc):
+        route = g.get("metrics_route")
+        if route is None:
+            return
+        metric_add("in_flight", (route,), -1)
+        method = request.method if request.method in METRIC_METHODS else "other"
+        metric_add("requests", (route, method, str(g.get("metrics_status", 500))))
+        metric_observe("latency", (route,), time.perf_counter() - g.metrics_started)
+
+    # Rendered slave scripts per master IP: (token, body, etag). The token is
+    # part of the key so rotating .kangaroo_token re-renders on next fetch.
+    script_cache: dict[str, tuple[str, bytes, str]] = {}
+
+    # ------------------------------------------------------------------ /key
+    @app.route("/key")
+    def route_key():
+        expected_token = get_or_create_token()
+        provided_token = request.args.get("token", "")
+        if not secrets.compare_digest(provided_token, expected_token):
+            abort(403)
         try:
-            ssh_port = int(data.get("ssh_port", 22))
-        except (ValueError, TypeError):
-            return jsonify({"error": "ssh_port must be an integer"}), 400
-        if not (1 <= ssh_port <= 65535):
-            return jsonify({"error": "ssh_port out of range"}), 400
-
-        if not name or not ip:
-            return jsonify({"error": "hostname and ip are required"}), 400
-
-		# prevent duplicates
-        if SERVERS_CONF.exists():
-            with open(SERVERS_CONF) as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) < 2:
-                        continue
-                    existing_name, existing_ip = parts[0], parts[1]
-                    if existing_name == name:
-                        return jsonify({"error": f"Server '{name}' already registered"}), 409
-                    if existing_ip == ip:
-                        return jsonify({"error": f"IP '{ip}' already registered under '{existing_name}'"}), 409
+            pub_key = read_text_cached(Path(f"{KANGAROO_KEY}.pub"))
+        except FileNotFoundError:
+            return jsonify({"error": "Key not generated yet. Run: kangaroo add-server first."}), 404
+        return pub_key, 200, {"Content-Type": "text/plain"}
+
+    # ------------------------------------------------------------ /download
+    @app.route("/download")
+    def route_download():
+        """Return the slave bootstrap script as a downloadable file."""
+        expected_token = get_or_create_token()
+        provided_token = request.args.get("token", "")
+        if not secrets.compare_digest(provided_token, expected_token):
+            abort(403)  # Forbidden
+
+        if configured_master_ip:
+            master_ip = configured_master_ip
+        else:
+            raw_host = request.host.split(":")[0]
+            try:
+                master_ip = _validate_ip(raw_host)
+            except ValueError:
+                return jsonify({
+                    "error": (
+                        f"Host header '{raw_host}' is not a valid IP address. "
+                        "Start the API with --master-ip <IP> to set it explicitly."
+                    )
+                }), 500
+
+        cached = script_cache.get(master_ip)
+        if cached is None or cached[0] != expected_token:
+            body = _build_slave_script(master_ip, master_port, expected_token, cert_pin).encode()
+            if len(script_cache) >= 64:
+                script_cache.clear()
+            cached = script_cache[master_ip] = (expected_token, body, hashlib.sha256(body).hexdigest()[:32])
+
+        _, body, etag = cached
+        response = Response(
+            body,
+            mimetype="text/x-sh",
+            headers={"Content-Disposition": "attachment; filename=kangaroo_slave_setup.sh"},
+        )
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    # ------------------------------------------------------------- /connect
+    @app.route("/connect", methods=["POST"])
+    def route_connect():
+        """Called by slave after it has set itself up."""
+        response = _connect()
+        metric_add("registrations", (str(response[1]),))
+        return response
+
+    def _connect():
+        with timed_phase("validation"):
+            data = request.get_json(force=True, silent=True) or {}
+
+            # Token validation
+            with timed_phase("token_read"):
+                token = get_or_create_token()
+            if not secrets.compare_digest(data.get("token", ""), token):
+                return jsonify({"error": "Invalid token"}), 403
+
+            try:
+                name = _validate_hostname(data.get("hostname", "").strip())
+                ip = _validate_ip(data.get("ip", "").strip())
+                description = _validate_text_field(data.get("description", ""), "description")
+            except ValueError as exc:
+                return jsonify({"error": str(exc)}), 400
+
+            try:
+                ssh_port = int(data.get("ssh_port", 22))
+            except (ValueError, TypeError):
+                return jsonify({"error": "ssh_port must be an integer"}), 400
+            if not (1 <= ssh_port <= 65535):
+                return jsonify({"error": "ssh_port out of range"}), 400
+
+            if not name or not ip:
+                return jsonify({"error": "hostname and ip are required"}), 400
 
-        private_key = ensure_kangaroo_key()
         target_users = "stefan,radovan,duka,filip,lazar,nikola,petar"
         users = [u.strip() for u in target_users.split(",")] #all_system_users()
 
-        try:
-            configure_users_for_server(name, ip, ssh_port, description, users, private_key)
-        except Exception as exc:
-            return jsonify({"error": str(exc)}), 500
+        with timed_phase("dedup"):
+            job, conflict = submit_registration(name, ip, ssh_port, description, users)
+        if conflict:
+            return jsonify({"error": conflict}), 409
 
-        click.echo(f"\n🦘 Slave '{name}' ({ip}:{ssh_port}) registered and configured for all users.")
-        return jsonify({"status": "ok", "server": name, "ip": ip, "port": ssh_port}), 200
+        status_url = f"/connect/{job['id']}"
+        return (
+            jsonify({"status": "queued", "job": job["id"], "server": name, "ip": ip, "port": ssh_port, "status_url": status_url}),
+            202,
+            {"Location": status_url},
+        )
+
+    # --------------------------------------------------------- /connect/<id>
+    @app.route("/connect/<job_id>")
+    def route_connect_status(job_id: str):
+        """Report the progress of a queued registration."""
+        provided_token = request.args.get("token", "")
+        if not secrets.compare_digest(provided_token, get_or_create_token()):
+            abort(403)
+
+        job = get_registration(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown registration job"}), 404
+        return jsonify(job), 200
+
+    # -------------------------------------------------------------- /metrics
+    @app.route("/metrics")
+    def route_metrics():
+        """Prometheus metrics; the master token is required unless *metrics_localhost* opens it to loopback peers."""
+        local = False
+        if metrics_localhost:
+            # Opt-in only: behind a local reverse proxy every request comes from loopback.
+            try:
+                local = ipaddress.ip_address(request.remote_addr or "").is_loopback
+            except ValueError:
+                pass
+        if not local:
+            auth = request.headers.get("Authorization", "")
+            provided = auth[7:] if auth.startswith("Bearer ") else request.args.get("token", "")
+            if not secrets.compare_digest(provided, get_or_create_token()):
+                abort(403)
+        return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
     return app
 
 
+# ---------------------------------------------------------------------------
+# Production HTTPS server
+# ---------------------------------------------------------------------------
+
+def build_server_ssl_context(tls_cert: Path, tls_key: Path) -> "ssl.SSLContext":  # noqa: F821
+    """Return a server TLS context with session resumption enabled.
+
+    TLS 1.2 clients resume through the server-side session cache or session
+    tickets, TLS 1.3 clients through tickets; returning clients (slaves
+    polling, repeat ``curl`` runs) skip the full handshake.
+    """
+    import ssl
+
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    ctx.options &= ~ssl.OP_NO_TICKET
+    ctx.num_tickets = 2
+    ctx.load_cert_chain(str(tls_cert), str(tls_key))
+    return ctx
+
+
+MAX_REQUEST_BODY = 64 * 1024  # /connect posts a few hundred bytes of JSON
+
+
+def serve_production(
+    app,
+    host: str,
+    port: int,
+    ssl_ctx,
+    threads: int = 16,
+    backlog: int = 128,
+    keepalive: float = 15.0,
+    request_timeout: float = 5.0,
+    max_connections: int = 1024,
+    access_log: bool = True,
+    handle_signals: bool = True,
+) -> None:
+    """Serve *app* over HTTPS until SIGTERM/SIGINT.
+
+    Unlike ``app.run()`` (Werkzeug closes every connection after one
+    response) clients get HTTP/1.1 keep-alive and the listen backlog is
+    configurable. Each connection has its own thread (at most
+    *max_connections*; more are closed on accept) for the TLS handshake, the
+    wait between keep-alive requests (up to *keepalive* seconds) and reading
+    a request, which must arrive within *request_timeout* seconds per read.
+    Only a request that has been read in full takes one of *threads* app
+    slots, so idle or slow clients cannot stall the API. On a signal the
+    server stops accepting and lets in-flight requests finish.
+    """
+    import io
+    import signal
+    import socketserver
+    import ssl
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import unquote
+    from wsgiref.handlers import SimpleHandler
+    from werkzeug.wsgi import LimitedStream
+
+    app_slots = threading.BoundedSemaphore(threads)
+
+    class ResponseHandler(SimpleHandler):
+        os_environ: dict = {}  # don't copy the process environment into every request
+        http_version = "1.1"
+        server_software = "Kangaroo"
+        status_code = 500
+        keep_alive = False
+
+        def close(self) -> None:
+            # BaseHandler.close() discards status and headers; note what we need first.
+            if self.status:
+                self.status_code = int(self.status.split(" ", 1)[0])
+            self.keep_alive = self.headers is not None and "Content-Length" in self.headers
+            super().close()
+
+    class KeepAliveRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        timeout = request_timeout
+        wbufsize = -1  # buffer so headers and a small body leave in one write
+        served = 0
+
+        def handle_one_request(self) -> None:
+            if self.served:
+                self.connection.settimeout(keepalive)  # idle between requests
+            try:
+                self.raw_requestline = self.rfile.readline(65537)
+                self.connection.settimeout(request_timeout)
+            except (TimeoutError, OSError):
+                self.close_connection = True
+                return
+            if not self.raw_requestline:
+                self.close_connection = True
+                return
+            if len(self.raw_requestline) > 65536:
+                self.send_error(414)
+                return
+            if not self.parse_request():
+                return
+            if self.request_version != "HTTP/1.1" or self.server.stopping:
+                self.close_connection = True
+            if "Transfer-Encoding" in self.headers:
+                # Only Content-Length bodies are read; a chunked one must not pass as empty.
+                self.send_error(411, "Send the body with Content-Length")
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                self.send_error(400, "Invalid Content-Length")
+                return
+            if length > MAX_REQUEST_BODY:
+                self.send_error(413)
+                return
+            try:
+                data = self.rfile.read(length)
+            except (TimeoutError, OSError):
+                self.close_connection = True
+                return
+            if len(data) < length:
+                self.close_connection = True
+                return
+            body = LimitedStream(io.BytesIO(data), length)
+
+            handler = ResponseHandler(body, self.wfile, sys.stderr, self._environ(), multithread=True)
+            with app_slots:
+                handler.run(app)
+                self.wfile.flush()
+            self.served += 1
+            if not handler.keep_alive:
+                self.close_connection = True
+            if access_log:
+                self.log_request(handler.status_code)
+
+        def _environ(self) -> dict:
+            path, _, query = self.path.partition("?")
+            environ = {
+                "REQUEST_METHOD": self.command,
+                "SCRIPT_NAME": "",
+                "PATH_INFO": unquote(path, "latin-1"),
+                "QUERY_STRING": query,
+                "SERVER_NAME": host,
+                "SERVER_PORT": str(port),
+                "SERVER_PROTOCOL": self.request_version,
+                "REMOTE_ADDR": self.client_address[0],
+                "REMOTE_PORT": str(self.client_address[1]),
+                "CONTENT_TYPE": self.headers.get("Content-Type", ""),
+                "CONTENT_LENGTH": self.headers.get("Content-Length", ""),
+                "HTTPS": "on",
+            }
+            for key, value in self.headers.items():
+                key = "HTTP_" + key.upper().replace("-", "_")
+                if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+                    environ[key] = f"{environ[key]},{value}" if key in environ else value
+            return environ
+
+    class HTTPSServer(socketserver.TCPServer):
+        address_family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        allow_reuse_address = True
+        request_queue_size = backlog
+        stopping = False
+
+        def __init__(self) -> None:
+            super().__init__((host, port), KeepAliveRequestHandler)
+            self.connection_slots = threading.BoundedSemaphore(max_connections)
+
+        def process_request(self, request, client_address) -> None:
+            if not self.connection_slots.acquire(blocking=False):
+                self.shutdown_request(request)
+                return
+            threading.Thread(
+                target=self._serve_connection, args=(request, client_address), name="kangaroo-http", daemon=True
+            ).start()
+
+        def _serve_connection(self, request, client_address) -> None:
+            try:
+                request.settimeout(request_timeout)
+                # Don't let Nagle hold a response back waiting for a delayed ACK.
+                request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                started = time.perf_counter()
+                request = ssl_ctx.wrap_socket(request, server_side=True)
+                metric_observe("tls_handshakes", (str(request.session_reused).lower(),), time.perf_counter() - started)
+                self.finish_request(request, client_address)
+            except (ssl.SSLError, OSError):
+                pass  # failed handshakes and dropped clients are routine
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.connection_slots.release()
+
+        def server_close(self) -> None:
+            self.stopping = True
+            super().server_close()
+            # Holding every app slot means no request is still in flight.
+            for _ in range(threads):
+                app_slots.acquire()
+
+    server = HTTPSServer()
+
+    def _graceful_stop(signum, frame) -> None:
+        click.echo("\n🦘 Shutting down, finishing in-flight requests...")
+        # shutdown() blocks until serve_forever() returns, so not on this thread.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    if handle_signals:
+        signal.signal(signal.SIGTERM, _graceful_stop)
+        signal.signal(signal.SIGINT, _graceful_stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
 def _build_slave_script(master_ip: str, master_port: int, token: str, cert_pin: str) -> str:
     """Generate the bash script that runs on the slave to self-register."""
     return f"""\
@@ -625,33 +2639,1002 @@ echo "kangaroo user provisioned."
 # 4. Notify master
 # ----------------------------------------------------------------
 echo "Notifying master..."
-curl -fsSL --pinnedpubkey "sha256//{cert_pin}" -X POST \\
+RESPONSE=$(curl -fsSL --pinnedpubkey "sha256//{cert_pin}" -X POST \\
      -H "Content-Type: application/json" \\
      -d "{{\\\"token\\\":\\\"$TOKEN\\\",\\\"hostname\\\":\\\"$HOSTNAME_VAL\\\",\\\"description\\\":\\\"$HOSTNAME_VAL\\\",\\\"ip\\\":\\\"$IP_VAL\\\",\\\"ssh_port\\\":$SSH_PORT}}" \\
-     "https://${{MASTER_IP}}:${{MASTER_PORT}}/connect"
+     "https://${{MASTER_IP}}:${{MASTER_PORT}}/connect")
+echo "$RESPONSE"
+
+# Registration is applied asynchronously; wait (up to ~60s) for the result.
+JOB_ID=$(echo "$RESPONSE" | sed -n 's/.*"job": *"\\([0-9a-f]*\\)".*/\\1/p')
+STATUS="queued"
+for _ in $(seq 1 30); do
+    [ -z "$JOB_ID" ] && break
+    JOB=$(curl -fsSL --pinnedpubkey "sha256//{cert_pin}" "https://${{MASTER_IP}}:${{MASTER_PORT}}/connect/${{JOB_ID}}?token=${{TOKEN}}" || true)
+    STATUS=$(echo "$JOB" | sed -n 's/.*"status": *"\\([a-z]*\\)".*/\\1/p')
+    [ "$STATUS" = "done" ] || [ "$STATUS" = "failed" ] && break
+    sleep 2
+done
+
+if [ "$STATUS" = "failed" ]; then
+    echo "Master failed to register this server: $JOB"
+    exit 1
+fi
 
 echo ""
 echo "=== Done! This server has been registered with the Kangaroo master. ==="
 """
 
 
+# ---------------------------------------------------------------------------
+# Resident daemon
+# ---------------------------------------------------------------------------
+
+# `kangaroo daemon` keeps the scanned user/host state in memory, kept current
+# with inotify, and answers one-line JSON requests on DAEMON_SOCKET. The
+# readers below (get_access_index, iter_ssh_users, get_ssh_user) ask it first
+# and fall back to scanning directly when it is not running. The socket is
+# root-only: answers include every user's hosts. DAEMON_TIMEOUT bounds the
+# connect; the reply may take up to SCAN_TIMEOUT more, the time the daemon
+# may need to re-parse a config that just changed.
+DAEMON_DIR = Path("/run/kangaroo-daemon")
+DAEMON_SOCKET = DAEMON_DIR / "kangaroo.sock"
+DAEMON_TIMEOUT = 2.0
+USE_DAEMON = True  # --no-daemon, and the daemon itself, turn this off
+
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ONLYDIR = 0x01000000
+_IN_WATCH_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+
+
+def daemon_request(op: str, **params):
+    """Send one request to the daemon and return its result; None if it is not answering."""
+    if not USE_DAEMON:
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_TIMEOUT)
+            sock.connect(str(DAEMON_SOCKET))
+            sock.settimeout(DAEMON_TIMEOUT + SCAN_TIMEOUT)
+            sock.sendall(json.dumps({"op": op, **params}).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                reply = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    return reply.get("result") if isinstance(reply, dict) and reply.get("ok") else None
+
+
+def _inotify_init():
+    """Return (libc, fd) for a non-blocking inotify instance, or None where unavailable."""
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    return (libc, fd) if fd >= 0 else None
+
+
+def _read_inotify(fd: int) -> list[tuple[int, int, str]]:
+    """Drain pending events as (watch descriptor, mask, name) without blocking."""
+    import struct
+
+    events = []
+    while True:
+        try:
+            buf = os.read(fd, 65536)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset + 16 <= len(buf):
+            wd, mask, _cookie, length = struct.unpack_from("iIII", buf, offset)
+            name = buf[offset + 16:offset + 16 + length].rstrip(b"\0")
+            events.append((wd, mask, os.fsdecode(name)))
+            offset += 16 + length
+
+
+def run_daemon(rescan: float = 60.0) -> None:
+    """Serve queries on DAEMON_SOCKET until SIGTERM/SIGINT.
+
+    Watched with inotify: /etc (passwd), every login user's home (for a new
+    .ssh), ~/.ssh (for config) and the directories of the files those
+    configs Include. Any relevant event marks the state dirty; pending events
+    are drained before every answer, so a query made right after a change
+    (e.g. by delete-server) already sees it. State older than *rescan*
+    seconds is rebuilt too, because inotify cannot see changes made on
+    another NFS client; that rebuild runs in the background and queries are
+    answered from the last good index until it is done. Rebuilding only
+    re-parses configs that changed. New files matching an Include glob are
+    only seen by the periodic rebuild.
+    """
+    import signal
+    import socketserver
+    import struct
+
+    global USE_DAEMON
+    USE_DAEMON = False  # our own get_access_index() calls must scan
+
+    inotify = _inotify_init()
+    if inotify is None:
+        raise OSError("inotify is not available on this system")
+    libc, inotify_fd = inotify
+
+    lock = threading.Lock()
+    watches: dict[int, tuple[str, str]] = {}  # wd -> (kind, path)
+    included: set[str] = set()  # every file a user's config Includes
+    state = {"index": None, "dirty": True, "refreshed": 0.0, "complete": True, "rescanning": False}
+
+    def watch(kind: str, path: str) -> None:
+        wd = libc.inotify_add_watch(inotify_fd, os.fsencode(path), _IN_WATCH_MASK)
+        if wd >= 0:
+            # inotify returns the same wd for a directory watched twice (an
+            # Include next to the config); the first kind is kept.
+            watches.setdefault(wd, (kind, path))
+        elif os.path.isdir(path):
+            # Out of watches (fs.inotify.max_user_watches): stay correct by
+            # rebuilding before every answer instead.
+            state["complete"] = False
+
+    def install(index: dict, started: float) -> None:
+        """Make *index*, scanned from *started* on, the one answered. Caller holds the lock."""
+        state["index"] = index
+        state["refreshed"] = started
+        for user in index["users"].values():
+            watch("home", user["home"])
+            watch("ssh", os.path.join(user["home"], ".ssh"))
+        for cached in load_access_index()["configs"].values():
+            for name, _sig in cached["includes"]:
+                if name not in included:
+                    included.add(name)
+                    watch("include", os.path.dirname(name))
+
+    def refresh() -> None:
+        started = time.time()
+        state["dirty"] = False
+        install(get_access_index(), started)
+
+    def rescan_in_background() -> None:
+        started = time.time()
+        try:
+            index = get_access_index()
+        except Exception as exc:
+            click.echo(f"Rescan failed: {exc}", err=True)
+            index = None
+        with lock:
+            # A refresh made meanwhile (after a change) is newer than this scan.
+            if index is not None and state["refreshed"] < started:
+                install(index, started)
+            state["rescanning"] = False
+
+    def relevant(kind: str, path: str, mask: int, name: str) -> bool:
+        if mask & _IN_Q_OVERFLOW:
+            return True
+        if (kind, name) in (("etc", "passwd"), ("home", ".ssh"), ("ssh", "config")):
+            return True
+        return os.path.join(path, name) in included
+
+    def current_index() -> dict:
+        with lock:
+            for wd, mask, name in _read_inotify(inotify_fd):
+                kind, path = watches.get(wd, ("", ""))
+                if relevant(kind, path, mask, name):
+                    state["dirty"] = True
+            if state["dirty"] or not state["complete"]:
+                refresh()
+            elif time.time() - state["refreshed"] >= rescan and not state["rescanning"]:
+                state["rescanning"] = True
+                threading.Thread(target=rescan_in_background, name="kangaroo-rescan", daemon=True).start()
+            return state["index"]
+
+    def answer(request: dict, peer_uid: int):
+        if peer_uid != 0:
+            # The socket is mode 0600 in a 0700 directory; this guards against a loosened one.
+            raise PermissionError("only root may query the daemon")
+        op = request.get("op")
+        if op == "ping":
+            return {"pid": os.getpid(), "users": len(current_index()["users"]), "refreshed": state["refreshed"]}
+        if op == "index":
+            return current_index()
+        if op == "user":
+            return {"user": current_index()["users"].get(request.get("username"))}
+        raise ValueError(f"unknown op {op!r}")
+
+    class QueryHandler(socketserver.StreamRequestHandler):
+        timeout = 30
+
+        def handle(self) -> None:
+            creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+            _pid, peer_uid, _gid = struct.unpack("3i", creds)
+            for raw in self.rfile:
+                try:
+                    request = json.loads(raw)
+                    reply = {"ok": True, "result": answer(request, peer_uid)}
+                except (ValueError, KeyError, AttributeError, PermissionError) as exc:
+                    reply = {"ok": False, "error": str(exc)}
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+                self.wfile.flush()
+
+    class QueryServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    if daemon_request("ping") is not None:
+        raise OSError(f"a daemon is already answering on {DAEMON_SOCKET}")
+    DAEMON_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.chown(DAEMON_DIR, 0, 0)
+    os.chmod(DAEMON_DIR, 0o700)  # mkdir() leaves an existing directory's mode alone
+    DAEMON_SOCKET.unlink(missing_ok=True)
+
+    watch("etc", "/etc")
+    with lock:
+        refresh()
+    server = QueryServer(str(DAEMON_SOCKET), QueryHandler)
+    os.chmod(DAEMON_SOCKET, 0o600)
+
+    def _stop(signum, frame) -> None:
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    click.echo(f"🦘 Kangaroo daemon serving {len(state['index']['users'])} users on {DAEMON_SOCKET}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        DAEMON_SOCKET.unlink(missing_ok=True)
+        os.close(inotify_fd)
+
+
+# ---------------------------------------------------------------------------
+# Login log parsing
+# ---------------------------------------------------------------------------
+
+# The three line shapes server/client.sh appends to ssh_login.log:
+#   User: U connected from IP: IP at T
+#   User: U connected to server: S using IP: IP at T
+#   User: U disconnected from server: S using IP: IP at T
+_LOGIN_LINE_RE = re.compile(
+    r"^User: (?P<user>\S+) (?:connected from IP: (?P<login_ip>\S*)"
+    r"|(?P<action>connected to|disconnected from) server: (?P<server>\S+) using IP: (?P<ip>\S*))"
+    r" at (?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)$"
+)
+_LOG_TIME_RE = re.compile(rb" at (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\s*$")
+_LOG_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class LoginEvent(NamedTuple):
+    time: datetime
+    event: str  # "login", "connect" or "disconnect"
+    user: str
+    ip: str
+    server: str | None
+    line: str
+
+    def as_dict(self) -> dict:
+        return {
+            "time": self.time.strftime(_LOG_TIME_FORMAT),
+            "event": self.event,
+            "user": self.user,
+            "ip": self.ip,
+            "server": self.server,
+        }
+
+
+def _log_time(value: str) -> datetime:
+    # Fixed "YYYY-MM-DD HH:MM:SS" layout; fromisoformat is C code and ~10x cheaper than strptime.
+    return datetime.fromisoformat(value)
+
+
+def parse_login_line(line: str) -> LoginEvent | None:
+    """Parse one ssh_login.log line; None for lines in any other shape."""
+    line = line.rstrip("\n")
+    m = _LOGIN_LINE_RE.match(line)
+    if not m:
+        return None
+    try:
+        when = _log_time(m["time"])
+    except ValueError:
+        return None
+    if m["action"] is None:
+        return LoginEvent(when, "login", m["user"], m["login_ip"], None, line)
+    event = "connect" if m["action"] == "connected to" else "disconnect"
+    return LoginEvent(when, event, m["user"], m["ip"], m["server"], line)
+
+
+_AGE_RE = re.compile(r"(\d+)([smhdw])")
+_AGE_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+
+def parse_age(value: str) -> timedelta:
+    """Parse a relative age like 30m, 12h, 7d or 4w."""
+    m = _AGE_RE.fullmatch(value.strip())
+    if not m:
+        raise ValueError(f"'{value}' is not an age like 30m, 12h, 7d")
+    return timedelta(**{_AGE_UNITS[m[2]]: int(m[1])})
+
+
+def parse_time_bound(value: str) -> datetime:
+    """Parse --since/--until: a date, date + time, or a relative age like 30m, 12h, 7d."""
+    value = value.strip()
+    if _AGE_RE.fullmatch(value):
+        return datetime.now().replace(microsecond=0) - parse_age(value)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"'{value}' is not a date (YYYY-MM-DD[ HH:MM[:SS]]) or an age like 30m, 12h, 7d")
+
+
+def _timestamp_from(f, offset: int) -> tuple[int, datetime | None]:
+    """Return (start, time) of the first timestamped line starting at or after *offset*."""
+    if offset:
+        # Back up one byte so a line starting exactly at *offset* is not skipped.
+        f.seek(offset - 1)
+        f.readline()
+    else:
+        f.seek(0)
+    while True:
+        start = f.tell()
+        line = f.readline()
+        if not line:
+            return start, None
+        m = _LOG_TIME_RE.search(line)
+        if m:
+            try:
+                return start, _log_time(m[1].decode())
+            except ValueError:
+                continue
+
+
+def find_log_offset(f, since: datetime) -> int:
+    """Binary-search a binary-mode, time-ordered log for the first line at or after *since*."""
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        _, t = _timestamp_from(f, mid)
+        if t is None or t >= since:
+            hi = mid
+        else:
+            lo = mid + 1
+    return _timestamp_from(f, lo)[0]
+
+
+def iter_login_events(
+    path: Path,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Iterator[LoginEvent]:
+    """Yield parsed events from *path* within [since, until], reading only that range.
+
+    The start is found by binary search on file offsets and reading stops at
+    the first event after *until*, relying on the log being append-ordered.
+    """
+    with open(path, "rb") as f:
+        if since is not None:
+            f.seek(find_log_offset(f, since))
+        for raw in f:
+            event = parse_login_line(raw.decode("utf-8", "replace"))
+            if event is None:
+                continue
+            if until is not None and event.time > until:
+                return
+            yield event
+
+
+def filter_login_events(
+    events: Iterator[LoginEvent],
+    user: str = "",
+    server: str = "",
+    ip: str = "",
+    search: str = "",
+) -> Iterator[LoginEvent]:
+    for event in events:
+        if user and event.user != user:
+            continue
+        if server and event.server != server:
+            continue
+        if ip and event.ip != ip:
+            continue
+        if search and search not in event.line:
+            continue
+        yield event
+
+
+# ---------------------------------------------------------------------------
+# Login log rotation
+# ---------------------------------------------------------------------------
+
+# Rotated history lives next to the live log as gzip segments
+# (ssh_login.log.<rotated-at>.gz). LOGIN_LOG_MANIFEST lists them oldest first
+# with the time of their first and last event, so readers can skip segments
+# outside a query window without opening them.
+
+def load_log_manifest() -> list[dict]:
+    try:
+        data = json.loads(LOGIN_LOG_MANIFEST.read_text())
+    except (OSError, ValueError):
+        return []
+    return data.get("segments", []) if isinstance(data, dict) else []
+
+
+def _save_log_manifest(segments: list[dict]) -> None:
+    atomic_write_text(LOGIN_LOG_MANIFEST, json.dumps({"segments": segments}, indent=2) + "\n", 0o644)
+
+
+def _first_log_time(path: Path) -> datetime | None:
+    with open(path, "rb") as f:
+        return _timestamp_from(f, 0)[1]
+
+
+def _compress_segment(raw_path: Path) -> dict:
+    """Gzip a rotated log file in one streaming pass and return its manifest entry."""
+    import gzip
+
+    segment = raw_path.with_name(raw_path.name + ".gz")
+    tmp = raw_path.with_name(f".{segment.name}.tmp")
+    first = last = None
+    lines = 0
+    with open(raw_path, "rb") as src, gzip.open(tmp, "wb") as dst:
+        for raw in src:
+            dst.write(raw)
+            lines += 1
+            m = _LOG_TIME_RE.search(raw)
+            if m:
+                last = m[1].decode()
+                first = first or last
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, segment)
+    raw_path.unlink()
+    return {
+        "file": segment.name,
+        "first": first,
+        "last": last,
+        "lines": lines,
+        "bytes": segment.stat().st_size,
+    }
+
+
+def rotate_login_log(
+    max_bytes: int = 0,
+    max_age: timedelta | None = None,
+    force: bool = False,
+    keep: int = 0,
+) -> dict | None:
+    """Rotate ssh_login.log into a compressed segment if it is due.
+
+    Due means at least *max_bytes* big, or its first event older than
+    *max_age*, or *force*. The live file is renamed and immediately recreated
+    (mode 0666, as install.sh sets it) so client.sh appends keep working, then
+    the renamed file is compressed. With *keep* only the newest *keep*
+    segments are retained. Returns the new manifest entry, or None.
+    """
+    log_dir = LOGIN_LOG.parent
+    with file_lock(log_dir / ".rotate.lock"):
+        segments = load_log_manifest()
+
+        # Finish rotations interrupted before their segment was compressed.
+        known = {seg["file"] for seg in segments}
+        for leftover in sorted(log_dir.glob(f"{LOGIN_LOG.name}.[0-9]*[0-9]")):
+            if f"{leftover.name}.gz" not in known:
+                segments.append(_compress_segment(leftover))
+
+        entry = None
+        signature = file_signature(LOGIN_LOG)
+        if signature is not None and signature[1] > 0:
+            due = force or (max_bytes and signature[1] >= max_bytes)
+            if not due and max_age is not None:
+                first = _first_log_time(LOGIN_LOG)
+                due = first is not None and first < datetime.now() - max_age
+            if due:
+                stamp = time.strftime("%Y%m%dT%H%M%S")
+                rotated = LOGIN_LOG.with_name(f"{LOGIN_LOG.name}.{stamp}")
+                n = 0
+                while rotated.exists() or rotated.with_name(rotated.name + ".gz").exists():
+                    n += 1
+                    rotated = LOGIN_LOG.with_name(f"{LOGIN_LOG.name}.{stamp}-{n}")
+                os.rename(LOGIN_LOG, rotated)
+                fd = os.open(LOGIN_LOG, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+                os.fchmod(fd, 0o666)
+                os.close(fd)
+                entry = _compress_segment(rotated)
+                segments.append(entry)
+
+        if keep and len(segments) > keep:
+            for seg in segments[:-keep]:
+                (log_dir / seg["file"]).unlink(missing_ok=True)
+            segments = segments[-keep:]
+        _save_log_manifest(segments)
+    return entry
+
+
+def iter_login_history(
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> Iterator[LoginEvent]:
+    """Yield events in [since, until] across rotated segments and the live log, in order.
+
+    Segments whose manifest time range misses the window are skipped without
+    being opened; the others are decompressed lazily, line by line, so memory
+    use does not grow with history.
+    """
+    import gzip
+    import io
+
+    for seg in load_log_manifest():
+        if since is not None and seg.get("last") and _log_time(seg["last"]) < since:
+            continue
+        if until is not None and seg.get("first") and _log_time(seg["first"]) > until:
+            return
+        path = LOGIN_LOG.parent / seg["file"]
+        try:
+            # GzipFile's own readline is slow; a BufferedReader on top halves the cost per line.
+            with io.BufferedReader(gzip.open(path, "rb"), 1 << 16) as f:
+                for raw in f:
+                    event = parse_login_line(raw.decode("utf-8", "replace"))
+                    if event is None or (since is not None and event.time < since):
+                        continue
+                    if until is not None and event.time > until:
+                        return
+                    yield event
+        except FileNotFoundError:
+            continue
+
+    if LOGIN_LOG.is_file():
+        yield from iter_login_events(LOGIN_LOG, since, until)
+
+
+def iter_login_lines(search: str = "") -> Iterator[str]:
+    """Yield raw non-blank lines containing *search*, oldest segment first, then the live log."""
+    import gzip
+    import io
+
+    for seg in load_log_manifest():
+        try:
+            with io.BufferedReader(gzip.open(LOGIN_LOG.parent / seg["file"], "rb"), 1 << 16) as f:
+                for raw in f:
+                    line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                    if line.strip() and search in line:
+                        yield line
+        except FileNotFoundError:
+            continue
+    if LOGIN_LOG.is_file():
+        with open(LOGIN_LOG, "rb") as f:
+            for raw in f:
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                if line.strip() and search in line:
+                    yield line
+
+
+def _reverse_lines(path: Path, block: int = 1 << 16) -> Iterator[bytes]:
+    """Yield the lines of *path* last to first, reading the file backwards in blocks."""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b""
+        while pos > 0:
+            size = min(block, pos)
+            pos -= size
+            f.seek(pos)
+            parts = (f.read(size) + rest).split(b"\n")
+            rest = parts[0]
+            yield from reversed(parts[1:])
+        yield rest
+
+
+def tail_login_lines(count: int, search: str = "") -> list[str]:
+    """Return the last *count* raw lines containing *search*, oldest first.
+
+    The live log is read backwards from its end, then segments newest first,
+    stopping as soon as *count* lines are found: the cost follows what is
+    shown, not the size of the history.
+    """
+    import gzip
+    import io
+    from collections import deque
+
+    found: list[str] = []  # newest first
+    if LOGIN_LOG.is_file():
+        for raw in _reverse_lines(LOGIN_LOG):
+            line = raw.decode("utf-8", "replace").rstrip("\r")
+            if line.strip() and search in line:
+                found.append(line)
+                if len(found) == count:
+                    return found[::-1]
+    for seg in reversed(load_log_manifest()):
+        last: deque[str] = deque(maxlen=count - len(found))
+        try:
+            with io.BufferedReader(gzip.open(LOGIN_LOG.parent / seg["file"], "rb"), 1 << 16) as f:
+                for raw in f:
+                    line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                    if line.strip() and search in line:
+                        last.append(line)
+        except FileNotFoundError:
+            continue
+        found.extend(reversed(last))
+        if len(found) == count:
+            break
+    return found[::-1]
+
+
+def _parse_size(value: str) -> int:
+    m = re.fullmatch(r"(\d+)([KMG]?)B?", value.strip().upper())
+    if not m:
+        raise ValueError(f"'{value}' is not a size like 500K, 100M or 1G")
+    return int(m[1]) * {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}[m[2]]
+
+
+# ---------------------------------------------------------------------------
+# Session analytics
+# ---------------------------------------------------------------------------
+
+SESSION_GROUPS = ("user", "server", "hour")
+
+
+class Session(NamedTuple):
+    user: str
+    ip: str
+    server: str
+    start: datetime
+    end: datetime | None
+    status: str  # "closed", "unclosed" (no disconnect was logged) or "open"
+
+    @property
+    def seconds(self) -> int | None:
+        # Clamped: a clock step back can log the disconnect "before" the connect.
+        return max(0, int((self.end - self.start).total_seconds())) if self.end else None
+
+    def as_dict(self) -> dict:
+        return {
+            "user": self.user,
+            "ip": self.ip,
+            "server": self.server,
+            "start": self.start.strftime(_LOG_TIME_FORMAT),
+            "end": self.end.strftime(_LOG_TIME_FORMAT) if self.end else None,
+            "seconds": self.seconds,
+            "status": self.status,
+        }
+
+
+def pair_sessions(
+    events: Iterable[LoginEvent],
+    max_open: timedelta = timedelta(hours=24),
+    stats: dict | None = None,
+) -> Iterator[Session]:
+    """Match connect/disconnect events into sessions, yielding each as it closes.
+
+    Sessions are keyed by (user, client IP, server); parallel sessions with
+    the same key close oldest first. Only sessions still open are held, and
+    any open longer than *max_open* is given up on and yielded as
+    "unclosed" (client.sh was killed before logging the disconnect), so
+    state stays bounded however long the log is. Sessions still open at the
+    end of *events* are yielded as "open". Disconnects with no matching
+    connect are counted in ``stats["unmatched"]``.
+    """
+    from collections import deque
+
+    if stats is None:
+        stats = {}
+    stats.setdefault("unmatched", 0)
+    opened: dict[tuple[str, str, str], deque[datetime]] = {}
+    sweep_every = max(max_open / 4, timedelta(minutes=1))
+    next_sweep = None
+
+    for event in events:
+        if event.event == "login":
+            continue
+        now = event.time
+        if next_sweep is None or now >= next_sweep:
+            cutoff = now - max_open
+            for key in list(opened):
+                starts = opened[key]
+                while starts and starts[0] < cutoff:
+                    yield Session(*key, starts.popleft(), None, "unclosed")
+                if not starts:
+                    del opened[key]
+            next_sweep = now + sweep_every
+
+        key = (event.user, event.ip, event.server)
+        if event.event == "connect":
+            opened.setdefault(key, deque()).append(now)
+            continue
+        starts = opened.get(key)
+        if not starts:
+            stats["unmatched"] += 1
+            continue
+        yield Session(*key, starts.popleft(), now, "closed")
+        if not starts:
+            del opened[key]
+
+    for key, starts in opened.items():
+        for start in starts:
+            yield Session(*key, start, None, "open")
+
+
+def _percentile(ordered: Sequence[int], fraction: float) -> int:
+    # Nearest-rank percentile of an already sorted sequence.
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def summarize_sessions(
+    sessions: Iterable[Session],
+    groups: Sequence[str] = SESSION_GROUPS,
+) -> dict[str, dict[str, dict]]:
+    """Aggregate sessions per user, server and/or hour of day (by start time).
+
+    Each group key gets its session count, how many were not closed, and
+    total/p50/p95 duration over the closed ones. Durations are kept as
+    4-byte ints, so exact percentiles stay cheap for millions of sessions.
+    """
+    from array import array
+
+    buckets: dict[str, dict[str, dict]] = {g: {} for g in groups}
+    for session in sessions:
+        keys = {"user": session.user, "server": session.server, "hour": f"{session.start.hour:02d}:00"}
+        seconds = session.seconds
+        for group, by_key in buckets.items():
+            bucket = by_key.get(keys[group])
+            if bucket is None:
+                bucket = by_key[keys[group]] = {"sessions": 0, "unclosed": 0, "durations": array("L")}
+            bucket["sessions"] += 1
+            if seconds is None:
+                bucket["unclosed"] += 1
+            else:
+                bucket["durations"].append(seconds)
+
+    summary: dict[str, dict[str, dict]] = {}
+    for group, by_key in buckets.items():
+        summary[group] = {}
+        for key in sorted(by_key):
+            bucket = by_key[key]
+            durations = sorted(bucket["durations"])
+            summary[group][key] = {
+                "sessions": bucket["sessions"],
+                "unclosed": bucket["unclosed"],
+                "total_seconds": sum(durations),
+                "p50_seconds": _percentile(durations, 0.50) if durations else None,
+                "p95_seconds": _percentile(durations, 0.95) if durations else None,
+            }
+    return summary
+
+
+def format_duration(seconds: int | None) -> str:
+    if seconds is None:
+        return "-"
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    return f"{minutes}m{secs:02d}s" if minutes else f"{secs}s"
+
+
+# ---------------------------------------------------------------------------
+# Fleet health
+# ---------------------------------------------------------------------------
+
+# HEALTH_CACHE is a TSV that server/client.sh reads to mark dead hosts in the
+# menu, so it stays trivially parseable from bash: a "# ttl SECONDS" line, a
+# column comment, then one row per server. A row older than the TTL means
+# "unknown", never "down".
+HEALTH_TTL = 300
+HEALTH_FIELDS = ("name", "ip", "port", "status", "checked", "ok", "attempts", "min_ms", "avg_ms", "p95_ms", "error")
+
+
+async def _probe_once(ip: str, port: int, timeout: float) -> float:
+    """TCP-connect to ip:port and read the SSH banner; return the connect time in ms."""
+    import asyncio
+
+    started = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    connect_ms = (time.perf_counter() - started) * 1000
+    try:
+        banner = await asyncio.wait_for(reader.readline(), max(timeout - connect_ms / 1000, 0.01))
+    except ValueError:
+        # readline() gives up on a line longer than the stream limit (64 KiB).
+        raise ConnectionError("no SSH banner (line too long)") from None
+    finally:
+        writer.close()
+    if not banner.startswith(b"SSH-"):
+        raise ConnectionError(f"no SSH banner (got {banner[:32]!r})")
+    return connect_ms
+
+
+async def _probe_server(server: dict, attempts: int, timeout: float, limit) -> dict:
+    import asyncio
+
+    latencies: list[float] = []
+    error = ""
+    async with limit:
+        for _ in range(attempts):
+            try:
+                latencies.append(await _probe_once(server["ip"], server["port"], timeout))
+            except asyncio.TimeoutError:
+                error = f"timed out after {timeout:g}s"
+            except OSError as exc:
+                error = os.strerror(exc.errno) if exc.errno else str(exc)
+    latencies.sort()
+    return {
+        "name": server["name"],
+        "ip": server["ip"],
+        "port": server["port"],
+        "status": "up" if latencies else "down",
+        "checked": int(time.time()),
+        "ok": len(latencies),
+        "attempts": attempts,
+        "min_ms": round(latencies[0], 2) if latencies else None,
+        "avg_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "p95_ms": round(_percentile(latencies, 0.95), 2) if latencies else None,
+        "error": "" if latencies else error,
+    }
+
+
+def probe_servers(servers: Iterable[dict], attempts: int = 3, timeout: float = 3.0, concurrency: int = 128) -> list[dict]:
+    """Probe every server (TCP connect + SSH banner, *attempts* times each) concurrently.
+
+    All hosts share one event loop with at most *concurrency* probes in
+    flight, so a few hundred hosts take roughly attempts x the slowest
+    host rather than the sum of all of them.
+    """
+    import asyncio
+
+    async def run() -> list[dict]:
+        limit = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(_probe_server(server, attempts, timeout, limit) for server in servers))
+
+    return asyncio.run(run())
+
+
+def load_health_cache() -> tuple[int, dict[str, dict]]:
+    """Return (ttl, {name: result}) from HEALTH_CACHE; empty if it is missing or malformed."""
+    ttl, results = HEALTH_TTL, {}
+    try:
+        text = HEALTH_CACHE.read_text()
+    except (OSError, ValueError):
+        return ttl, results
+    try:
+        for line in text.splitlines():
+            if line.startswith("# ttl "):
+                ttl = int(line.split()[2])
+            if not line or line.startswith("#"):
+                continue
+            row = dict(zip(HEALTH_FIELDS, line.split("\t")))
+            for field in ("port", "checked", "ok", "attempts"):
+                row[field] = int(row.get(field) or 0)
+            for field in ("min_ms", "avg_ms", "p95_ms"):
+                row[field] = float(row[field]) if row.get(field) not in (None, "", "-") else None
+            row.setdefault("error", "")
+            results[row["name"]] = row
+    except (ValueError, IndexError):
+        # Same as client.sh, which ignores a cache whose ttl is not a number.
+        return HEALTH_TTL, {}
+    return ttl, results
+
+
+def save_health_cache(results: dict[str, dict], ttl: int) -> None:
+    lines = [f"# ttl {ttl}", "# " + " ".join(HEALTH_FIELDS)]
+    for result in results.values():
+        cells = ("-" if result[f] is None else str(result[f]) for f in HEALTH_FIELDS)
+        lines.append("\t".join(re.sub(r"\s+", " ", cell) for cell in cells))
+    # World-readable: client.sh runs as the jumping user.
+    atomic_write_text(HEALTH_CACHE, "\n".join(lines) + "\n", 0o644)
+
+
 # ---------------------------------------------------------------------------
 # CLI
 # ---------------------------------------------------------------------------
 
+OUTPUT_FORMATS = ("text", "json", "ndjson")
+
+
+def format_option(func):
+    return click.option(
+        "--format",
+        "fmt",
+        type=click.Choice(OUTPUT_FORMATS),
+        default="text",
+        show_default=True,
+        help="json: one array, ndjson: one object per line; both stream as records are read",
+    )(func)
+
+
+def echo_records(records: Iterable[dict], fmt: str) -> int:
+    """Write *records* as a JSON array or as NDJSON, one at a time. Returns the count."""
+    count = 0
+    if fmt == "json":
+        click.echo("[", nl=False)
+    for record in records:
+        if fmt == "json":
+            click.echo(("\n" if not count else ",\n") + json.dumps(record), nl=False)
+        else:
+            click.echo(json.dumps(record))
+        count += 1
+    if fmt == "json":
+        click.echo("\n]" if count else "]")
+    return count
+
+
+def _user_record(user: dict, with_config: bool = False) -> dict:
+    record = {"username": user["username"], "uid": user["uid"], "home": user["home"]}
+    if with_config:
+        record["hosts"] = {host: user["config_map"].get(host, {}) for host in user["hosts"]}
+    else:
+        record["hosts"] = user["hosts"]
+    if "error" in user["config_map"]:
+        record["error"] = user["config_map"]["error"]
+    return record
+
+
 @click.group()
-def cli() -> None:
+@click.option(
+    "--scan-workers",
+    default=SCAN_WORKERS,
+    type=click.IntRange(1, 256),
+    show_default=True,
+    envvar="KANGAROO_SCAN_WORKERS",
+    help="Threads used to read users' SSH configs (raise for NFS homes)",
+)
+@click.option(
+    "--scan-timeout",
+    default=SCAN_TIMEOUT,
+    type=click.FloatRange(0.1),
+    show_default=True,
+    envvar="KANGAROO_SCAN_TIMEOUT",
+    help="Seconds before a single config read is reported as an error (parallel scans only)",
+)
+@click.option(
+    "--no-daemon",
+    is_flag=True,
+    envvar="KANGAROO_NO_DAEMON",
+    help="Scan configs directly even if 'kangaroo daemon' is running",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    envvar="KANGAROO_PROFILE",
+    help="Time subprocesses and phases and print a waterfall to stderr on exit",
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="Also save the profile as a Chrome trace JSON file (implies --profile)",
+)
+@click.pass_context
+def cli(ctx: click.Context, scan_workers: int, scan_timeout: float, no_daemon: bool, profile: bool, trace_file: Path | None) -> None:
     """Kangaroo SSH JumpServer 🦘"""
+    global SCAN_WORKERS, SCAN_TIMEOUT, USE_DAEMON
     require_root()
+    SCAN_WORKERS = scan_workers
+    SCAN_TIMEOUT = scan_timeout
+    USE_DAEMON = not no_daemon
+    if profile or trace_file:
+        start_profiling()
+        # Close callbacks run last-in first-out: the command span ends before the report.
+        ctx.call_on_close(lambda: finish_profiling(trace_file))
+        ctx.with_resource(span(f"kangaroo {ctx.invoked_subcommand}", "command"))
 
 
 # ------------------------------------------------------------------ users
 
 @cli.command("users")
-def cmd_users() -> None:
+@format_option
+def cmd_users(fmt: str) -> None:
     """List all SSH users."""
+    if fmt != "text":
+        echo_records((_user_record(user) for user in iter_ssh_users()), fmt)
+        return
+
     for user in sorted(get_ssh_users(), key=lambda u: u["username"]):
         click.echo(f"User: {user['username']}")
+        if "error" in user["config_map"]:
+            click.echo(f"  [Error: {user['config_map']['error']}]")
         if user["hosts"]:
             click.echo("  Servers:")
             for host in sorted(user["hosts"]):
@@ -664,17 +3647,34 @@ def cmd_users() -> None:
 # ----------------------------------------------------------------- servers
 
 @cli.command("servers")
-def cmd_servers() -> None:
+@click.option("--registered", is_flag=True, help="List the server registry (jump_servers.conf) instead")
+@format_option
+def cmd_servers(registered: bool, fmt: str) -> None:
     """List all hosts and how many users have access."""
+    if registered:
+        _echo_registry(fmt)
+        return
+
     host_hostnames: dict[str, set[str]] = defaultdict(set)
     host_users: dict[str, set[str]] = defaultdict(set)
 
-    for user in get_ssh_users():
+    for user in iter_ssh_users():
         for host in user["hosts"]:
             hostname = user["config_map"].get(host, {}).get("HostName", "(no HostName)")
             host_hostnames[host].add(hostname)
             host_users[host].add(user["username"])
 
+    if fmt != "text":
+        # Every user must be read before a host's list is complete; only the output is streamed.
+        echo_records(
+            (
+                {"host": host, "hostnames": sorted(host_hostnames[host]), "users": sorted(host_users[host])}
+                for host in host_hostnames
+            ),
+            fmt,
+        )
+        return
+
     click.echo("=== Servers ===\n")
     for host in sorted(host_hostnames):
         hostnames = ", ".join(sorted(host_hostnames[host]))
@@ -682,17 +3682,43 @@ def cmd_servers() -> None:
         click.echo(f"{host} ({count} user{'s' if count != 1 else ''}): {hostnames}")
 
 
+def _echo_registry(fmt: str = "text") -> None:
+    records = load_server_registry()["by_name"]
+    host_users = get_access_index()["hosts"]
+
+    if fmt != "text":
+        echo_records(({**r, "users": host_users.get(name, [])} for name, r in records.items()), fmt)
+        return
+
+    click.echo("=== Registered servers ===\n")
+    for name in sorted(records):
+        r = records[name]
+        count = len(host_users.get(name, []))
+        line = f"{name} {r['ip']}:{r['port']} ({count} user{'s' if count != 1 else ''})"
+        if r["registered_at"]:
+            line += f" since {r['registered_at']}"
+        click.echo(f"{line} — {r['description']}" if r["description"] else line)
+
+
 # -------------------------------------------------------------------- user
 
 @cli.command("user")
 @click.argument("username")
-def cmd_user(username: str) -> None:
+@format_option
+def cmd_user(username: str, fmt: str) -> None:
     """Show SSH servers and config for USERNAME."""
-    user = find_user(username, get_ssh_users())
+    user = get_ssh_user(username)
     if not user:
+        if fmt != "text":
+            click.echo(f"User '{username}' not found or has no SSH config.", err=True)
+            raise SystemExit(1)
         click.echo(f"User '{username}' not found or has no SSH config.")
         return
 
+    if fmt != "text":
+        echo_records(({"host": host, **_host_record(user, host)} for host in user["hosts"]), fmt)
+        return
+
     click.echo(f"User: {username}")
     if not user["hosts"]:
         click.echo("  No SSH servers configured.")
@@ -709,17 +3735,38 @@ def cmd_user(username: str) -> None:
         click.echo("")
 
 
+def _host_record(user: dict, host: str) -> dict:
+    config = user["config_map"].get(host, {})
+    return {"error": config["error"]} if "error" in config else {"config": config}
+
+
 # ------------------------------------------------------------------ server
 
 @cli.command("server")
 @click.argument("server_name")
-def cmd_server(server_name: str) -> None:
+@format_option
+def cmd_server(server_name: str, fmt: str) -> None:
     """Show SSH config for SERVER_NAME across all users."""
-    found = False
-    for user in get_ssh_users():
-        if server_name not in user["hosts"]:
-            continue
-        found = True
+    if fmt != "text":
+        echo_records(
+            (
+                {"username": user["username"], **_host_record(user, server_name)}
+                for user in iter_ssh_users()
+                if server_name in user["hosts"]
+            ),
+            fmt,
+        )
+        return
+
+    record = load_server_registry()["by_name"].get(server_name)
+    if record:
+        click.echo(f"Registered: {record['ip']}:{record['port']} {record['description']}".rstrip())
+        click.echo("")
+
+    index = get_access_index()
+    usernames = index["hosts"].get(server_name, [])
+    for username in usernames:
+        user = index["users"][username]
         click.echo(f"User: {user['username']}")
         config = user["config_map"].get(server_name, {})
         if "error" in config:
@@ -729,10 +3776,26 @@ def cmd_server(server_name: str) -> None:
                 click.echo(f"  {k}: {v}")
         click.echo("")
 
-    if not found:
+    if not usernames:
         click.echo(f"No users found with server '{server_name}'.")
 
 
+# ------------------------------------------------------------------ export
+
+@cli.command("export")
+def cmd_export() -> None:
+    """Write the full user -> host -> config matrix as NDJSON, in one pass.
+
+    The registered servers come first, one {"type": "server", ...} line
+    each, followed by one {"type": "user", ...} line per user, printed as
+    soon as that user's config has been read.
+    """
+    for record in load_server_registry()["by_name"].values():
+        click.echo(json.dumps({"type": "server", **record}))
+    for user in iter_ssh_users():
+        click.echo(json.dumps({"type": "user", **_user_record(user, with_config=True)}))
+
+
 # ---------------------------------------------------------- delete-server
 
 @cli.command("delete-server")
@@ -740,7 +3803,7 @@ def cmd_server(server_name: str) -> None:
 @click.argument("server_name")
 def cmd_delete_server(username: str, server_name: str) -> None:
     """Delete SERVER_NAME from USERNAME's SSH config."""
-    user = find_user(username, get_ssh_users())
+    user = get_ssh_user(username)
     if not user:
         click.echo(f"User '{username}' not found or has no SSH config.")
         return
@@ -750,34 +3813,274 @@ def cmd_delete_server(username: str, server_name: str) -> None:
         click.echo(f"No SSH config file found for '{username}'.")
         return
 
-    ok, err = remove_host_block(config_path, server_name)
-    if ok:
+    removed, err = remove_host_block(config_path, server_name, user)
+    if err:
+        click.echo(f"Failed: {err}")
+    elif removed:
         click.echo(f"Removed '{server_name}' from '{username}' SSH config.")
+    elif server_name in user["hosts"]:
+        warn_included([server_name], username)
     else:
-        click.echo(f"Failed: {err}")
+        click.echo(f"'{server_name}' not found in '{username}' SSH config.")
 
 
 # ------------------------------------------------------ delete-server-all
 
 @cli.command("delete-server-all")
 @click.argument("server_name")
-def cmd_delete_server_all(server_name: str) -> None:
+@click.option("--unregister", is_flag=True, help="Also remove it from the server registry")
+def cmd_delete_server_all(server_name: str, unregister: bool) -> None:
     """Delete SERVER_NAME from all users' SSH configs."""
-    removed_any = False
-    for user in get_ssh_users():
+    index = get_access_index()
+    usernames = index["hosts"].get(server_name, [])
+    for username in usernames:
+        user = index["users"][username]
         config_path = Path(user["home"]) / ".ssh" / "config"
         if not config_path.is_file():
             continue
-        ok, err = remove_host_block(config_path, server_name)
-        if ok:
-            click.echo(f"Removed '{server_name}' from '{user['username']}'.")
-            removed_any = True
+        removed, err = remove_host_block(config_path, server_name, user)
+        if err:
+            click.echo(f"Failed for '{username}': {err}")
+        elif removed:
+            click.echo(f"Removed '{server_name}' from '{username}'.")
         else:
-            click.echo(f"Failed for '{user['username']}': {err}")
+            warn_included([server_name], username)
 
-    if not removed_any:
+    if not usernames:
         click.echo(f"No SSH config entries found for '{server_name}'.")
 
+    if unregister and unregister_servers({server_name}):
+        click.echo(f"Unregistered '{server_name}'.")
+
+
+# --------------------------------------------------------- delete-servers
+
+@cli.command("delete-servers")
+@click.argument("server_names", nargs=-1)
+@click.option(
+    "--from-file",
+    "from_file",
+    type=click.File("r"),
+    help="File with server aliases, one per line ('-' for stdin)",
+)
+@click.option("--unregister", is_flag=True, help="Also remove them from the server registry")
+def cmd_delete_servers(server_names: tuple[str, ...], from_file, unregister: bool) -> None:
+    """Delete several SERVER_NAMES from all users' SSH configs in one pass."""
+    names = set(server_names)
+    if from_file:
+        for line in from_file:
+            names.update(line.split("#", 1)[0].split())
+
+    if not names:
+        click.echo("No server names given.", err=True)
+        return
+
+    index = get_access_index()
+    affected = {u for name in names for u in index["hosts"].get(name, [])}
+
+    for username, user in index["users"].items():
+        if username not in affected:
+            continue
+        config_path = Path(user["home"]) / ".ssh" / "config"
+        removed, err = remove_host_blocks(config_path, names, user)
+        if err:
+            click.echo(f"Failed for '{username}': {err}")
+            continue
+        if removed:
+            click.echo(f"Removed {', '.join(removed)} from '{username}'.")
+        warn_included(sorted(names.intersection(user["hosts"]).difference(removed)), username)
+
+    missing = sorted(names - index["hosts"].keys())
+    if missing:
+        click.echo(f"No SSH config entries found for: {', '.join(missing)}.")
+
+    if unregister:
+        unregistered = unregister_servers(names)
+        if unregistered:
+            click.echo(f"Unregistered {', '.join(unregistered)}.")
+
+
+# ------------------------------------------------------------ grant/revoke
+
+def _split_names(value: str) -> list[str]:
+    return list(dict.fromkeys(n.strip() for n in value.split(",") if n.strip()))
+
+
+@cli.command("grant")
+@click.option("--users", "target_users", required=True, help="Comma-separated usernames (or 'all')")
+@click.option("--servers", "target_servers", required=True, help="Comma-separated registered servers (or 'all')")
+@click.option(
+    "--control-persist",
+    default="",
+    help="Multiplex users' connections and keep the master open this long (e.g. 10m)",
+)
+def cmd_grant(target_users: str, target_servers: str, control_persist: str) -> None:
+    """Give USERS access to registered SERVERS, writing each config once."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    registry = load_server_registry()["by_name"]
+    names = list(registry) if target_servers == "all" else _split_names(target_servers)
+    unknown = [name for name in names if name not in registry]
+    if unknown:
+        click.echo(f"Not registered: {', '.join(unknown)}. Add them with add-server first.", err=True)
+        raise SystemExit(1)
+    if not names:
+        click.echo("No servers given.", err=True)
+        raise SystemExit(1)
+
+    try:
+        blocks = host_blocks_for((registry[name] for name in names), control_persist)
+    except ValueError as exc:
+        click.echo(f"Invalid server entry: {exc}", err=True)
+        raise SystemExit(1)
+
+    entries = resolve_entries(all_system_users() if target_users == "all" else _split_names(target_users))
+    key_data = ensure_kangaroo_key().read_bytes()
+
+    def grant(entry: pwd.struct_passwd) -> tuple[list[str], str | None]:
+        try:
+            return grant_user_hosts(entry, blocks, key_data), None
+        except OSError as exc:
+            return [], str(exc)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=KEY_INSTALL_WORKERS) as pool:
+        for entry, (added, err) in zip(entries, pool.map(grant, entries)):
+            if err:
+                failed += 1
+                click.echo(f"Failed for '{entry.pw_name}': {err}")
+            elif added:
+                click.echo(f"Granted {', '.join(added)} to '{entry.pw_name}'.")
+            else:
+                click.echo(f"'{entry.pw_name}' already has access.")
+    if failed:
+        raise SystemExit(1)
+
+
+@cli.command("revoke")
+@click.option("--users", "target_users", required=True, help="Comma-separated usernames (or 'all')")
+@click.option("--servers", "target_servers", required=True, help="Comma-separated server names (or 'all' registered)")
+def cmd_revoke(target_users: str, target_servers: str) -> None:
+    """Remove SERVERS from USERS' SSH configs, writing each config once."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    if target_servers == "all":
+        names = set(load_server_registry()["by_name"])
+    else:
+        names = set(_split_names(target_servers))
+    if not names:
+        click.echo("No servers given.", err=True)
+        raise SystemExit(1)
+
+    index = get_access_index()
+    wanted = set(index["users"]) if target_users == "all" else set(_split_names(target_users))
+    for username in sorted(wanted - index["users"].keys()):
+        click.echo(f"User '{username}' not found. Skipping.")
+    affected = {u for name in names for u in index["hosts"].get(name, [])}
+    users = [user for username, user in index["users"].items() if username in wanted and username in affected]
+
+    def revoke(user: dict) -> tuple[list[str], str | None]:
+        return remove_host_blocks(Path(user["home"]) / ".ssh" / "config", names, user)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=KEY_INSTALL_WORKERS) as pool:
+        for user, (removed, err) in zip(users, pool.map(revoke, users)):
+            if err:
+                failed += 1
+                click.echo(f"Failed for '{user['username']}': {err}")
+            elif removed:
+                click.echo(f"Revoked {', '.join(removed)} from '{user['username']}'.")
+    if not users:
+        click.echo("No matching SSH config entries found.")
+    if failed:
+        raise SystemExit(1)
+
+
+# ------------------------------------------------------------------ sync
+
+@cli.command("sync")
+@click.argument("policy_file", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--apply", "do_apply", is_flag=True, help="Make the changes instead of only printing the plan")
+@click.option("--prune", is_flag=True, help="Also remove registered hosts from users not in the policy")
+@click.option(
+    "--control-persist",
+    default="",
+    help="Multiplex users' connections and keep the master open this long (e.g. 10m)",
+)
+@format_option
+def cmd_sync(policy_file: Path, do_apply: bool, prune: bool, control_persist: str, fmt: str) -> None:
+    """Bring users' SSH configs in line with the access policy in POLICY_FILE."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    registry = load_server_registry()["by_name"]
+    try:
+        policy = load_access_policy(policy_file, registry)
+    except (OSError, ValueError) as exc:
+        click.echo(f"Invalid policy: {exc}", err=True)
+        raise SystemExit(1)
+
+    index = get_access_index()
+    for username in sorted(policy.keys() - index["users"].keys()):
+        click.echo(f"User '{username}' not found. Skipping.", err=True)
+    users = {}
+    for username, user in index["users"].items():
+        if "error" in user["config_map"]:
+            click.echo(f"Skipping '{username}': {user['config_map']['error']}", err=True)
+        else:
+            users[username] = user
+    plan = []
+    for change in plan_access_sync(users, policy, registry, prune):
+        if "error" in change:
+            click.echo(f"Skipping '{change['username']}': {change['error']}", err=True)
+            continue
+        warn_included(change.pop("included"), change["username"])
+        if change["add"] or change["remove"] or change["update"]:
+            plan.append(change)
+
+    if fmt != "text":
+        echo_records(({k: v for k, v in change.items() if k != "home"} for change in plan), fmt)
+    else:
+        for change in plan:
+            marks = (
+                [f"+{n}" for n in change["add"]]
+                + [f"-{n}" for n in change["remove"]]
+                + [f"~{n}" for n in change["update"]]
+            )
+            click.echo(f"{change['username']}: {' '.join(marks)}")
+        click.echo(
+            f"{len(plan)} of {len(index['users'])} user(s) to change: "
+            f"{sum(len(c['add']) for c in plan)} to add, {sum(len(c['remove']) for c in plan)} to remove, "
+            f"{sum(len(c['update']) for c in plan)} to update."
+        )
+    if not do_apply or not plan:
+        return
+
+    try:
+        blocks = host_blocks_for(
+            (registry[n] for n in {n for c in plan for n in c["add"] + c["update"]}), control_persist
+        )
+    except ValueError as exc:
+        click.echo(f"Invalid server entry: {exc}", err=True)
+        raise SystemExit(1)
+    key_data = ensure_kangaroo_key().read_bytes() if any(c["add"] for c in plan) else b""
+
+    def apply(change: dict) -> str | None:
+        try:
+            apply_user_sync(pwd.getpwnam(change["username"]), change, blocks, key_data)
+        except (KeyError, OSError) as exc:
+            return str(exc)
+        return None
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=KEY_INSTALL_WORKERS) as pool:
+        for change, err in zip(plan, pool.map(apply, plan)):
+            if err:
+                failed += 1
+                click.echo(f"Failed for '{change['username']}': {err}", err=True)
+    click.echo(f"Applied changes to {len(plan) - failed} user(s).", err=fmt != "text")
+    if failed:
+        raise SystemExit(1)
+
 
 # ------------------------------------------------------------ add-server
 
@@ -789,6 +4092,11 @@ def cmd_delete_server_all(server_name: str) -> None:
 @click.option("--password", default="", help="SSH password")
 @click.option("--description", default="", help="Human-readable description")
 @click.option("--users", "target_users", default="", help="Comma-separated usernames (or 'all')")
+@click.option(
+    "--control-persist",
+    default="",
+    help="Multiplex users' connections and keep the master open this long (e.g. 10m)",
+)
 def cmd_add_server(
     name: str,
     ip: str,
@@ -797,8 +4105,16 @@ def cmd_add_server(
     password: str,
     description: str,
     target_users: str,
+    control_persist: str,
 ) -> None:
     """Add a new server and configure SSH access for users."""
+    if control_persist:
+        try:
+            _validate_control_persist(control_persist)
+        except ValueError as exc:
+            click.echo(f"Invalid --control-persist: {exc}", err=True)
+            raise SystemExit(1)
+
     # Resolve IP
     if not ip:
         try:
@@ -814,20 +4130,25 @@ def cmd_add_server(
     private_key = ensure_kangaroo_key()
     public_key = Path(f"{private_key}.pub")
 
-    # Deploy key
-    if use_password:
-        if not copy_key_to_remote(password, ssh_user, ip, port, public_key):
-            click.echo("Failed to copy SSH key.")
-            return
-        click.echo("SSH key copied successfully.")
-    else:
-        click.echo("\nAdd this key to remote authorized_keys:\n")
-        click.echo(public_key.read_text())
-        input("Press ENTER when done...")
-
-    # Remote provisioning
-    run_remote_provision(ssh_user, ip, port, private_key)
-    click.echo("Remote configuration complete.")
+    try:
+        # Deploy key
+        with span("deploy key"):
+            if use_password:
+                if not copy_key_to_remote(password, ssh_user, ip, port, public_key):
+                    click.echo("Failed to copy SSH key.")
+                    return
+                click.echo("SSH key copied successfully.")
+            else:
+                click.echo("\nAdd this key to remote authorized_keys:\n")
+                click.echo(public_key.read_text())
+                input("Press ENTER when done...")
+
+        # Remote provisioning
+        with span("remote provision"):
+            run_remote_provision(ssh_user, ip, port, private_key)
+        click.echo("Remote configuration complete.")
+    finally:
+        close_ssh_master(ssh_user, ip, port)
 
     # Resolve local users to configure
     if not target_users:
@@ -838,11 +4159,212 @@ def cmd_add_server(
 
     system_users = all_system_users() if target_users == "all" else [u.strip() for u in target_users.split(",")]
 
-    configure_users_for_server(name, ip, port, description, system_users, private_key)
+    configure_users_for_server(name, ip, port, description, system_users, private_key, control_persist)
 
     click.echo(f"\nServer {name} ({ip}:{port}) added successfully 🦘")
 
 
+# ----------------------------------------------------------- add-servers
+
+INVENTORY_FIELDS = ("name", "ip", "port", "user", "credential", "description")
+
+
+def read_inventory(path: Path) -> list[dict]:
+    """Parse a CSV inventory with the columns in INVENTORY_FIELDS.
+
+    Only ``name`` and ``ip`` are required. ``credential`` says how to reach the
+    host the first time: ``key`` (the kangaroo key is already authorized),
+    ``env:VAR`` or ``file:/path`` (password read from there). Lines starting
+    with ``#`` are ignored. Raises ValueError on the first invalid row.
+    """
+    import csv
+
+    hosts: list[dict] = []
+    seen: set[str] = set()
+    seen_ips: dict[str, str] = {}
+    with open(path, newline="") as f:
+        rows = csv.DictReader(line for line in f if line.strip() and not line.lstrip().startswith("#"))
+        unknown = set(rows.fieldnames or ()) - set(INVENTORY_FIELDS)
+        if unknown:
+            raise ValueError(f"unknown inventory column(s): {', '.join(sorted(unknown))}")
+
+        for lineno, row in enumerate(rows, start=2):
+            try:
+                name = _validate_hostname((row.get("name") or "").strip())
+                ip = _validate_ip((row.get("ip") or "").strip())
+                port = int((row.get("port") or "").strip() or 22)
+                if not 1 <= port <= 65535:
+                    raise ValueError(f"port {port} out of range")
+                description = _validate_text_field((row.get("description") or "").strip(), "description")
+                credential = (row.get("credential") or "key").strip()
+                if credential != "key" and not credential.startswith(("env:", "file:")):
+                    raise ValueError(f"credential must be 'key', 'env:VAR' or 'file:PATH', got '{credential}'")
+            except ValueError as exc:
+                raise ValueError(f"{path}, row {lineno}: {exc}") from None
+
+            if name in seen:
+                raise ValueError(f"{path}, row {lineno}: duplicate server '{name}'")
+            if ip in seen_ips:
+                raise ValueError(f"{path}, row {lineno}: IP '{ip}' already used by '{seen_ips[ip]}'")
+            seen.add(name)
+            seen_ips[ip] = name
+            hosts.append(
+                {
+                    "name": name,
+                    "ip": ip,
+                    "port": port,
+                    "ssh_user": (row.get("user") or "").strip() or "root",
+                    "credential": credential,
+                    "description": description,
+                }
+            )
+    return hosts
+
+
+def _resolve_credential(credential: str) -> str:
+    """Return the password for an inventory credential, or "" for ``key``."""
+    if credential == "key":
+        return ""
+    kind, _, ref = credential.partition(":")
+    if kind == "env":
+        if ref not in os.environ:
+            raise ValueError(f"environment variable {ref} is not set")
+        return os.environ[ref]
+    return Path(ref).read_text().splitlines()[0]
+
+
+def _onboard_remote(host: dict, private_key: Path, timeout: float) -> dict:
+    """Copy the key to and provision one inventory host; never raises."""
+    started = time.monotonic()
+    result = {"name": host["name"], "ip": host["ip"], "ok": False, "error": ""}
+    try:
+        password = _resolve_credential(host["credential"])
+    except (OSError, ValueError, IndexError) as exc:
+        result["error"] = f"credential: {exc}"
+        result["seconds"] = time.monotonic() - started
+        return result
+
+    try:
+        with span(f"onboard {host['name']}"):
+            if password and not copy_key_to_remote(
+                password, host["ssh_user"], host["ip"], host["port"],
+                Path(f"{private_key}.pub"), batch=True, timeout=timeout,
+            ):
+                result["error"] = "failed to copy SSH key"
+            else:
+                run_remote_provision(
+                    host["ssh_user"], host["ip"], host["port"], private_key,
+                    batch=True, timeout=timeout,
+                )
+                result["ok"] = True
+    except subprocess.CalledProcessError as exc:
+        lines = (exc.stderr or "").strip().splitlines()
+        result["error"] = f"provisioning failed (exit {exc.returncode})" + (f": {lines[-1]}" if lines else "")
+    except subprocess.TimeoutExpired:
+        result["error"] = f"timed out after {timeout:g}s"
+    except OSError as exc:
+        result["error"] = str(exc)
+    finally:
+        close_ssh_master(host["ssh_user"], host["ip"], host["port"])
+    result["seconds"] = time.monotonic() - started
+    return result
+
+
+@cli.command("add-servers")
+@click.option(
+    "--from-file",
+    "from_file",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="CSV inventory with columns: " + ",".join(INVENTORY_FIELDS),
+)
+@click.option("--users", "target_users", required=True, help="Comma-separated usernames (or 'all')")
+@click.option("--parallel", default=10, type=click.IntRange(1, 256), show_default=True, help="Hosts provisioned at once")
+@click.option("--timeout", default=300.0, type=click.FloatRange(1), show_default=True, help="Seconds allowed per remote step")
+@click.option(
+    "--control-persist",
+    default="",
+    help="Multiplex users' connections and keep the master open this long (e.g. 10m)",
+)
+def cmd_add_servers(
+    from_file: Path,
+    target_users: str,
+    parallel: int,
+    timeout: float,
+    control_persist: str,
+) -> None:
+    """Onboard every server in an inventory file without prompting.
+
+    Rows whose name or IP is already registered are rejected up front, as
+    for self-registering slaves: re-adding a server would replace its
+    registry record but leave the users' existing Host blocks pointing at
+    the old address.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if control_persist:
+        try:
+            _validate_control_persist(control_persist)
+        except ValueError as exc:
+            click.echo(f"Invalid --control-persist: {exc}", err=True)
+            raise SystemExit(1)
+
+    try:
+        hosts = read_inventory(from_file)
+    except (OSError, ValueError) as exc:
+        click.echo(f"Invalid inventory: {exc}", err=True)
+        raise SystemExit(1)
+    if not hosts:
+        click.echo("Inventory is empty.")
+        return
+
+    results: dict[str, dict] = {}
+    registry = load_server_registry()
+    for host in hosts:
+        conflict = registry_conflict(host["name"], host["ip"], registry)
+        if conflict:
+            results[host["name"]] = {
+                "name": host["name"], "ip": host["ip"], "ok": False, "error": conflict, "seconds": 0.0,
+            }
+            click.echo(f"  {host['name']}: REJECTED: {conflict}")
+    pending = [host for host in hosts if host["name"] not in results]
+
+    private_key = ensure_kangaroo_key()
+    click.echo(f"Provisioning {len(pending)} server(s), {parallel} at a time...")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        futures = [pool.submit(_onboard_remote, host, private_key, timeout) for host in pending]
+        for done, future in enumerate(as_completed(futures), start=1):
+            res = future.result()
+            results[res["name"]] = res
+            status = "ok" if res["ok"] else f"FAILED: {res['error']}"
+            click.echo(f"  [{done}/{len(pending)}] {res['name']}: {status}")
+
+    # Local config writes: one append per user covering every provisioned host.
+    provisioned = [host for host in hosts if results[host["name"]]["ok"]]
+    if provisioned:
+        system_users = (
+            all_system_users() if target_users == "all" else [u.strip() for u in target_users.split(",")]
+        )
+        configure_users_for_servers(provisioned, system_users, private_key, control_persist)
+
+    failed = len(hosts) - len(provisioned)
+    click.echo("\n=== Onboarding report ===")
+    width = max(len(host["name"]) for host in hosts)
+    for host in hosts:
+        res = results[host["name"]]
+        status = "ok" if res["ok"] else "FAILED"
+        line = f"{res['name']:<{width}}  {res['ip']:<15}  {status:<6}  {res['seconds']:7.1f}s"
+        click.echo(f"{line}  {res['error']}" if res["error"] else line)
+    click.echo(
+        f"\n{len(hosts)} server(s): {len(provisioned)} ok, {failed} failed "
+        f"in {time.monotonic() - started:.1f}s 🦘"
+    )
+    if failed:
+        raise SystemExit(1)
+
+
 # --------------------------------------------------------------- connect
 
 def is_port_open(host: str, port: int) -> bool:
@@ -850,8 +4372,6 @@ def is_port_open(host: str, port: int) -> bool:
         sock.settimeout(0.5)
         return sock.connect_ex((host, port)) == 0
 
-import time
-
 def start_master_api_subprocess(port: int) -> None:
     cmd = [
         sys.executable,
@@ -861,12 +4381,13 @@ def start_master_api_subprocess(port: int) -> None:
         str(port),
     ]
 
-    subprocess.Popen(cmd, start_new_session=True)
+    with span("start master api"):
+        subprocess.Popen(cmd, start_new_session=True)
 
-    for _ in range(20):
-        if is_port_open("127.0.0.1", port):
-            return
-        time.sleep(0.25)
+        for _ in range(20):
+            if is_port_open("127.0.0.1", port):
+                return
+            time.sleep(0.25)
 
     click.echo("Failed to start Master API.", err=True)
 
@@ -878,7 +4399,8 @@ def cmd_connect(port: int, ip: str) -> None:
     ensure_kangaroo_key()
     token = get_or_create_token()
     ensure_tls_cert()
-    cert_pin = get_cert_pin(KANGAROO_TLS_CERT)
+    with span("cert pin"):
+        cert_pin = get_cert_pin(KANGAROO_TLS_CERT)
 
     if not is_port_open("127.0.0.1", port):
         click.echo("🦘 Master API not running. Starting in background...")
@@ -910,7 +4432,29 @@ def cmd_connect(port: int, ip: str) -> None:
 @click.option("--port", default=DEFAULT_MASTER_PORT, show_default=True, help="Port to listen on")
 @click.option("--host", default="0.0.0.0", show_default=True, help="Bind address")
 @click.option("--master-ip", "master_ip", default="", help="Public IP to embed in slave scripts")
-def cmd_master_api(port: int, host: str, master_ip: str) -> None:
+@click.option("--threads", default=16, type=click.IntRange(1, 1024), show_default=True, help="Requests handled concurrently")
+@click.option("--backlog", default=128, type=click.IntRange(1), show_default=True, help="Listen queue length")
+@click.option("--keepalive", default=15.0, type=click.FloatRange(0.1), show_default=True, help="Idle keep-alive timeout (seconds)")
+@click.option("--request-timeout", default=5.0, type=click.FloatRange(0.1), show_default=True, help="Timeout for the TLS handshake and each read of a request (seconds)")
+@click.option("--max-connections", default=1024, type=click.IntRange(1), show_default=True, help="Open client connections (more are closed on accept)")
+@click.option(
+    "--metrics-localhost",
+    is_flag=True,
+    help="Serve /metrics to loopback clients without the token (not behind a local reverse proxy)",
+)
+@click.option("--dev", "dev_server", is_flag=True, help="Use the Flask development server instead")
+def cmd_master_api(
+    port: int,
+    host: str,
+    master_ip: str,
+    threads: int,
+    backlog: int,
+    keepalive: float,
+    request_timeout: float,
+    max_connections: int,
+    metrics_localhost: bool,
+    dev_server: bool,
+) -> None:
     """Start the master HTTP API (key distribution + slave registration)."""
     try:
         from flask import Flask  # noqa: F401
@@ -937,28 +4481,55 @@ def cmd_master_api(port: int, host: str, master_ip: str) -> None:
     click.echo(f"   Endpoints:")
     click.echo(f"     GET  /key       — public key (token required)")
     click.echo(f"     GET  /download  — slave setup script (token required)")
-    click.echo(f"     POST /connect   — slave registration (token required)\n")
+    click.echo(f"     POST /connect   — queue slave registration (token required)")
+    click.echo(f"     GET  /connect/<id> — registration status (token required)\n")
 
-    import ssl as _ssl
-    ssl_ctx = _ssl.SSLContext(_ssl.PROTOCOL_TLS_SERVER)
-    ssl_ctx.load_cert_chain(str(tls_cert), str(tls_key))
+    ssl_ctx = build_server_ssl_context(tls_cert, tls_key)
+
+    app = build_flask_app(port, master_ip, cert_pin, metrics_localhost)
+    if dev_server:
+        app.run(host=host, port=port, debug=False, ssl_context=ssl_ctx)
+        return
 
-    app = build_flask_app(port, master_ip, cert_pin)
-    app.run(host=host, port=port, debug=False, ssl_context=ssl_ctx)
+    click.echo(
+        f"   Serving {threads} requests at a time, up to {max_connections} connections, "
+        f"backlog {backlog}, keep-alive {keepalive:g}s\n"
+    )
+    serve_production(
+        app, host, port, ssl_ctx, threads=threads, backlog=backlog, keepalive=keepalive,
+        request_timeout=request_timeout, max_connections=max_connections,
+    )
 
 
 # ---------------------------------------------------------- login-logs
 
 @cli.command("login-logs")
 @click.option("--head", "use_head", is_flag=True, help="Show first lines instead of last")
-@click.option("--lines", default=10, show_default=True, help="Number of lines")
+@click.option("--lines", default=None, type=click.IntRange(1), help="Number of lines [default: 10; all with --since/--until/--user/--server/--ip/--format]")
 @click.option("--follow", is_flag=True, help="Follow log output (like tail -f)")
 @click.option("--search", default="", help="Filter by username, IP, or action")
-def cmd_login_logs(use_head: bool, lines: int, follow: bool, search: str) -> None:
+@click.option("--since", default="", help="Only events at/after this time (YYYY-MM-DD[ HH:MM[:SS]] or 30m/12h/7d)")
+@click.option("--until", default="", help="Only events at/before this time")
+@click.option("--user", "user_filter", default="", help="Only events of this user")
+@click.option("--server", "server_filter", default="", help="Only jumps to/from this server")
+@click.option("--ip", "ip_filter", default="", help="Only events from this client IP")
+@format_option
+def cmd_login_logs(
+    use_head: bool,
+    lines: int | None,
+    follow: bool,
+    search: str,
+    since: str,
+    until: str,
+    user_filter: str,
+    server_filter: str,
+    ip_filter: str,
+    fmt: str,
+) -> None:
     """Show SSH login logs."""
-    log_path = SCRIPT_DIR / "server" / "logs" / "ssh_login.log"
+    log_path = LOGIN_LOG
 
-    if not log_path.is_file():
+    if not log_path.is_file() and not load_log_manifest():
         click.echo("No logs yet.")
         return
 
@@ -966,24 +4537,334 @@ def cmd_login_logs(use_head: bool, lines: int, follow: bool, search: str) -> Non
         click.echo("Cannot use --head and --follow together.", err=True)
         return
 
-    if use_head:
-        cmd = ["head", f"-n{lines}", str(log_path)]
-    else:
-        cmd = ["tail", f"-n{lines}"]
+    if since or until or user_filter or server_filter or ip_filter or fmt != "text":
+        try:
+            since_dt = parse_time_bound(since) if since else None
+            until_dt = parse_time_bound(until) if until else None
+        except ValueError as exc:
+            click.echo(f"Invalid time: {exc}", err=True)
+            raise SystemExit(1)
+        _query_login_logs(
+            log_path, since_dt, until_dt, user_filter, server_filter, ip_filter, search,
+            fmt, lines, use_head, follow,
+        )
+        return
+
+    # Plain listing: raw lines, read only as far as needed to fill --lines.
+    from itertools import islice
+
+    count = lines or 10
+    try:
+        shown = islice(iter_login_lines(search), count) if use_head else tail_login_lines(count, search)
+        for line in shown:
+            click.echo(line)
         if follow:
-            cmd.append("-f")
-        cmd.append(str(log_path))
+            _follow_login_log(log_path, lambda line: search in line)
+    except OSError as exc:
+        click.echo(f"Failed to read log file: {exc}", err=True)
+        raise SystemExit(1)
+
+
+def _query_login_logs(
+    log_path: Path,
+    since: datetime | None,
+    until: datetime | None,
+    user: str,
+    server: str,
+    ip: str,
+    search: str,
+    fmt: str,
+    lines: int | None,
+    use_head: bool,
+    follow: bool,
+) -> None:
+    """Stream matches from rotated segments and the live log; memory stays bounded by --lines, not by the log size."""
+    from collections import deque
+    from itertools import islice
+
+    events = filter_login_events(iter_login_history(since, until), user, server, ip, search)
+    if lines:
+        events = islice(events, lines) if use_head else iter(deque(events, maxlen=lines))
 
     try:
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as proc:
-            for line in proc.stdout:
-                if not search or search in line:
-                    click.echo(line, nl=False)
-            proc.wait()
-            if proc.returncode != 0:
-                click.echo(f"Error reading log: {proc.stderr.read()}", err=True)
+        if fmt != "text":
+            echo_records((event.as_dict() for event in events), fmt)
+            return
+        for event in events:
+            click.echo(event.line)
+        if follow and until is None:
+            _follow_login_log(
+                log_path,
+                lambda line: next(filter_login_events(
+                    filter(None, [parse_login_line(line)]), user, server, ip, search), None) is not None,
+            )
     except OSError as exc:
         click.echo(f"Failed to read log file: {exc}", err=True)
+        raise SystemExit(1)
+
+
+def _follow_login_log(log_path: Path, match: Callable[[str], bool]) -> None:
+    with open(log_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        while True:
+            pos = f.tell()
+            raw = f.readline()
+            if not raw.endswith(b"\n"):
+                f.seek(pos)  # nothing new, or a line still being written
+                time.sleep(0.5)
+                continue
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            if line.strip() and match(line):
+                click.echo(line)
+
+
+# ------------------------------------------------------------------ daemon
+
+@cli.command("daemon")
+@click.option("--rescan", default=60.0, type=click.FloatRange(1), show_default=True, help="Seconds between full rebuilds (catches NFS changes inotify cannot see)")
+def cmd_daemon(rescan: float) -> None:
+    """Keep user/host state in memory and answer queries on a Unix socket."""
+    try:
+        run_daemon(rescan)
+    except OSError as exc:
+        click.echo(f"Cannot start daemon: {exc}", err=True)
+        raise SystemExit(1)
+
+
+# ------------------------------------------------------------------ health
+
+@cli.command("health")
+@click.argument("names", nargs=-1)
+@click.option("--attempts", default=3, type=click.IntRange(1, 50), show_default=True, help="Probes per server")
+@click.option("--timeout", default=3.0, type=click.FloatRange(0.1), show_default=True, help="Seconds per probe")
+@click.option("--concurrency", default=128, type=click.IntRange(1, 4096), show_default=True, help="Probes in flight at once")
+@click.option("--ttl", default=HEALTH_TTL, type=click.IntRange(1), show_default=True, help="Seconds a result stays valid")
+@click.option("--cached", is_flag=True, help="Reuse results younger than the TTL; probe only the rest")
+@format_option
+def cmd_health(
+    names: tuple[str, ...],
+    attempts: int,
+    timeout: float,
+    concurrency: int,
+    ttl: int,
+    cached: bool,
+    fmt: str,
+) -> None:
+    """Probe registered servers (all, or NAMES) and cache the results for the menu.
+
+    Each probe opens a TCP connection and reads the SSH banner. Results are
+    written to server/health.tsv, where server/client.sh marks down hosts.
+    """
+    registry = load_server_registry()["by_name"]
+    unknown = [name for name in names if name not in registry]
+    if unknown:
+        click.echo(f"Not registered: {', '.join(unknown)}", err=True)
+        raise SystemExit(1)
+    servers = [registry[name] for name in names] if names else list(registry.values())
+    if not servers:
+        click.echo("No registered servers.")
+        return
+
+    _, results = load_health_cache()
+    results = {name: r for name, r in results.items() if name in registry}
+    now = time.time()
+    if cached:
+        todo = [s for s in servers if s["name"] not in results or now - results[s["name"]]["checked"] >= ttl]
+    else:
+        todo = servers
+    for result in probe_servers(todo, attempts, timeout, concurrency):
+        results[result["name"]] = result
+    try:
+        save_health_cache(results, ttl)
+    except OSError as exc:
+        click.echo(f"Warning: could not write {HEALTH_CACHE}: {exc}", err=True)
+
+    shown = [results[s["name"]] for s in servers]
+    if fmt != "text":
+        echo_records(shown, fmt)
+        return
+
+    def ms(value: float | None) -> str:
+        return "-" if value is None else f"{value:.1f}ms"
+
+    click.echo(f"{'NAME':<24} {'ADDRESS':<22} {'STATUS':<6} {'OK':>5} {'MIN':>9} {'AVG':>9} {'P95':>9}")
+    for r in shown:
+        line = (
+            f"{r['name']:<24} {r['ip'] + ':' + str(r['port']):<22} {r['status']:<6} {str(r['ok']) + '/' + str(r['attempts']):>5} "
+            f"{ms(r['min_ms']):>9} {ms(r['avg_ms']):>9} {ms(r['p95_ms']):>9}"
+        )
+        click.echo(f"{line}  {r['error']}" if r["error"] else line)
+    down = sum(r["status"] == "down" for r in shown)
+    click.echo(f"\n{len(shown) - down} up, {down} down ({len(todo)} probed).")
+
+
+# -------------------------------------------------------------- rotate-key
+
+@cli.command("rotate-key")
+@click.option("--type", "key_type", type=click.Choice(["rsa", "ed25519"]), default="rsa", show_default=True, help="Type of the new key (ed25519 handshakes faster)")
+@click.option("--parallel", default=16, type=click.IntRange(1, 256), show_default=True, help="Hosts updated concurrently")
+@click.option("--timeout", default=30.0, type=click.FloatRange(1), show_default=True, help="Seconds per SSH command")
+@click.option("--ssh-user", default="root", show_default=True, help="Provisioning login that also holds the key (add-server --user)")
+@click.option("--resume", is_flag=True, help="Continue an interrupted rotation")
+@click.option("--rollback", is_flag=True, help="Undo an unfinished rotation and keep the old key")
+def cmd_rotate_key(key_type: str, parallel: int, timeout: float, ssh_user: str, resume: bool, rollback: bool) -> None:
+    """Replace the shared kangaroo key on all registered hosts and users."""
+    if resume and rollback:
+        click.echo("Use either --resume or --rollback.", err=True)
+        raise SystemExit(1)
+
+    state = load_key_rotation()
+    try:
+        if rollback:
+            if state is None:
+                click.echo("No rotation in progress.")
+                return
+            if not rollback_key_rotation(state, parallel, timeout):
+                click.echo("Some hosts could not be restored; fix them and run --rollback again.", err=True)
+                raise SystemExit(1)
+            click.echo("🦘 Rotation rolled back; the old key is in use everywhere.")
+            return
+
+        if state is not None and not resume:
+            click.echo(
+                f"A rotation started at {state['started']} is unfinished: use --resume or --rollback.",
+                err=True,
+            )
+            raise SystemExit(1)
+        if state is None:
+            if resume:
+                click.echo("No rotation in progress.")
+                return
+            if not load_server_registry()["by_name"]:
+                click.echo("No registered servers.")
+                return
+            state = start_key_rotation(key_type, ssh_user)
+            click.echo(f"Generated a new {key_type} key for {len(state['hosts'])} registered host(s).")
+
+        if not advance_key_rotation(state, parallel, timeout):
+            failed = sorted(n for n, h in state["hosts"].items() if h["error"])
+            click.echo(f"\nRotation paused; failed: {', '.join(failed) or 'none'}.", err=True)
+            click.echo("Fix those hosts (or unregister them) and run --resume, or undo with --rollback.", err=True)
+            raise SystemExit(1)
+    except (OSError, subprocess.CalledProcessError) as exc:
+        click.echo(f"Key rotation failed: {exc}", err=True)
+        raise SystemExit(1)
+    click.echo("🦘 Key rotated on every host and user.")
+
+
+# ---------------------------------------------------------- sessions
+
+@cli.command("sessions")
+@click.option("--since", default="", help="Only sessions starting at/after this time (YYYY-MM-DD[ HH:MM[:SS]] or 30m/12h/7d)")
+@click.option("--until", default="", help="Only events at/before this time")
+@click.option("--user", "user_filter", default="", help="Only sessions of this user")
+@click.option("--server", "server_filter", default="", help="Only sessions on this server")
+@click.option("--ip", "ip_filter", default="", help="Only sessions from this client IP")
+@click.option("--by", "groups", multiple=True, type=click.Choice(SESSION_GROUPS), help="Aggregate per user, server and/or hour of day [default: all]")
+@click.option("--list", "list_sessions", is_flag=True, help="Also print every session with its duration")
+@click.option("--max-open", default="24h", show_default=True, help="Give up on a session with no disconnect after this long")
+@click.option("--format", "fmt", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def cmd_sessions(
+    since: str,
+    until: str,
+    user_filter: str,
+    server_filter: str,
+    ip_filter: str,
+    groups: tuple[str, ...],
+    list_sessions: bool,
+    max_open: str,
+    fmt: str,
+) -> None:
+    """Pair connect/disconnect events into sessions and report durations."""
+    try:
+        since_dt = parse_time_bound(since) if since else None
+        until_dt = parse_time_bound(until) if until else None
+        max_open_td = parse_age(max_open)
+    except ValueError as exc:
+        click.echo(f"Invalid option: {exc}", err=True)
+        raise SystemExit(1)
+
+    groups = tuple(g for g in SESSION_GROUPS if g in groups) if groups else SESSION_GROUPS
+    events = filter_login_events(iter_login_history(since_dt, until_dt), user_filter, server_filter, ip_filter)
+    stats: dict = {}
+    listed = 0
+
+    def emit(sessions: Iterator[Session]) -> Iterator[Session]:
+        # Sessions are printed as they close, so --list streams instead of buffering.
+        nonlocal listed
+        for session in sessions:
+            if list_sessions and fmt == "json":
+                click.echo((",\n    " if listed else "\n    ") + json.dumps(session.as_dict()), nl=False)
+            elif list_sessions:
+                status = "" if session.status == "closed" else f" ({session.status})"
+                end = session.end.strftime(_LOG_TIME_FORMAT) if session.end else "-"
+                click.echo(
+                    f"{session.start.strftime(_LOG_TIME_FORMAT)}  {end:<19}  {format_duration(session.seconds):>8}  "
+                    f"{session.user} -> {session.server} from {session.ip}{status}"
+                )
+            listed += 1
+            yield session
+
+    if fmt == "json":
+        click.echo('{"sessions": [' if list_sessions else "{", nl=False)
+    try:
+        summary = summarize_sessions(emit(pair_sessions(events, max_open_td, stats)), groups)
+    except OSError as exc:
+        click.echo(f"Failed to read log file: {exc}", err=True)
+        raise SystemExit(1)
+
+    if fmt == "json":
+        body = json.dumps({**summary, "unmatched_disconnects": stats["unmatched"]}, indent=2)[1:-1]
+        click.echo(("\n  ],\n" if list_sessions else "\n") + body.strip("\n") + "\n}")
+        return
+
+    if not listed:
+        click.echo("No sessions found.")
+        return
+    if list_sessions:
+        click.echo()
+    for group in groups:
+        click.echo(f"=== Sessions by {group} ===\n")
+        click.echo(f"{group.upper():<24} {'SESSIONS':>8} {'UNCLOSED':>8} {'TOTAL':>10} {'P50':>8} {'P95':>8}")
+        for key, row in summary[group].items():
+            click.echo(
+                f"{key:<24} {row['sessions']:>8} {row['unclosed']:>8} {format_duration(row['total_seconds']):>10} "
+                f"{format_duration(row['p50_seconds']):>8} {format_duration(row['p95_seconds']):>8}"
+            )
+        click.echo()
+    if stats["unmatched"]:
+        click.echo(f"{stats['unmatched']} disconnect(s) had no matching connect (started before the window?).")
+
+
+# ---------------------------------------------------------- rotate-logs
+
+@cli.command("rotate-logs")
+@click.option("--max-size", default="100M", show_default=True, help="Rotate once the log is this big (e.g. 500K, 100M, 1G)")
+@click.option("--max-age", default="", help="Rotate once the oldest entry is older than this (e.g. 7d, 4w)")
+@click.option("--keep", default=0, type=click.IntRange(0), show_default=True, help="Segments to keep (0 = all)")
+@click.option("--force", is_flag=True, help="Rotate now regardless of size and age")
+def cmd_rotate_logs(max_size: str, max_age: str, keep: int, force: bool) -> None:
+    """Rotate ssh_login.log into a compressed segment when it is due."""
+    try:
+        max_bytes = _parse_size(max_size)
+        age = parse_age(max_age) if max_age else None
+    except ValueError as exc:
+        click.echo(f"Invalid option: {exc}", err=True)
+        raise SystemExit(1)
+
+    try:
+        entry = rotate_login_log(max_bytes, age, force, keep)
+    except OSError as exc:
+        click.echo(f"Failed to rotate log: {exc}", err=True)
+        raise SystemExit(1)
+
+    if entry is None:
+        click.echo("Rotation not due.")
+    else:
+        click.echo(
+            f"Rotated {entry['lines']} lines ({entry['first']} — {entry['last']}) "
+            f"into {entry['file']} ({entry['bytes']} bytes)."
+        )
 
 
 if __name__ == "__main__":
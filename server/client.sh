@@ -10,6 +10,7 @@ SCRIPT_PATH="$0"
 SCRIPT_ABS_PATH=$(readlink -f "$SCRIPT_PATH")
 SCRIPT_DIR=$(dirname "$SCRIPT_ABS_PATH")
 LOGFILE="$SCRIPT_DIR/logs/ssh_login.log"
+HEALTH_FILE="$SCRIPT_DIR/health.tsv"
 USER_NAME=$(whoami)
 IP_ADDRESS=$(echo "${SSH_CONNECTION:-127.0.0.1}" | awk '{print $1}')
 DATE_TIME=$(date '+%Y-%m-%d %H:%M:%S')
@@ -31,23 +32,66 @@ fi
 
 # 2. check if user has a config file
 ssh_config="$HOME/.ssh/config"
+menu_file="$HOME/.ssh/kangaroo_menu"
 [[ -f "$ssh_config" ]] || { echo "No servers exist. Contact Administrator."; exit 1; }
 
-# 3. parse the config file
-raw_servers=$(awk '
-    /^Host / { host=$2 } 
-    /^[[:space:]]*HostName / { hostname=$2 } 
-    /^# Description: / { desc=substr($0, index($0,$3)) } 
-    host && hostname && desc {
-        print host "|" hostname "|" desc
-        host=""; hostname=""; desc=""
-    }
-' "$ssh_config" | sort -t '|' -k1,1)
-
-if [[ -z "$raw_servers" ]]; then
-    echo "No servers authorized. Contact Administrator."
-    exit 1
-fi
+# 3. menu rows: cli.py writes the menu whenever it changes the config; rebuild it
+# here (same format: header row, NAME/IP padded to the widest value, byte
+# order) only if the config was edited some other way since.
+build_menu() {
+    local tmp
+    if ! tmp=$(mktemp "$menu_file.XXXXXX" 2>/dev/null); then
+        # ~/.ssh is not writable: keep a private copy for this session instead
+        menu_file=$(mktemp) && tmp=$(mktemp) || exit 1
+    fi
+    # Comments directly above a Host/Match line belong to that block, comments
+    # between options to the block they are in (as in cli.py's tokenizer).
+    awk '
+        function emit() { if (host != "" && hostname != "" && desc != "") print host "\t" hostname "\t" desc }
+        {
+            line = $0; sub(/^[ \t]+/, "", line)
+            if (line == "" || substr(line, 1, 1) == "#") {
+                if (pend == "" && $0 ~ /^# Description: /) { pend = $0; sub(/^# Description:[[:space:]]*/, "", pend) }
+                next
+            }
+            n = split(line, f, /[ \t]*=[ \t]*|[ \t]+/); key = tolower(f[1])
+            if (key == "host" || key == "match") {
+                emit()
+                host = (key == "host" && n > 1) ? f[2] : ""; hostname = ""; desc = pend; pend = ""
+                next
+            }
+            if (desc == "") desc = pend
+            pend = ""
+            if (key == "hostname" && hostname == "") hostname = f[2]
+        }
+        END { if (desc == "") desc = pend; emit() }
+    ' "$ssh_config" | LC_ALL=C sort -t $'\t' -k1,1 | awk -F '\t' '
+        {
+            name[NR]=$1; ip[NR]=$2; desc[NR]=substr($0, length($1) + length($2) + 3)
+            if (length($1) > w1) w1=length($1)
+            if (length($2) > w2) w2=length($2)
+        }
+        END {
+            if (w1 < 4) w1=4
+            if (w2 < 2) w2=2
+            fmt="%-" w1 "s  %-" w2 "s  %s\n"
+            printf fmt, "NAME", "IP", "DESCRIPTION"
+            for (i=1; i<=NR; i++) printf fmt, name[i], ip[i], desc[i]
+        }
+    ' > "$tmp" && mv -f "$tmp" "$menu_file" || rm -f "$tmp"
+}
+
+refresh_menu() {
+    if [[ ! -f "$menu_file" || "$ssh_config" -nt "$menu_file" ]]; then
+        build_menu
+    fi
+    if [[ $(wc -l < "$menu_file") -le 1 ]]; then
+        echo "No servers authorized. Contact Administrator."
+        exit 1
+    fi
+}
+
+refresh_menu
 
 draw_banner() {
     local width=$(tput cols)
@@ -70,29 +114,42 @@ draw_banner() {
 # TODO: mv
 chmod 775 /var/run/tlog > /dev/null 2>&1
 
+# names of hosts found down by the last 'kangaroo health' run still within its TTL
+load_down_hosts() {
+    down_hosts=""
+    [[ -r "$HEALTH_FILE" ]] || return
+    local ttl now
+    ttl=$(awk 'NR == 1 && $1 == "#" && $2 == "ttl" { print $3 }' "$HEALTH_FILE")
+    [[ "$ttl" =~ ^[0-9]+$ ]] || return
+    now=$(date +%s)
+    down_hosts=$(awk -F '\t' -v now="$now" -v ttl="$ttl" -v ORS=' ' \
+        '!/^#/ && $4 == "down" && now - $5 < ttl { print $1 }' "$HEALTH_FILE")
+}
+
 # 4. display menu where user can choose servers
 while true; do
-    term_width=$(tput cols)
-    col1_w=$(( term_width * 25 / 100 ))
-    col2_w=$(( term_width * 25 / 100 ))
-    col3_w=$(( term_width - col1_w - col2_w - 5 ))
-
-    formatted_list=$(echo "$raw_servers" | while IFS="|" read -r name ip desc; do
-        printf "%-${col1_w}s %-${col2_w}s %-${col3_w}s\n" "$name" "$ip" "$desc"
-    done)
-
-    header_row=$(printf "\e[1;37m%-${col1_w}s %-${col2_w}s %-${col3_w}s\e[0m" "NAME" "IP" "DESCRIPTION")
-    full_header="$(draw_banner)\n$header_row\n"
-
-    selection=$(echo "$formatted_list" | \
-        fzf --header "$(echo -e "$full_header")" \
+    refresh_menu
+    load_down_hosts
+
+    selection=$(
+        if [[ -n "$down_hosts" ]]; then
+            awk -v down="$down_hosts" '
+                BEGIN { n = split(down, names, " "); for (i = 1; i <= n; i++) is_down[names[i]] = 1 }
+                NR > 1 && ($1 in is_down) { $0 = $0 "  [DOWN]" }
+                { print }
+            ' "$menu_file"
+        else
+            cat "$menu_file"
+        fi | fzf --header "$(draw_banner)" \
+            --header-lines 1 \
             --layout=reverse \
             --height 100% \
             --border none \
             --no-hscroll \
             --info inline \
             --color="header:bold:blue,prompt:bold:yellow,pointer:bold:red" \
-            --prompt="Search Host > ")
+            --prompt="Search Host > "
+    )
 
     # 5. validate selection
     [[ -z "$selection" ]] && exit 0
@@ -102,7 +159,7 @@ while true; do
         continue
     fi
 
-    if ! echo "$raw_servers" | grep -qF "${server_name}|"; then
+    if ! awk -v name="$server_name" 'NR > 1 && $1 == name { found = 1; exit } END { exit !found }' "$menu_file"; then
         echo "Unauthorized server selection."
         continue
     fi